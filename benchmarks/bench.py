@@ -0,0 +1,418 @@
+"""Benchmarks of the execution magics against stand-in scheduler commands.
+
+The ``fakebin`` directory provides ``sbatch``, ``sacct``, ``squeue``,
+``scancel``, ``srun``, ``salloc`` and ``ssh`` commands (see
+``fakebin/_fakeslurm.py``), put in front of ``PATH``. Each scenario runs
+in a fresh child process, with its own scheduler state directory, and
+reports:
+
+- per-cell overhead: cell wall time not spent by the job itself,
+- detection latency: delay between the job end and its notice by the
+  workload manager (from the execution traces),
+- scheduler calls per job (from the log of the fake commands),
+- maximal number of threads and resident memory of the process.
+
+Usage::
+
+    python benchmarks/bench.py                       # all scenarios
+    python benchmarks/bench.py concurrent --jobs 1,100,1000
+    python benchmarks/bench.py output --output-size 200000000 --json out.json
+
+The package must be installed (or its generated ``__init__.py`` be in the
+``PYTHONPATH``).
+"""
+import os
+import sys
+import json
+import time
+import signal
+import argparse
+import resource
+import tempfile
+import threading
+import contextlib
+import collections
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+FAKEBIN = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fakebin')
+# Scenarios run for each number of jobs
+_PER_JOBS = ('concurrent', 'async')
+
+
+class Sampler(object):
+    """Sample the number of threads and anonymous memory of the process."""
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.threads = 0
+        self.anon = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+
+    @staticmethod
+    def _count_threads():
+        try:
+            return len(os.listdir('/proc/self/task'))
+        except OSError:
+            return threading.active_count()
+
+    @staticmethod
+    def _rss_anon():
+        """Anonymous resident memory in bytes (Linux only)."""
+        try:
+            with open('/proc/self/status') as f:
+                for line in f:
+                    if line.startswith('RssAnon:'):
+                        return int(line.split()[1]) * 1024
+        except (IOError, OSError):
+            pass
+        return 0
+
+    def _run(self):
+        while not self._stop.is_set():
+            # The sampler thread is not counted
+            self.threads = max(self.threads, self._count_threads() - 1)
+            self.anon = max(self.anon, self._rss_anon())
+            self._stop.wait(self.interval)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Kilobytes on Linux, bytes on macOS
+        if sys.platform != 'darwin':
+            maxrss *= 1024
+        return {'threads_max': self.threads,
+                'rss_max_mb': maxrss / 2. ** 20,
+                'anon_max_mb': self.anon / 2. ** 20 or None}
+
+
+def scheduler_calls():
+    """Number of calls of each fake command."""
+    calls = collections.Counter()
+    try:
+        with open(os.path.join(os.environ['FAKE_SLURM_DIR'], 'calls.log')) as f:
+            for line in f:
+                calls[line.split(' ', 1)[0]] += 1
+    except (IOError, OSError):
+        pass
+    return calls
+
+
+def job_times(jobid):
+    """Submission, start and end times of a fake job."""
+    path = os.path.join(os.environ['FAKE_SLURM_DIR'], 'jobs',
+                        '{0}.times'.format(jobid))
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return {}
+
+
+def _stats(values, prefix):
+    """Mean and maximum of a list of durations, in milliseconds."""
+    values = [v for v in values if v is not None]
+    if not values:
+        return {}
+    return {prefix + '_ms': 1e3 * sum(values) / len(values),
+            prefix + '_max_ms': 1e3 * max(values)}
+
+
+def _latencies(mgrs):
+    """Delays between the end of fake jobs and their notice."""
+    latencies = []
+    for mgr in mgrs:
+        end = job_times(getattr(mgr, '_jobid', None)).get('end')
+        notice = mgr.trace.first('end')
+        if end is not None and notice is not None:
+            latencies.append(notice - end)
+    return latencies
+
+
+class Bench(object):
+    """Scenarios, run in the child process."""
+
+    def __init__(self, params):
+        self.params = params
+        import execute_batch_scheduler
+        from IPython.core.interactiveshell import InteractiveShell
+        self.tmp = tempfile.mkdtemp(prefix='ipython-execute-bench-')
+        execute_batch_scheduler._DEFAULT_SLURM_OUTERR_FILE = os.path.join(
+            self.tmp, 'python-execute-slurm.%J')
+        execute_batch_scheduler._DEFAULT_CACHE_DIR = os.path.join(
+            self.tmp, 'cache')
+        self.shell = InteractiveShell.instance()
+        self.shell.extension_manager.load_extension(
+            'execute_batch_scheduler.execute_magic')
+
+    def cell(self, line, cell):
+        """Run a cell magic, its output being discarded."""
+        with open(os.devnull, 'w') as devnull, \
+                contextlib.redirect_stdout(devnull), \
+                contextlib.redirect_stderr(devnull):
+            self.shell.run_cell_magic('execute', line, cell)
+
+    def line(self, magic, line):
+        with open(os.devnull, 'w') as devnull, \
+                contextlib.redirect_stdout(devnull), \
+                contextlib.redirect_stderr(devnull):
+            self.shell.run_line_magic(magic, line)
+
+    def _script(self):
+        run_time = self.params['run_time']
+        return 'sleep {0}\necho done'.format(run_time) if run_time else 'echo done'
+
+    def overhead(self):
+        """Sequential cells waited for in the foreground."""
+        n = self.params['cells']
+        overheads, mgrs = [], []
+        for _ in range(n):
+            start = time.time()
+            self.cell('--wlm slurm --amgr mgr', self._script())
+            wall = time.time() - start
+            mgr = self.shell.user_ns['mgr']
+            t = job_times(mgr._jobid)
+            if 'submit' in t and 'end' in t:
+                overheads.append(wall - (t['end'] - t['submit']))
+            mgrs.append(mgr)
+        result = {'jobs': n}
+        result.update(_stats(overheads, 'overhead'))
+        result.update(_stats(_latencies(mgrs), 'latency'))
+        return result
+
+    def concurrent(self):
+        """Background cells waited for together with ``%jobs --wait``."""
+        n = self.params['jobs']
+        start = time.time()
+        for i in range(n):
+            self.cell('--wlm slurm --bg --amgr mgr{0}'.format(i),
+                      self._script())
+        submitted = time.time()
+        self.line('jobs', '--wait')
+        end = time.time()
+        mgrs = [self.shell.user_ns['mgr{0}'.format(i)] for i in range(n)]
+        last = max(job_times(m._jobid).get('end', end) for m in mgrs)
+        result = {'jobs': n,
+                  'submit_ms': 1e3 * (submitted - start) / n,
+                  'overhead_ms': 1e3 * (submitted - start + end - last) / n,
+                  'done': sum(1 for m in mgrs if m.succeeded)}
+        result.update(_stats(_latencies(mgrs), 'latency'))
+        return result
+
+    def async_api(self):
+        """Backends driven directly through their asynchronous API."""
+        import asyncio
+        from execute_batch_scheduler.backends import SlurmMgr
+        n = self.params['jobs']
+        mgrs = [SlurmMgr([], '/bin/bash', {}) for _ in range(n)]
+
+        async def run_all():
+            # Bounded like the background cells executor
+            asyncio.get_running_loop().set_default_executor(
+                ThreadPoolExecutor(max_workers=8))
+            return await asyncio.gather(*[m.run_async(self._script())
+                                          for m in mgrs])
+
+        start = time.time()
+        asyncio.run(run_all())
+        end = time.time()
+        first = min(job_times(m._jobid).get('submit', start) for m in mgrs)
+        last = max(job_times(m._jobid).get('end', end) for m in mgrs)
+        result = {'jobs': n,
+                  'overhead_ms': 1e3 * (end - start - (last - first)) / n,
+                  'done': sum(1 for m in mgrs if m.succeeded)}
+        result.update(_stats(_latencies(mgrs), 'latency'))
+        return result
+
+    def output(self):
+        """A cell printing a large output, then accesses to its view."""
+        size = self.params['output_size']
+        # Lines of 100 bytes
+        script = "head -c {0} /dev/zero | tr '\\0' x | fold -w 99".format(size)
+        start = time.time()
+        self.cell('--wlm slurm --amgr mgr', script)
+        wall = time.time() - start
+        mgr = self.shell.user_ns['mgr']
+        t = job_times(mgr._jobid)
+        start = time.time()
+        out, _ = mgr.get_output_view()
+        lines = len(out)
+        out[lines // 2]
+        out.tail(10)
+        view = time.time() - start
+        return {'jobs': 1, 'output_mb': out.size / 2. ** 20, 'lines': lines,
+                'overhead_ms': 1e3 * (wall - (t.get('end', 0) -
+                                              t.get('submit', 0))),
+                'view_ms': 1e3 * view}
+
+    def interrupt(self):
+        """A foreground cell interrupted while its job runs."""
+        delay = self.params['queue_delay'] + 1.
+        interrupted = []
+
+        def interrupt():
+            interrupted.append(time.time())
+            os.kill(os.getpid(), signal.SIGINT)
+
+        timer = threading.Timer(delay, interrupt)
+        timer.start()
+        self.cell('--wlm slurm --amgr mgr', 'sleep 60')
+        returned = time.time()
+        mgr = self.shell.user_ns['mgr']
+        # Wait for the fake job to be killed
+        for _ in range(100):
+            t = job_times(mgr._jobid)
+            if 'end' in t:
+                break
+            time.sleep(0.05)
+        state = subprocess.check_output(
+            ['sacct', '-j', str(mgr._jobid), '-P']).decode().strip()
+        return {'jobs': 1, 'state': state.split('|')[-1],
+                'cancel_ms': 1e3 * (returned - interrupted[0]),
+                'killed_ms': 1e3 * (t.get('end', returned) - interrupted[0])}
+
+    def ssh(self):
+        """Sequential SSH cells through a master connection."""
+        n = self.params['cells']
+        walls = []
+        for _ in range(n):
+            start = time.time()
+            self.cell('--wlm ssh --host benchhost', 'true')
+            walls.append(time.time() - start)
+        result = {'jobs': n, 'first_ms': 1e3 * walls[0]}
+        result.update(_stats(walls[1:], 'overhead'))
+        return result
+
+
+SCENARIOS = collections.OrderedDict([
+    ('overhead', Bench.overhead),
+    ('concurrent', Bench.concurrent),
+    ('async', Bench.async_api),
+    ('output', Bench.output),
+    ('interrupt', Bench.interrupt),
+    ('ssh', Bench.ssh),
+])
+
+
+def child(scenario, params):
+    """Run a scenario and print its result as JSON."""
+    bench = Bench(params)
+    sampler = Sampler()
+    sampler.start()
+    start = time.time()
+    result = SCENARIOS[scenario](bench)
+    result['wall_s'] = time.time() - start
+    result.update(sampler.stop())
+    jobs = result['jobs']
+    for cmd, n in scheduler_calls().items():
+        result['{0}_per_job'.format(cmd)] = float(n) / jobs
+    result['scenario'] = scenario
+    sys.stdout.write(json.dumps(result) + '\n')
+
+
+def run(scenario, params):
+    """Run a scenario in a child process."""
+    env = dict(os.environ)
+    env['PATH'] = FAKEBIN + os.pathsep + env.get('PATH', '')
+    env['FAKE_SLURM_DIR'] = tempfile.mkdtemp(prefix='fake-slurm-')
+    for name in ('queue_delay', 'submit_delay', 'query_delay', 'ssh_delay'):
+        env['FAKE_' + name.upper()] = str(params[name])
+    p = subprocess.Popen([sys.executable, os.path.abspath(__file__),
+                          '--child', scenario, json.dumps(params)],
+                         stdout=subprocess.PIPE, env=env)
+    out, _ = p.communicate()
+    lines = out.decode('utf8', 'replace').strip().splitlines()
+    if p.returncode != 0 or not lines:
+        return {'scenario': scenario, 'jobs': params.get('jobs'),
+                'error': 'exit code {0}'.format(p.returncode)}
+    return json.loads(lines[-1])
+
+
+_COLUMNS = [('scenario', '{0:<11}'), ('jobs', '{0:>5}'), ('wall_s', '{0:>8.2f}'),
+            ('overhead_ms', '{0:>11.1f}'), ('latency_ms', '{0:>10.1f}'),
+            ('sbatch_per_job', '{0:>8.2f}'), ('sacct_per_job', '{0:>7.2f}'),
+            ('squeue_per_job', '{0:>8.2f}'), ('ssh_per_job', '{0:>7.2f}'),
+            ('threads_max', '{0:>7}'), ('rss_max_mb', '{0:>8.1f}'),
+            ('anon_max_mb', '{0:>8.1f}')]
+_TITLES = ['scenario', 'jobs', 'wall (s)', 'ovh/cell ms', 'detect ms',
+           'sbatch/j', 'sacct/j', 'squeue/j', 'ssh/j', 'threads', 'RSS MB',
+           'anon MB']
+
+
+def _widths():
+    return [len(fmt.format(0 if 'f' in fmt else '')) for _, fmt in _COLUMNS]
+
+
+def report_header():
+    print(' '.join(t.rjust(w) for t, w in zip(_TITLES, _widths())))
+
+
+def report(result):
+    """Print a row of the results table, then the other values."""
+    cells = []
+    for (key, fmt), w in zip(_COLUMNS, _widths()):
+        value = result.get(key)
+        cells.append('-'.rjust(w) if value is None else fmt.format(value))
+    print(' '.join(cells))
+    extra = dict((k, v) for k, v in result.items()
+                 if k not in dict(_COLUMNS) and not k.endswith('_max_ms'))
+    if extra:
+        print('    ' + ', '.join('{0}={1}'.format(
+            k, round(v, 1) if isinstance(v, float) else v)
+            for k, v in sorted(extra.items())))
+    sys.stdout.flush()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('scenarios', nargs='*', metavar='scenario',
+                        help='Scenarios to run among {0} (default to '
+                        'all)'.format(', '.join(SCENARIOS)))
+    parser.add_argument('--jobs', default='1,100,1000',
+                        help='Comma separated numbers of concurrent jobs')
+    parser.add_argument('--cells', type=int, default=20,
+                        help='Number of sequential cells')
+    parser.add_argument('--run-time', type=float, default=0.,
+                        help='Job run time in seconds')
+    parser.add_argument('--queue-delay', type=float, default=0.5,
+                        help='Time spent by jobs in the queue in seconds')
+    parser.add_argument('--submit-delay', type=float, default=0.,
+                        help='sbatch latency in seconds')
+    parser.add_argument('--query-delay', type=float, default=0.,
+                        help='sacct and squeue latency in seconds')
+    parser.add_argument('--ssh-delay', type=float, default=0.2,
+                        help='ssh connection setup time in seconds')
+    parser.add_argument('--output-size', type=int, default=100 * 2 ** 20,
+                        help='Output size of the large output scenario')
+    parser.add_argument('--json', help='Write the results to a JSON file')
+    args = parser.parse_args(argv)
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error('unknown scenario: ' + ', '.join(sorted(unknown)))
+    params = dict((k, v) for k, v in vars(args).items()
+                  if k not in ('scenarios', 'jobs', 'json'))
+    results = []
+    report_header()
+    for scenario in args.scenarios or SCENARIOS:
+        counts = [None]
+        if scenario in _PER_JOBS:
+            counts = [int(n) for n in args.jobs.split(',')]
+        for n in counts:
+            results.append(run(scenario, dict(params, jobs=n)))
+            report(results[-1])
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=1)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) == 4 and sys.argv[1] == '--child':
+        child(sys.argv[2], json.loads(sys.argv[3]))
+    else:
+        main()
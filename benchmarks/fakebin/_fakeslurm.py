@@ -0,0 +1,555 @@
+"""Stand-in Slurm and SSH commands for the benchmarks.
+
+Jobs are recorded in the ``FAKE_SLURM_DIR`` directory and run by a small
+scheduler daemon, started on demand by ``sbatch`` and exiting once idle.
+The behaviour of the scheduler is read from environment variables when a
+job is submitted:
+
+- ``FAKE_QUEUE_DELAY``: time (in seconds) spent in the PENDING state
+  (default 0).
+- ``FAKE_STATES``: states traversed before RUNNING, as a comma separated
+  list of ``STATE:seconds`` (e.g. ``PENDING:2,CONFIGURING:1``). Overrides
+  ``FAKE_QUEUE_DELAY``.
+- ``FAKE_END_STATE``: forced end state (e.g. ``TIMEOUT``), instead of
+  COMPLETED or FAILED from the script exit code.
+- ``FAKE_SUBMIT_DELAY``: latency of ``sbatch`` and ``salloc``.
+- ``FAKE_QUERY_DELAY``: latency of ``sacct`` and ``squeue``.
+- ``FAKE_ACCT_LAG``: time before a job is known by ``sacct`` (``squeue``
+  knows it at once), and before the usage of its steps is accounted once
+  it is over.
+- ``FAKE_SSH_DELAY``: ``ssh`` connection setup time, saved when going
+  through a master connection.
+- ``FAKE_DAEMON_IDLE``: idle time before the scheduler daemon exits
+  (default 30).
+- ``FAKE_PARTITIONS``: comma separated partitions listed by ``sinfo``
+  (default ``debug``).
+- ``FAKE_PARTITION_START``: start delays (in seconds) estimated by
+  ``sbatch --test-only``, as a comma separated list of ``partition:seconds``
+  (default 0).
+- ``FAKE_TOTAL_CPU``, ``FAKE_MAX_RSS``: CPU time (in seconds) and memory
+  high-water mark (like ``512M``) accounted to the batch step of a job
+  (default 0).
+- ``FAKE_ELAPSED``: accounted run time (in seconds) of a job, instead of
+  the actual one.
+
+``sacct`` reports the ``--format`` fields among ``JobID``, ``State``,
+``Elapsed``, ``TotalCPU``, ``MaxRSS``, ``MaxVMSize``, ``AllocCPUS``,
+``ReqMem`` and ``NNodes``, with the ``batch`` step of the started jobs
+unless ``-X`` is given. ``AllocCPUS`` follows the ``-n`` and ``-c``
+submission options, and ``ReqMem`` the ``--mem`` or ``--mem-per-cpu``
+ones.
+
+Jobs submitted with ``--dependency=afterok:ID[:ID],afterany:ID`` stay
+PENDING until their dependencies are over. With
+``--kill-on-invalid-dep=yes``, they are cancelled when an ``afterok``
+dependency does not complete.
+
+``ssh`` runs the remote commands locally, the reached host being given in
+their ``FAKE_SSH_HOST`` environment variable.
+
+Every command call is appended to ``calls.log`` in the state directory,
+with its timestamp. Job submission, start and end times are written in
+``jobs/<jobid>.times`` (JSON).
+"""
+import os
+import sys
+import json
+import time
+import fcntl
+import signal
+import hashlib
+import tempfile
+import subprocess
+
+DIR = os.environ.get('FAKE_SLURM_DIR') or os.path.join(
+    tempfile.gettempdir(), 'fake-slurm-{0}'.format(os.getuid()))
+JOBS = os.path.join(DIR, 'jobs')
+# Delay between two scans of the daemon
+_TICK = 0.02
+# Idle time (in seconds) before the daemon exits
+_IDLE = float(os.environ.get('FAKE_DAEMON_IDLE') or 30.)
+_END_STATES = ('CANCELLED', 'COMPLETED', 'FAILED', 'NODE_FAIL',
+               'PREEMPTED', 'TIMEOUT')
+
+
+def _env(name, default=0.):
+    return float(os.environ.get(name) or default)
+
+
+def _write(path, data):
+    """Write a file atomically."""
+    tmp = '{0}.{1}.tmp'.format(path, os.getpid())
+    with open(tmp, 'w') as f:
+        f.write(data)
+    os.rename(tmp, path)
+
+
+def _read(path):
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except (IOError, OSError):
+        return None
+
+
+def _setup():
+    if not os.path.isdir(JOBS):
+        os.makedirs(JOBS, exist_ok=True)
+
+
+def log(cmd, args):
+    """Record a command call."""
+    _setup()
+    with open(os.path.join(DIR, 'calls.log'), 'a') as f:
+        f.write('{0} {1:.6f} {2}\n'.format(cmd, time.time(), ' '.join(args)))
+
+
+def _option(args, name, default=None):
+    """Value of a ``--name=value`` option."""
+    for a in args:
+        if a.startswith(name + '='):
+            return a.split('=', 1)[1]
+    return default
+
+
+def get_state(name):
+    return _read(os.path.join(JOBS, name + '.state'))
+
+
+def set_state(name, state):
+    _write(os.path.join(JOBS, name + '.state'), state)
+
+
+def get_times(name):
+    return json.loads(_read(os.path.join(JOBS, name + '.times')) or '{}')
+
+
+def set_time(name, key, t=None):
+    times = get_times(name)
+    times[key] = time.time() if t is None else t
+    _write(os.path.join(JOBS, name + '.times'), json.dumps(times))
+
+
+def _tasks(jobid):
+    """Names of a job or of its array tasks."""
+    tasks = _read(os.path.join(JOBS, str(jobid) + '.tasks'))
+    if tasks:
+        return ['{0}_{1}'.format(jobid, t) for t in tasks.split()]
+    return [str(jobid)]
+
+
+def _short_option(args, short, name, default=None):
+    """Value of a ``-s value``, ``--name value`` or ``--name=value``
+    option, the last one given."""
+    value = default
+    for i, a in enumerate(args[:-1]):
+        if a in (short, name):
+            value = args[i + 1]
+    return _option(args[::-1], name, value)
+
+
+def _usage(args):
+    """Accounted resources of a job."""
+    cpus = int(_short_option(args, '-n', '--ntasks', 1)) * \
+        int(_short_option(args, '-c', '--cpus-per-task', 1))
+    mem = _option(args, '--mem')
+    if mem is None and _option(args, '--mem-per-cpu'):
+        mem = _option(args, '--mem-per-cpu') + 'c'
+    return {'cpus': cpus, 'mem': mem or '0',
+            'cpu_time': _env('FAKE_TOTAL_CPU'),
+            'rss': os.environ.get('FAKE_MAX_RSS') or '0',
+            'elapsed': os.environ.get('FAKE_ELAPSED')}
+
+
+def _duration(seconds):
+    """Slurm duration of seconds."""
+    seconds = int(round(seconds))
+    text = '{0:02d}:{1:02d}:{2:02d}'.format(seconds // 3600 % 24,
+                                             seconds // 60 % 60, seconds % 60)
+    return '{0}-{1}'.format(seconds // 86400, text) if seconds >= 86400 else text
+
+
+def _dependencies(args):
+    """Dependencies of a job, as ``[type, jobid]`` pairs."""
+    deps = []
+    for item in (_option(args, '--dependency') or '').split(','):
+        kind, _, jobids = item.partition(':')
+        deps.extend([kind, j] for j in jobids.split(':') if j)
+    return deps
+
+
+def _states():
+    """States traversed before RUNNING."""
+    spec = os.environ.get('FAKE_STATES')
+    if spec is None:
+        delay = _env('FAKE_QUEUE_DELAY')
+        return [['PENDING', delay]] if delay > 0 else []
+    states = []
+    for item in spec.split(','):
+        state, _, secs = item.partition(':')
+        states.append([state.strip(), float(secs or 0)])
+    return states
+
+
+def _lock():
+    """Lock of the job counter and of the daemon start."""
+    _setup()
+    lock = open(os.path.join(DIR, 'lock'), 'w')
+    fcntl.flock(lock, fcntl.LOCK_EX)
+    return lock
+
+
+def _new_jobid():
+    counter = os.path.join(DIR, 'counter')
+    jobid = int(_read(counter) or 999) + 1
+    _write(counter, str(jobid))
+    return jobid
+
+
+def _ensure_daemon():
+    """Start the scheduler daemon if not running (under the lock)."""
+    try:
+        with open(os.path.join(DIR, 'daemon.lock'), 'w') as f:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except (IOError, OSError):
+        return
+    with open(os.devnull, 'r+') as devnull:
+        subprocess.Popen([sys.executable, '-E', os.path.abspath(__file__)],
+                         stdin=devnull, stdout=devnull, stderr=devnull,
+                         start_new_session=True, close_fds=True)
+
+
+def _partitions():
+    return (os.environ.get('FAKE_PARTITIONS') or 'debug').split(',')
+
+
+def _test_only(args):
+    """Estimate the start time of a job, without submitting it."""
+    partitions = _partitions()
+    partition = _option(args, '--partition')
+    if partition is None and '-p' in args:
+        partition = args[args.index('-p') + 1]
+    partition = partition or partitions[0]
+    if partition not in partitions:
+        sys.stderr.write('sbatch: error: invalid partition specified: '
+                         '{0}\n'.format(partition))
+        return 1
+    delays = dict(d.split(':') for d in
+                  (os.environ.get('FAKE_PARTITION_START') or '').split(',') if d)
+    start = time.localtime(time.time() + float(delays.get(partition, 0)))
+    sys.stderr.write('sbatch: Job 0 to start at {0} using 1 processors on '
+                     'nodes node1 in partition {1}\n'.format(
+                         time.strftime('%Y-%m-%dT%H:%M:%S', start), partition))
+    return 0
+
+
+def sinfo(args):
+    log('sinfo', args)
+    for partition in _partitions():
+        print(partition)
+    return 0
+
+
+def sbatch(args):
+    log('sbatch', args)
+    time.sleep(_env('FAKE_SUBMIT_DELAY'))
+    script = sys.stdin.read()
+    if '--test-only' in args:
+        return _test_only(args)
+    out = _option(args, '--output', 'slurm-%j.out')
+    err = _option(args, '--error', out)
+    array = _option(args, '--array')
+    now = time.time()
+    with _lock():
+        jobid = _new_jobid()
+        path = os.path.join(JOBS, '{0}.sh'.format(jobid))
+        with open(path, 'w') as f:
+            f.write(script)
+        os.chmod(path, 0o755)
+        tasks = [None]
+        if array:
+            first, _, last = array.partition('-')
+            tasks = list(range(int(first), int(last or first) + 1))
+            _write(os.path.join(JOBS, '{0}.tasks'.format(jobid)),
+                   ' '.join(str(t) for t in tasks))
+        for task in tasks:
+            name = str(jobid) if task is None else '{0}_{1}'.format(jobid, task)
+            env = dict(os.environ, SLURM_JOB_ID=str(jobid))
+            files = [out, err]
+            for i, f in enumerate(files):
+                for pattern in ('%J', '%j', '%A'):
+                    f = f.replace(pattern, str(jobid))
+                files[i] = f.replace('%a', str(task))
+            if task is not None:
+                env.update(SLURM_ARRAY_JOB_ID=str(jobid),
+                           SLURM_ARRAY_TASK_ID=str(task))
+            states = _states()
+            job = {'script': path, 'out': files[0], 'err': files[1],
+                   'env': env, 'cwd': os.getcwd(), 'submit': now,
+                   'states': states,
+                   'end_state': os.environ.get('FAKE_END_STATE'),
+                   'dependency': _dependencies(args),
+                   'kill_invalid': _option(args, '--kill-on-invalid-dep') == 'yes',
+                   'acct': now + _env('FAKE_ACCT_LAG'),
+                   'acct_lag': _env('FAKE_ACCT_LAG'),
+                   'usage': _usage(args)}
+            set_state(name, states[0][0] if states else 'PENDING')
+            set_time(name, 'submit', now)
+            _write(os.path.join(JOBS, name + '.job'), json.dumps(job))
+        _ensure_daemon()
+    print('Submitted batch job {0}'.format(jobid))
+    return 0
+
+
+def sacct(args):
+    log('sacct', args)
+    time.sleep(_env('FAKE_QUERY_DELAY'))
+    jobids = _option(args, '--jobs') or args[args.index('-j') + 1]
+    fields = (_option(args, '--format') or 'JobID,State').split(',')
+    sep = '|' if '-P' in args else ' '
+    now = time.time()
+    for jobid in jobids.split(','):
+        for name in _tasks(jobid):
+            job = json.loads(_read(os.path.join(JOBS, name + '.job')) or '{}')
+            state = get_state(name)
+            if state is None or job.get('acct', 0) > now:
+                continue
+            if state == 'CANCELLED':
+                state = 'CANCELLED by {0}'.format(os.getuid())
+            usage = job.get('usage') or _usage([])
+            times = get_times(name)
+            elapsed = 0.
+            if 'start' in times:
+                elapsed = times.get('end', now) - times['start']
+            if usage['elapsed'] is not None:
+                elapsed = float(usage['elapsed'])
+            row = {'JobID': name, 'State': state, 'Elapsed': _duration(elapsed),
+                   'TotalCPU': _duration(usage['cpu_time']), 'MaxRSS': '',
+                   'MaxVMSize': '', 'AllocCPUS': str(usage['cpus']),
+                   'ReqMem': usage['mem'], 'NNodes': '1'}
+            rows = [row]
+            accounted = 'end' not in times or \
+                times['end'] + job.get('acct_lag', 0) <= now
+            if 'start' in times and accounted and '-X' not in args:
+                rows.append(dict(row, JobID=name + '.batch', ReqMem='',
+                                 MaxRSS=usage['rss'], MaxVMSize=usage['rss']))
+            for row in rows:
+                print(sep.join(row.get(f, '') for f in fields))
+    return 0
+
+
+def squeue(args):
+    log('squeue', args)
+    time.sleep(_env('FAKE_QUERY_DELAY'))
+    jobids = args[args.index('-j') + 1] if '-j' in args else ''
+    rc = 0
+    for jobid in jobids.split(','):
+        names = [n for n in _tasks(jobid) if get_state(n) is not None]
+        if not names:
+            sys.stderr.write('slurm_load_jobs error: Invalid job id specified\n')
+            rc = 1
+        for name in names:
+            state = get_state(name)
+            if state in ('PENDING', 'CONFIGURING', 'RUNNING', 'COMPLETING'):
+                print('{0} {1}'.format(name, state))
+    return rc
+
+
+def _kill(name):
+    pid = _read(os.path.join(JOBS, name + '.pid'))
+    if pid:
+        try:
+            os.killpg(int(pid), signal.SIGTERM)
+        except OSError:
+            pass
+
+
+def scancel(args):
+    log('scancel', args)
+    for jobid in args:
+        if jobid.startswith('-'):
+            continue
+        for name in _tasks(jobid):
+            if get_state(name) not in (None, 'COMPLETED', 'FAILED'):
+                set_state(name, 'CANCELLED')
+                _kill(name)
+    return 0
+
+
+def salloc(args):
+    log('salloc', args)
+    time.sleep(_env('FAKE_SUBMIT_DELAY'))
+    with _lock():
+        jobid = _new_jobid()
+    name = str(jobid)
+    set_time(name, 'submit')
+    for state, secs in _states():
+        set_state(name, state)
+        time.sleep(secs)
+    set_state(name, 'RUNNING')
+    set_time(name, 'start')
+    sys.stderr.write('salloc: Granted job allocation {0}\n'.format(jobid))
+    return 0
+
+
+def srun(args):
+    log('srun', args)
+    i = 0
+    while i < len(args) and args[i].startswith('-'):
+        i += 2 if args[i] in ('-n', '-N', '-c', '-t', '-p', '-J', '-w') else 1
+    jobid = _option(args[:i], '--jobid')
+    if jobid is not None and get_state(jobid) != 'RUNNING':
+        sys.stderr.write('srun: error: Unable to confirm allocation for job '
+                         '{0}: Invalid job id specified\n'.format(jobid))
+        return 1
+    out = _option(args[:i], '--output')
+    err = _option(args[:i], '--error', out)
+    stdout = open(out, 'w') if out else None
+    stderr = (stdout if err == out else open(err, 'w')) if err else None
+    p = subprocess.Popen(args[i:], stdout=stdout, stderr=stderr)
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda s, f: p.send_signal(s))
+    rc = p.wait()
+    return rc if rc >= 0 else 128 - rc
+
+
+def _control_path(args, host):
+    for i, a in enumerate(args[:-1]):
+        if a == '-o' and args[i + 1].startswith('ControlPath='):
+            path = args[i + 1].split('=', 1)[1]
+            return path.replace('%C', hashlib.sha1(host.encode()).hexdigest())
+    return None
+
+
+def ssh(args):
+    log('ssh', args)
+    i, opts = 0, []
+    while i < len(args) and args[i].startswith('-'):
+        if args[i] in ('-o', '-p', '-l', '-i', '-F', '-S', '-O'):
+            opts += args[i:i + 2]
+            i += 2
+        else:
+            opts.append(args[i])
+            i += 1
+    host, command = args[i], args[i + 1:]
+    control = _control_path(opts, host)
+    if '-O' in opts:
+        if control and opts[opts.index('-O') + 1] in ('stop', 'exit') \
+                and os.path.exists(control):
+            os.remove(control)
+        return 0
+    if 'ControlMaster=yes' in opts:
+        time.sleep(_env('FAKE_SSH_DELAY'))
+        if control:
+            open(control, 'w').close()
+        return 0
+    if not (control and os.path.exists(control)):
+        time.sleep(_env('FAKE_SSH_DELAY'))
+    env = dict(os.environ, FAKE_SSH_HOST=host)
+    if command:
+        stdin = subprocess.DEVNULL if '-n' in opts else None
+        return subprocess.call(['bash', '-c', ' '.join(command)], stdin=stdin,
+                               env=env)
+    return subprocess.call(['bash', '-s'], env=env)
+
+
+def _start(name, job):
+    """Start the script of a job."""
+    out = open(job['out'], 'w')
+    err = out if job['err'] == job['out'] else open(job['err'], 'w')
+    try:
+        p = subprocess.Popen([job['script']], stdout=out, stderr=err,
+                             stdin=subprocess.DEVNULL, env=job['env'],
+                             cwd=job['cwd'], start_new_session=True)
+    finally:
+        out.close()
+        err.close()
+    _write(os.path.join(JOBS, name + '.pid'), str(p.pid))
+    return p
+
+
+def _blocked(job):
+    """Whether a job waits for its dependencies, and whether one of them
+    can no longer be satisfied."""
+    blocked, invalid = False, False
+    for kind, jobid in job.get('dependency', []):
+        states = [get_state(n) for n in _tasks(jobid)]
+        if any(s not in _END_STATES for s in states):
+            blocked = True
+        elif kind == 'afterok' and any(s != 'COMPLETED' for s in states):
+            invalid = True
+    return blocked, invalid
+
+
+def daemon():
+    """Run the submitted jobs until idle."""
+    lock = open(os.path.join(DIR, 'daemon.lock'), 'w')
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except (IOError, OSError):
+        return
+    known, pending, running = set(), {}, {}
+    idle = time.time()
+    while True:
+        for f in os.listdir(JOBS):
+            if f.endswith('.job') and f[:-4] not in known:
+                known.add(f[:-4])
+                pending[f[:-4]] = json.loads(_read(os.path.join(JOBS, f)))
+        now = time.time()
+        for name, job in list(pending.items()):
+            state = get_state(name)
+            if state == 'CANCELLED':
+                del pending[name]
+                continue
+            blocked, invalid = _blocked(job)
+            if invalid and job['kill_invalid']:
+                del pending[name]
+                set_state(name, 'CANCELLED')
+                set_time(name, 'end')
+                continue
+            if blocked or invalid:
+                # Queue states are traversed once dependencies are over
+                job['submit'] = now
+                continue
+            elapsed, t, current = now - job['submit'], 0., None
+            for st, secs in job['states']:
+                if elapsed < t + secs:
+                    current = st
+                    break
+                t += secs
+            if current is not None:
+                if state != current:
+                    set_state(name, current)
+                continue
+            del pending[name]
+            try:
+                running[name] = (_start(name, job), job)
+            except (IOError, OSError):
+                set_state(name, 'FAILED')
+                set_time(name, 'end')
+                continue
+            set_state(name, 'RUNNING')
+            set_time(name, 'start')
+        for name, (p, job) in list(running.items()):
+            rc = p.poll()
+            if rc is None:
+                continue
+            del running[name]
+            set_time(name, 'end')
+            if get_state(name) != 'CANCELLED':
+                set_state(name, job['end_state'] or (
+                    'COMPLETED' if rc == 0 else 'FAILED'))
+        if pending or running:
+            idle = now
+        elif now - idle > _IDLE:
+            with _lock():
+                # Jobs submitted while exiting start a new daemon
+                if not any(f.endswith('.job') and f[:-4] not in known
+                           for f in os.listdir(JOBS)):
+                    lock.close()
+                    return
+        time.sleep(_TICK)
+
+
+if __name__ == '__main__':
+    daemon()
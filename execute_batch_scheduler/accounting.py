@@ -0,0 +1,240 @@
+"""Resource efficiency of Slurm jobs from ``sacct`` accounting.
+
+List of defined functions:
+
+- :py:func:`job_efficiency` : CPU and memory usage of a job and its steps.
+- :py:func:`is_complete` : Whether the usage of jobs is accounted.
+- :py:func:`summary` : Compact text of job efficiency reports.
+- :py:func:`parse_duration` : Seconds of a Slurm duration.
+- :py:func:`parse_size` : Bytes of a Slurm memory size.
+
+The CPU efficiency of a job is its CPU time over the time its cores were
+allocated (``TotalCPU / (Elapsed * AllocCPUS)``), and its memory
+efficiency is the high-water mark of its steps over the requested
+memory (``max(MaxRSS) / ReqMem``), like ``seff`` reports them. Jobs
+using much less than they request wait longer in the queue and waste
+allocation hours.
+
+The usage of the steps is accounted a few seconds after the job end, so
+that reports are queried again until :py:func:`is_complete`.
+"""
+import collections
+from subprocess import check_output
+
+from IPython.utils import py3compat
+
+#: Accounting fields queried for each job and step
+FIELDS = ('JobID', 'State', 'Elapsed', 'TotalCPU', 'MaxRSS', 'MaxVMSize',
+          'AllocCPUS', 'ReqMem', 'NNodes')
+
+_UNITS = {'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30, 'T': 1 << 40,
+          'P': 1 << 50}
+
+
+def parse_duration(value):
+    """Get the seconds of a Slurm duration.
+
+    Parameters
+    ----------
+    value : str
+        Duration like ``1-02:03:04``, ``02:03:04``, ``03:04.567`` or
+        ``INVALID``.
+
+    Returns
+    -------
+    seconds: float
+        Duration in seconds, None when empty or invalid.
+    """
+    days, _, hms = value.strip().rpartition('-')
+    try:
+        days = int(days or 0)
+        parts = [float(p) for p in hms.split(':')]
+        if days:
+            parts += [0.] * (3 - len(parts))
+        else:
+            parts = [0.] * (3 - len(parts)) + parts
+        hours, minutes, seconds = parts
+    except ValueError:
+        return None
+    return days * 86400. + hours * 3600. + minutes * 60. + seconds
+
+
+def parse_size(value, cpus=1, nodes=1):
+    """Get the bytes of a Slurm memory size.
+
+    Parameters
+    ----------
+    value : str
+        Size like ``512``, ``1234K`` or ``4G``, with a ``c`` (per CPU) or
+        ``n`` (per node) suffix for the ``ReqMem`` of older Slurm versions.
+        Sizes without unit are in kilobytes, ``ReqMem`` in megabytes.
+    cpus : int
+        Allocated CPUs, for a size per CPU.
+    nodes : int
+        Allocated nodes, for a size per node.
+
+    Returns
+    -------
+    size: int
+        Size in bytes, None when empty or invalid.
+    """
+    value = value.strip()
+    factor = 1
+    if value[-1:] in ('c', 'n'):
+        factor = cpus if value[-1] == 'c' else nodes
+        value = value[:-1]
+    unit = _UNITS.get(value[-1:].upper())
+    try:
+        if unit is None:
+            return int(float(value) * _UNITS['K']) * factor
+        return int(float(value[:-1]) * unit) * factor
+    except ValueError:
+        return None
+
+
+def _integer(value):
+    try:
+        return int(value)
+    except ValueError:
+        return None
+
+
+def _ratio(used, available):
+    """Percentage of use, None when unknown."""
+    if used is None or not available:
+        return None
+    return 100. * used / available
+
+
+def job_efficiency(jobid):
+    """Get the CPU and memory usage of a job and its steps.
+
+    Parameters
+    ----------
+    jobid : int or str
+        Slurm job id.
+
+    Returns
+    -------
+    efficiency: collections.OrderedDict
+        Report by job id (``jobid_task`` for each task of a job array),
+        as a dict with the ``state``, ``elapsed`` and ``total_cpu``
+        seconds, ``alloc_cpus``, ``req_mem``, ``max_rss`` and
+        ``max_vmsize`` bytes (the highest among the steps), the
+        ``cpu_efficiency`` and ``mem_efficiency`` percentages (None when
+        unknown) and the usage of every step in ``steps``.
+
+    Raises
+    ------
+    subprocess.CalledProcessError
+        If ``sacct`` fails.
+    """
+    out = check_output(['sacct', '-j', str(jobid), '--format=' + ','.join(FIELDS),
+                        '-n', '-P'])
+    reports = collections.OrderedDict()
+    for line in py3compat.bytes_to_str(out).splitlines():
+        row = dict(zip(FIELDS, line.split('|')))
+        if len(row) != len(FIELDS) or '[' in row['JobID']:
+            # Array tasks not started yet
+            continue
+        name, _, step = row['JobID'].partition('.')
+        cpus = _integer(row['AllocCPUS'])
+        usage = {'elapsed': parse_duration(row['Elapsed']),
+                 'total_cpu': parse_duration(row['TotalCPU']),
+                 'max_rss': parse_size(row['MaxRSS']),
+                 'max_vmsize': parse_size(row['MaxVMSize']),
+                 'alloc_cpus': cpus}
+        if not step:
+            usage.update(state=row['State'], steps=collections.OrderedDict(),
+                         req_mem=parse_size(row['ReqMem'] + (
+                             '' if row['ReqMem'][-1:].isalpha() else 'M'),
+                             cpus or 1, _integer(row['NNodes']) or 1))
+            reports[name] = usage
+        elif name in reports:
+            reports[name]['steps'][step] = usage
+    for report in reports.values():
+        for key in ('max_rss', 'max_vmsize'):
+            sizes = [s[key] for s in report['steps'].values()
+                     if s[key] is not None]
+            if sizes:
+                report[key] = max(sizes)
+        report['cpu_efficiency'] = _ratio(
+            report['total_cpu'],
+            (report['elapsed'] or 0) * (report['alloc_cpus'] or 0))
+        report['mem_efficiency'] = _ratio(report['max_rss'], report['req_mem'])
+    return reports
+
+
+def is_complete(efficiency):
+    """Whether the usage of jobs is accounted.
+
+    Parameters
+    ----------
+    efficiency : dict
+        Reports by job id (see :py:func:`job_efficiency`).
+
+    Returns
+    -------
+    complete: bool
+        False when no job is reported yet or when a job that ran has no
+        step with its CPU time and memory high-water mark.
+    """
+    if not efficiency:
+        return False
+    for report in efficiency.values():
+        if not report['elapsed'] and report['state'].startswith('CANCELLED'):
+            # Cancelled before its start, no step is ever accounted
+            continue
+        if not any(s['total_cpu'] is not None and s['max_rss'] is not None
+                   for s in report['steps'].values()):
+            return False
+    return True
+
+
+def _human(size):
+    """Human readable size."""
+    for unit in 'KMGTP':
+        size /= 1024.
+        if size < 1024 or unit == 'P':
+            return "{0:.1f}{1}".format(size, unit)
+
+
+def _hms(seconds):
+    seconds = int(round(seconds))
+    return "{0}:{1:02d}:{2:02d}".format(seconds // 3600, seconds // 60 % 60,
+                                        seconds % 60)
+
+
+def summary(efficiency):
+    """Get a compact text of job efficiency reports.
+
+    Parameters
+    ----------
+    efficiency : dict
+        Reports by job id (see :py:func:`job_efficiency`).
+
+    Returns
+    -------
+    text: str
+        One line by job, like ``Job 42 COMPLETED: CPU 24.8% of 4 cores
+        for 0:10:00, memory 1.2G of 8.0G (15.0%)``.
+    """
+    lines = []
+    for name, report in efficiency.items():
+        cpu = "CPU n/a" if report['cpu_efficiency'] is None else \
+            "CPU {0:.1f}%".format(report['cpu_efficiency'])
+        if report['alloc_cpus']:
+            cpu += " of {0} cores".format(report['alloc_cpus'])
+        if report['elapsed'] is not None:
+            cpu += " for " + _hms(report['elapsed'])
+        if report['max_rss'] is None:
+            mem = "memory n/a"
+        else:
+            mem = "memory " + _human(report['max_rss'])
+        if report['req_mem']:
+            mem += " of " + _human(report['req_mem'])
+            if report['mem_efficiency'] is not None:
+                mem += " ({0:.1f}%)".format(report['mem_efficiency'])
+        lines.append("Job {0} {1}: {2}, {3}\n".format(
+            name, report['state'], cpu, mem))
+    return ''.join(lines)
@@ -4,8 +4,18 @@ List of defined class:
 
 - :py:class:`BaseMgr` : Abstract class for functionnal specifications
 - :py:class:`BasicMgr` : Simple bash execution (testing purposes). One should use ``%%script bash`` or ``%%bash`` magics instead
+- :py:class:`LocalMgr` : Execute cell content in background on the cores of the local machine.
+- :py:class:`LocalPool` : Bounded pool of local cores shared by all :py:class:`LocalMgr`
 - :py:class:`SSHMgr` : Execute cell content through SSH on a distant machine.
+- :py:class:`SSHMasterPool` : Persistent SSH master connections shared by all :py:class:`SSHMgr`
+- :py:class:`SSHSession` : Persistent remote shell running the cells of an :py:class:`SSHMgr` session
+- :py:class:`SSHFanout` : Concurrent run of an :py:class:`SSHMgr` cell on many hosts
 - :py:class:`SlurmMgr` : Execute cell content as a Slurm job
+- :py:class:`SlurmStatePoller` : Shared Slurm job state cache used by all :py:class:`SlurmMgr`
+- :py:class:`SlurmStartEstimator` : Cached start time estimates of jobs on candidate partitions
+- :py:class:`SlurmBundle` : Client-side queue of cells run as steps of a single Slurm job
+- :py:class:`SlurmJobGraph` : Slurm jobs linked by dependencies, tracked together
+- :py:class:`SlurmAllocation` : Held Slurm allocation in which cells run as job steps
 
     .. inheritance-diagram::
         execute_batch_scheduler.backends
@@ -13,18 +23,177 @@ List of defined class:
 """
 import signal
 import time
+import asyncio
+import functools
 import errno
 import io
 import sys
 import os
 import argparse
-from subprocess import (Popen, PIPE, check_output, check_call)
+import threading
+import tempfile
+import shutil
+import collections
+import itertools
+import re
+import shlex
+import sqlite3
+import datetime
+from concurrent.futures import ThreadPoolExecutor, Future
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from subprocess import (Popen, PIPE, TimeoutExpired, CalledProcessError,
+                        check_output, check_call)
 from abc import ABCMeta, abstractmethod
+from .watch import FileWatcher
+from .streams import (FileFollower, PipeDrainer, Spool, OutputView)
+from .trace import Trace, TraceLog, traced
+from .slurmrest import SlurmRestClient, SlurmRestError, job_description
+from .staging import Stager, StageError
+from .journal import JobJournal
+from . import accounting
 from IPython.utils import py3compat
 from IPython.core.magic_arguments import MagicArgumentParser
 from six import with_metaclass
 
 
+def parse_sweep(spec):
+    """Parse a parameter sweep specification.
+
+    Parameters
+    ----------
+    spec : str
+        Comma separated values (``0.1,0.5,2``) or an inclusive integer
+        range with an optional step (``1-500`` or ``0-100:10``).
+
+    Returns
+    -------
+    values: list of str
+        Parameter values.
+
+    Raises
+    ------
+    ValueError
+        If the range step is 0 or if the sweep has no value.
+    """
+    m = re.match(r'^\s*(-?\d+)-(-?\d+)(?::(\d+))?\s*$', spec)
+    if m:
+        start, stop, step = m.groups()
+        if step is not None and int(step) == 0:
+            raise ValueError("range step must be positive in '{0}'".format(spec))
+        values = [str(v) for v in range(int(start), int(stop) + 1, int(step or 1))]
+    else:
+        values = [v.strip() for v in spec.split(',') if v.strip()]
+    if not values:
+        raise ValueError("no value in '{0}'".format(spec))
+    return values
+
+
+def _split_top(spec):
+    """Split a hostlist on the commas out of brackets."""
+    items, depth, start = [], 0, 0
+    for i, c in enumerate(spec):
+        if c == '[':
+            depth += 1
+        elif c == ']':
+            depth -= 1
+            if depth < 0:
+                raise ValueError("unbalanced brackets in '{0}'".format(spec))
+        elif c == ',' and depth == 0:
+            items.append(spec[start:i])
+            start = i + 1
+    if depth:
+        raise ValueError("unbalanced brackets in '{0}'".format(spec))
+    return [i.strip() for i in items + [spec[start:]] if i.strip()]
+
+
+def expand_hostlist(spec):
+    """Expand a hostlist expression.
+
+    Parameters
+    ----------
+    spec : str
+        Comma separated host names, with bracketed ranges like
+        ``node[001-064,100]`` or ``rack[1-2]-n[1-4]``.
+
+    Returns
+    -------
+    hosts: list of str
+        Host names, duplicates removed.
+
+    Raises
+    ------
+    ValueError
+        If the expression is malformed or has no host.
+    """
+    hosts = []
+    for item in _split_top(spec):
+        m = re.match(r'^([^\[]*)\[([^\]]*)\](.*)$', item)
+        if m is None:
+            hosts.append(item)
+            continue
+        prefix, ranges, rest = m.groups()
+        suffixes = expand_hostlist(rest) if rest else ['']
+        for r in ranges.split(','):
+            bounds = r.strip().split('-')
+            if len(bounds) > 2 or not all(b.isdigit() for b in bounds):
+                raise ValueError("invalid range '{0}' in '{1}'".format(r, spec))
+            width = len(bounds[0])
+            for n in range(int(bounds[0]), int(bounds[-1]) + 1):
+                for suffix in suffixes:
+                    hosts.append('{0}{1:0{2}d}{3}'.format(prefix, n, width,
+                                                         suffix))
+    hosts = list(collections.OrderedDict.fromkeys(hosts))
+    if not hosts:
+        raise ValueError("no host in '{0}'".format(spec))
+    return hosts
+
+
+def fold_hostlist(hosts):
+    """Fold host names into a hostlist expression.
+
+    Host names ending with numbers of the same width are folded into
+    bracketed ranges, like ``node[001-003,007]``.
+
+    Parameters
+    ----------
+    hosts : list of str
+        Host names.
+
+    Returns
+    -------
+    spec: str
+        Hostlist expression.
+    """
+    groups = collections.OrderedDict()
+    for host in hosts:
+        m = re.match(r'^(.*?)(\d+)$', host)
+        if m is None:
+            groups[(host, None)] = None
+        else:
+            key = (m.group(1), len(m.group(2)))
+            groups.setdefault(key, []).append(int(m.group(2)))
+    items = []
+    for (prefix, width), numbers in groups.items():
+        if numbers is None:
+            items.append(prefix)
+            continue
+        numbers = sorted(set(numbers))
+        ranges, start = [], numbers[0]
+        for prev, n in zip(numbers, numbers[1:] + [None]):
+            if n is not None and n == prev + 1:
+                continue
+            if prev == start:
+                ranges.append('{0:0{1}d}'.format(start, width))
+            else:
+                ranges.append('{0:0{2}d}-{1:0{2}d}'.format(start, prev, width))
+            start = n
+        if len(numbers) == 1:
+            items.append('{0}{1}'.format(prefix, ranges[0]))
+        else:
+            items.append('{0}[{1}]'.format(prefix, ','.join(ranges)))
+    return ','.join(items)
+
+
 class BaseMgr(with_metaclass(ABCMeta, object)):
     """Abstract base class for description of workload manager interface.
 
@@ -32,10 +201,27 @@ class BaseMgr(with_metaclass(ABCMeta, object)):
     a cell, how to monitor job progression and how to get output from
     execution.
 
+    Execution phases are recorded in the ``trace`` attribute (see
+    :py:mod:`~execute_batch_scheduler.trace`).
+
+    Asynchronous counterparts :py:meth:`submit_async`,
+    :py:meth:`wait_async` and :py:meth:`output_async` allow to run many
+    cells concurrently from a single thread::
+
+        mgrs = [SlurmMgr(['-n', '4'], '/bin/bash', {}) for c in cells]
+        outputs = await asyncio.gather(
+            *[m.run_async(c) for m, c in zip(mgrs, cells)])
+
     """
 
     # Main Popen command to submit cell content.
     _wlbin = None
+    # Shells accepting POSIX shell syntax in scripts
+    _posix_shells = ('sh', 'bash', 'dash', 'ksh', 'zsh')
+    # Execution traces of the session
+    _traces = TraceLog()
+    # Delay in seconds between two checks of the cell process by wait_async
+    _async_poll = 0.1
 
     @abstractmethod
     def __init__(self, args, shell, userns):
@@ -56,9 +242,14 @@ class BaseMgr(with_metaclass(ABCMeta, object)):
         self._waiting_steps = 0
         self._running_steps = 0
         self.shebang = ("#!{0} \n".format(shell)).encode('utf8', 'replace')
+        self._shell = shell
         # Cell output
         self.out, self.err = None, None
         self._userns = userns
+        # Directory of the objects exchanged with the job
+        self._data_dir = None
+        # Timestamped phases of the execution
+        self.trace = self._traces.new(type(self).__name__)
 
     @abstractmethod
     def submit(self, content):
@@ -93,6 +284,177 @@ class BaseMgr(with_metaclass(ABCMeta, object)):
         """
         return None, None
 
+    def get_full_output(self):
+        """Get the whole job output and error, including the parts already
+        displayed while the job ran.
+
+        Default implementation returns :py:meth:`get_output`.
+        """
+        return self.get_output()
+
+    def get_output_view(self, full=False):
+        """Get views of the job output and error.
+
+        Unlike :py:meth:`get_output`, data is only read when accessed
+        (see :py:class:`~execute_batch_scheduler.streams.OutputView`).
+
+        Default implementation wraps :py:meth:`get_output` (or
+        :py:meth:`get_full_output`) in memory.
+
+        Parameters
+        ----------
+        full : bool (default=False)
+            Include the parts already displayed while the job ran.
+
+        Returns
+        -------
+        stdout: :py:class:`~execute_batch_scheduler.streams.OutputView`
+            Job standard output
+        stderr: :py:class:`~execute_batch_scheduler.streams.OutputView`
+            Job standard errput
+        """
+        output = self.get_full_output() if full else self.get_output()
+        return tuple(OutputView((o or '').encode('utf8', 'replace'))
+                     for o in (output or (None, None)))
+
+    def cancel(self):
+        """Cancel the job.
+
+        Default implementation interrupts the submission process.
+        """
+        if getattr(self, 'p', None) is not None:
+            self._interrupt()
+
+    def set_data_dir(self, path):
+        """Give the job a directory of objects exchanged with the
+        namespace.
+
+        Its path is exported in the ``EXECUTE_DATA_DIR`` environment
+        variable of the job (see :py:mod:`~execute_batch_scheduler.jobdata`).
+
+        Parameters
+        ----------
+        path : str
+            Data directory, reachable by the job.
+        """
+        self._data_dir = path
+
+    def _job_env(self):
+        """Environment of the job process, None to inherit the kernel one."""
+        if self._data_dir is None:
+            return None
+        return dict(os.environ, EXECUTE_DATA_DIR=self._data_dir)
+
+    @property
+    def cache_cmd(self):
+        """Command line part of the result cache key (see
+        :py:class:`~execute_batch_scheduler.cache.ResultCache`)."""
+        return self.cmd
+
+    @property
+    def succeeded(self):
+        """Whether the cell ran successfully.
+
+        Only successful results are cached. Default implementation
+        returns False.
+        """
+        return False
+
+    async def submit_async(self, content):
+        """Asynchronous counterpart of :py:meth:`submit`.
+
+        Default implementation runs :py:meth:`submit` in the event loop
+        default executor.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.submit, content)
+
+    async def wait_async(self, silent=True):
+        """Asynchronous counterpart of :py:meth:`wait_progress`.
+
+        Default implementation waits from the event loop for the exit of
+        the :py:class:`subprocess.Popen` instance ``p`` of the cell, then
+        runs :py:meth:`wait_progress`, over at once, in the event loop
+        default executor. When the waiting task is cancelled, the cell is
+        cancelled with :py:meth:`cancel`.
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            if isinstance(getattr(self, 'p', None), Popen):
+                await self._wait_process()
+            return await loop.run_in_executor(
+                None, functools.partial(self.wait_progress, silent=silent))
+        except asyncio.CancelledError:
+            await loop.run_in_executor(None, self.cancel)
+            raise
+
+    async def _wait_process(self):
+        """Wait for the exit of the :py:class:`subprocess.Popen` instance
+        ``p``, checking it every ``_async_poll`` seconds."""
+        while self.p.poll() is None:
+            await asyncio.sleep(self._async_poll)
+
+    async def output_async(self):
+        """Asynchronous counterpart of :py:meth:`get_output`.
+
+        Default implementation runs :py:meth:`get_output` in the event
+        loop default executor.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.get_output)
+
+    async def run_async(self, content, silent=True):
+        """Submit cell content, wait for its completion and get its output.
+
+        Parameters
+        ----------
+        content: str
+            IPython cell content.
+        slient : bool (default=True)
+            Display or not a progression state.
+
+        Returns
+        -------
+        stdout: str
+            Job standard output
+        stderr: str
+            Job standard errput
+        """
+        await self.submit_async(content)
+        await self.wait_async(silent=silent)
+        return await self.output_async()
+
+    def _build_script(self, content, prologue=b''):
+        """Build job script from shebang and cell content.
+
+        The prologue is inserted after the leading comments of the cell,
+        where schedulers read their directives (like ``#SBATCH``).
+        """
+        header, body = self._split_header(content)
+        script = self.shebang + header.encode('utf8', 'replace') + prologue
+        script += body.encode('utf8', 'replace')
+        if not script.endswith(b'\n'):
+            script += b'\n'
+        return script
+
+    @staticmethod
+    def _split_header(content):
+        """Split cell content after its leading comment and blank lines."""
+        lines = content.splitlines(True)
+        i = 0
+        while i < len(lines) and (not lines[i].strip() or
+                                  lines[i].lstrip().startswith('#')):
+            i += 1
+        header = ''.join(lines[:i])
+        if header and not header.endswith('\n'):
+            header += '\n'
+        return header, ''.join(lines[i:])
+
+    @property
+    def _is_posix_shell(self):
+        """Whether the cell shell accepts POSIX shell syntax."""
+        return os.path.basename(self._shell.split(' ')[0]) in self._posix_shells
+
     def _interrupt(self):
         """Handle signals to kill :py:class:`subprocess.Popen` instance"""
         try:
@@ -114,7 +476,7 @@ class BaseMgr(with_metaclass(ABCMeta, object)):
             print("Error while terminating subprocess (pid=%i): %s" \
                 % (self.p.pid, e))
 
-    def _print_step_and_wait(self, s, silent=False):
+    def _print_step(self, s, silent=False):
         """Print progression.
 
         Display a :
@@ -126,6 +488,11 @@ class BaseMgr(with_metaclass(ABCMeta, object)):
         Arguments:
         ----------
         - s : number of steps so far
+
+        Returns
+        -------
+        delay: float
+            Time to wait before next step.
         """
         # Get appropriate step limit (l), time to wait (t) and
         # character to display (c)
@@ -133,24 +500,39 @@ class BaseMgr(with_metaclass(ABCMeta, object)):
                                (20, 10, 'o'),
                                (30, 60, 'O'),
                                (1e12, 600, '@')) if s < v[0]][0]
-        if s < l:
-            if not silent:
-                sys.stdout.write(c)
-            time.sleep(t)
+        if not silent:
+            sys.stdout.write(c)
         sys.stdout.flush()
+        return t
+
+    def _print_step_and_wait(self, s, silent=False):
+        """Print progression and wait until next step."""
+        time.sleep(self._print_step(s, silent=silent))
+
+    def _step_running(self, silent=False, wait=True):
+        """Performs one more running step.
 
-    def _step_running(self, silent=False):
-        """Performs one more running step."""
+        When ``wait`` is False, only display the step and return the time
+        to wait before the next one.
+        """
         if not silent and self._running_steps == 0:
             sys.stdout.write("Running ")
         self._running_steps += 1
+        if not wait:
+            return self._print_step(self._running_steps, silent=silent)
         self._print_step_and_wait(self._running_steps, silent=silent)
 
-    def _step_waiting(self, silent=False):
-        """Performs one more waiting step."""
+    def _step_waiting(self, silent=False, wait=True):
+        """Performs one more waiting step.
+
+        When ``wait`` is False, only display the step and return the time
+        to wait before the next one.
+        """
         if not silent and self._waiting_steps == 0:
             sys.stdout.write("Waiting for resources ")
         self._waiting_steps += 1
+        if not wait:
+            return self._print_step(self._waiting_steps, silent=silent)
         self._print_step_and_wait(self._waiting_steps, silent=silent)
 
 
@@ -167,36 +549,69 @@ class BasicMgr(BaseMgr):
         super(BasicMgr, self).__init__(args, shell, userns)
         self.cmd = self._wlbin + args
 
+    def submit(self, content):
+        """Submit the cell content to the Popen instance.
+        Return the output and error."""
+        self.trace.mark('submit')
         # Build Popen instance
         try:
-            self.p = Popen(self.cmd, stdout=PIPE, stderr=PIPE, stdin=PIPE,)
+            self.p = Popen(self.cmd, stdout=PIPE, stderr=PIPE, stdin=PIPE,
+                           env=self._job_env())
         except OSError as e:
             if e.errno == errno.ENOENT:
                 print("Couldn't find program: %r" % self.cmd[0])
                 return
             else:
                 raise e
-
-    def submit(self, content):
-        """Submit the cell content to the Popen instance.
-        Return the output and error."""
-        # Parse cell content
-        script = self.shebang
-        script += content.encode('utf8', 'replace')
-        if not script.endswith(b'\n'):
-            script += b'\n'
+        self.trace.mark('popen')
+        # Cell runs as soon as the shell starts
+        self.trace.mark('submitted')
+        self.trace.mark('running')
 
         # Submit cell content to Popen instance
         try:
-            out, err = self.p.communicate(script)
+            out, err = self.p.communicate(self._build_script(content))
         except KeyboardInterrupt:
             self._interrupt()
             return
+        self.trace.mark('end')
         self.out = py3compat.bytes_to_str(out)
         self.err = py3compat.bytes_to_str(err)
         return(self.out, self.err)
 
-    def wait_progress(self):
+    async def submit_async(self, content):
+        """Submit the cell content to an asyncio subprocess.
+        Return the output and error."""
+        self.trace.mark('submit')
+        try:
+            self.p = await asyncio.create_subprocess_exec(
+                *self.cmd, stdout=PIPE, stderr=PIPE, stdin=PIPE,
+                env=self._job_env())
+        except OSError as e:
+            if e.errno == errno.ENOENT:
+                print("Couldn't find program: %r" % self.cmd[0])
+                return
+            else:
+                raise e
+        self.trace.mark('popen')
+        # Cell runs as soon as the shell starts
+        self.trace.mark('submitted')
+        self.trace.mark('running')
+        try:
+            out, err = await self.p.communicate(self._build_script(content))
+        except asyncio.CancelledError:
+            self.p.kill()
+            raise
+        self.trace.mark('end')
+        self.out = py3compat.bytes_to_str(out)
+        self.err = py3compat.bytes_to_str(err)
+        return(self.out, self.err)
+
+    def wait_progress(self, silent=False):
+        """Skip progression. Cell already executed on submit."""
+        pass
+
+    async def wait_async(self, silent=True):
         """Skip progression. Cell already executed on submit."""
         pass
 
@@ -204,26 +619,181 @@ class BasicMgr(BaseMgr):
         """Skip ouptut. Cell output already displayed on submit"""
         return None, None
 
+    async def output_async(self):
+        """Get the output and error of the cell executed on submit."""
+        return(self.out, self.err)
 
-class SSHMgr(BaseMgr):
-    """SSH based manager.
+    def get_full_output(self):
+        """Get the output and error of the cell executed on submit."""
+        return(self.out, self.err)
 
-    Reach a distant machine through SSH to execute cell content as a script.
-    SSH is running in batch mode without standard input interaction with
-    user, so it must connect without password or passphrase.
+    @property
+    def succeeded(self):
+        """Whether the shell exited with status 0."""
+        return getattr(self, 'p', None) is not None and self.p.returncode == 0
 
 
-    .. todo::
-        Add a `user` argument to change from default user connexion.
+class LocalPool(object):
+    """Bounded pool of local cores shared by all :py:class:`LocalMgr`.
+
+    Submitted jobs wait in a first in, first out queue until enough cores
+    are free, then run pinned to their own cores. Each running job is
+    waited for by a thread of its own, so that the number of threads is
+    bounded by the number of cores, however many jobs are queued.
+
+    The pool holds ``_DEFAULT_LOCAL_CPUS`` cores, by default all the cores
+    the kernel may run on. Job scripts and output files live in a session
+    temporary directory.
     """
 
-    _wlbin = ['ssh', '-n']
+    def __init__(self, cpus=None):
+        """Initialize an empty pool.
 
-    def __init__(self, args, shell, userns):
-        """Initialize the workload manager interface for SSH.
+        Parameters
+        ----------
+        cpus : int
+            Number of cores of the pool (default from
+            ``_DEFAULT_LOCAL_CPUS``).
+        """
+        self._cpus = cpus
+        self._lock = threading.Lock()
+        self._dir = None
+        self._ids = itertools.count(1)
+        # Free cores, computed at first submission
+        self._free = None
+        self._queue = collections.deque()
+        self._running = set()
+
+    @property
+    def cpus(self):
+        """Cores of the pool."""
+        if hasattr(os, 'sched_getaffinity'):
+            cores = sorted(os.sched_getaffinity(0))
+        else:
+            cores = list(range(os.cpu_count() or 1))
+        ncpus = self._cpus
+        if ncpus is None:
+            from . import _DEFAULT_LOCAL_CPUS
+            ncpus = _DEFAULT_LOCAL_CPUS
+        return cores[:ncpus] if ncpus else cores
+
+    def new_job(self):
+        """Get a new job number and the base name of its files."""
+        with self._lock:
+            if self._dir is None:
+                self._dir = tempfile.mkdtemp(prefix='ipython-execute-local-')
+            jobid = next(self._ids)
+            return jobid, os.path.join(self._dir, 'job{0}'.format(jobid))
+
+    def submit(self, job_mgr):
+        """Queue a job, started as soon as enough cores are free.
 
-        It rely on ``ssh -n`` so ssh must connect without any password
-        and passphrase. The ssh command is achieved through a :py:class:`subprocess.Popen` object
+        Parameters
+        ----------
+        job_mgr : :py:class:`LocalMgr`
+            Manager of the job.
+
+        Raises
+        ------
+        ValueError
+            If the job needs more cores than the pool holds.
+        """
+        with self._lock:
+            if self._free is None:
+                self._free = set(self.cpus)
+            ncpus = len(self._free) + sum(len(m.cores) for m in self._running)
+            if job_mgr.ncpus > ncpus:
+                raise ValueError("Local job needs {0} cores, the pool holds "
+                                 "{1}".format(job_mgr.ncpus, ncpus))
+            self._queue.append(job_mgr)
+            self._dispatch()
+
+    def _dispatch(self):
+        """Start the queued jobs while enough cores are free."""
+        while self._queue and self._queue[0].ncpus <= len(self._free):
+            job_mgr = self._queue.popleft()
+            cores = sorted(self._free)[:job_mgr.ncpus]
+            self._free.difference_update(cores)
+            try:
+                job_mgr._launch(cores)
+            except OSError as e:
+                self._free.update(cores)
+                job_mgr._ended('FAILED', "Cannot start local job: {0}\n".format(e))
+                continue
+            self._running.add(job_mgr)
+            waiter = threading.Thread(target=self._wait, args=(job_mgr,),
+                                      name='execute-local-{0}'.format(job_mgr._jobid))
+            waiter.daemon = True
+            waiter.start()
+
+    def _wait(self, job_mgr):
+        """Wait for a running job, then give its cores to the queued jobs."""
+        rc = job_mgr.p.wait()
+        with self._lock:
+            self._running.discard(job_mgr)
+            self._free.update(job_mgr.cores)
+            if job_mgr._cancelled:
+                job_mgr._ended('CANCELLED')
+            else:
+                job_mgr._ended('COMPLETED' if rc == 0 else 'FAILED')
+            self._dispatch()
+
+    def cancel(self, job_mgr, sig=signal.SIGTERM):
+        """Remove a queued job or signal a running one.
+
+        Parameters
+        ----------
+        job_mgr : :py:class:`LocalMgr`
+            Manager of the job.
+        sig : int
+            Signal sent to a running job (default to SIGTERM).
+        """
+        with self._lock:
+            if job_mgr in self._queue:
+                self._queue.remove(job_mgr)
+                job_mgr._ended('CANCELLED')
+            elif job_mgr in self._running:
+                job_mgr._cancelled = True
+                try:
+                    # Job runs in its own session with its children
+                    os.killpg(job_mgr.p.pid, sig)
+                except OSError:
+                    pass
+
+    def close(self):
+        """Cancel all the jobs and remove the session directory."""
+        with self._lock:
+            jobs = list(self._queue) + list(self._running)
+        for job_mgr in jobs:
+            self.cancel(job_mgr)
+        with self._lock:
+            if self._dir is not None:
+                shutil.rmtree(self._dir, ignore_errors=True)
+                self._dir = None
+
+
+class LocalMgr(BaseMgr):
+    """Local process pool manager.
+
+    Run cell content on the cores of the local machine, through a pool
+    shared by all the instances (see :py:class:`LocalPool`). A job gets
+    ``--ntasks`` times ``--cpus-per-task`` cores, waits in the pool queue
+    until they are free, and runs pinned to them in background. Like for
+    :py:class:`SlurmMgr`, :py:meth:`submit` returns once the job is
+    queued and :py:meth:`wait_progress` displays its progression.
+
+    The job script gets its job number, number of tasks, cores per task
+    and cores in the ``EXECUTE_JOB_ID``, ``EXECUTE_NTASKS``,
+    ``EXECUTE_CPUS_PER_TASK`` and ``EXECUTE_CPUS`` environment variables.
+    ``OMP_NUM_THREADS`` defaults to the number of cores per task.
+    """
+
+    _end_states = ('CANCELLED', 'COMPLETED', 'FAILED')
+    # Cores are shared among all the instances
+    _pool = LocalPool()
+
+    def __init__(self, args, shell, userns):
+        """Initialize the local submission.
 
         Parameters
         ----------
@@ -234,122 +804,1549 @@ class SSHMgr(BaseMgr):
         userns : dict
             User namespace from cell_magics
         """
-        super(SSHMgr, self).__init__(args, shell, userns)
+        super(LocalMgr, self).__init__(args, shell, userns)
         parser = MagicArgumentParser()
-        parser.add_argument('--host', type=str, default='localhost',
-                            help='Machine to reach (default = localhost)')
-        parser.add_argument('--pid', type=str,
-                            help='Variable to store SSH process pid')
-        _args, cmd = parser.parse_known_args(args)
-        self.cmd = self._wlbin + [_args.host, ] + cmd
-        # SSH Cannot fork into background without a command to execute.
-        # Popen instance is created in submit
+        parser.add_argument('-n', '--ntasks', type=int, default=1,
+                            help='Number of tasks')
+        parser.add_argument('-c', '--cpus-per-task', type=int, default=1,
+                            help='Number of cores per task')
+        parser.add_argument('--jobid', type=str,
+                            help='Variable to store the local job number')
+        _args = parser.parse_args(args)
+        if _args.ntasks < 1 or _args.cpus_per_task < 1:
+            parser.error('task and core counts must be positive')
+        self.ntasks = _args.ntasks
+        self.cpus_per_task = _args.cpus_per_task
+        self.ncpus = self.ntasks * self.cpus_per_task
+        self.cmd = shlex.split(shell)
+        self._args_jobid = _args.jobid
+        self._jobid = None
+        self._files = None
+        # Cores of the running job
+        self.cores = []
+        # Job state: PENDING, RUNNING then one of the end states
+        self.state = None
+        self._cancelled = False
+        # Error message of a job that could not start
+        self._message = ''
+        self._is_started = False
+        self._is_terminated = False
+        self._done = Future()
 
     def submit(self, content):
-        """Submit the cell content to the Popen instance.
+        """Queue the cell content in the local pool.
 
         Parameters
         ----------
         content: str
             IPython cell content.
 
+        Returns
+        -------
+        stdout: str
+            Submission message.
+        stderr: str
+            Submission error message.
         """
-        self._is_terminated = False
-
-        # Build Popen instance
+        self.trace.mark('submit')
+        self._jobid, self._files = self._pool.new_job()
+        with open(self._files + '.sh', 'wb') as f:
+            f.write(self._build_script(content))
+        self.trace.label = self._jobid
+        self.state = 'PENDING'
+        self.trace.mark('submitted')
+        self._is_started = True
         try:
-            self.p = Popen(self.cmd + [content, ], stdout=PIPE, stderr=PIPE)
-        except OSError as e:
-            if e.errno == errno.ENOENT:
-                print("Couldn't find program: %r" % self.cmd[0])
-                return
-            else:
-                raise e
-        except KeyboardInterrupt:
-            self._interrupt()
-            self._is_terminated = True
-        # SSH output is bind to Popen command output
-        if self.p.poll() is None:
-            if _args.pid:
-                self._userns[_args.pid] = self.p.pid
-            return ("SSH started with pid: {0}\n".format(self.p.pid), '')
-        else:
-            self._is_terminated = True
-            return self.get_output()
+            self._pool.submit(self)
+        except ValueError as e:
+            self._ended('FAILED')
+            return ('', "{0}\n".format(e))
+        if self._args_jobid:
+            self._userns[self._args_jobid] = self._jobid
+        return ("Submitted local job {0}\n".format(self._jobid), '')
+
+    def _launch(self, cores):
+        """Start the job script pinned to the given cores."""
+        env = dict(self._job_env() or os.environ,
+                   EXECUTE_JOB_ID=str(self._jobid),
+                   EXECUTE_NTASKS=str(self.ntasks),
+                   EXECUTE_CPUS_PER_TASK=str(self.cpus_per_task),
+                   EXECUTE_CPUS=','.join(str(c) for c in cores))
+        env.setdefault('OMP_NUM_THREADS', str(self.cpus_per_task))
+        cmd = self.cmd + [self._files + '.sh']
+        # The script is pinned by taskset, or in the child before it starts
+        # otherwise, so that the processes it forks are pinned too.
+        preexec_fn = None
+        taskset = shutil.which('taskset')
+        if taskset:
+            cmd = [taskset, '-c', ','.join(str(c) for c in cores)] + cmd
+        elif hasattr(os, 'sched_setaffinity'):
+            preexec_fn = functools.partial(os.sched_setaffinity, 0, cores)
+        with open(os.devnull, 'rb') as devnull, \
+                open(self._files + '.out', 'wb') as out, \
+                open(self._files + '.err', 'wb') as err:
+            self.p = Popen(cmd, stdin=devnull, stdout=out, stderr=err,
+                           env=env, start_new_session=True,
+                           preexec_fn=preexec_fn)
+        self.cores = cores
+        self.state = 'RUNNING'
+        self.trace.mark('popen')
+        self.trace.mark('running')
+
+    def _ended(self, state, message=''):
+        """Record the end state of the job."""
+        self.state = state
+        self._message = message
+        self._is_terminated = True
+        self.trace.mark('end')
+        self._done.set_result(state)
 
     def wait_progress(self, silent=False):
-        """Wait for progression.
+        """Wait for the job completion, displaying its progression.
 
         Parameters
         ----------
         slient : bool (default=False)
             Display or not a progression state.
         """
-        while self.p.poll() is None:
-            self._step_running(silent=silent)
+        if not self._is_started:
+            return
+        try:
+            while not self._done.done():
+                if self.state == 'PENDING':
+                    delay = self._step_waiting(silent=silent, wait=False)
+                else:
+                    if self._waiting_steps > 0 and self._running_steps == 0 \
+                            and not silent:
+                        sys.stdout.write("\n")
+                    delay = self._step_running(silent=silent, wait=False)
+                try:
+                    self._done.result(delay)
+                except FutureTimeoutError:
+                    pass
+        except KeyboardInterrupt:
+            sys.stdout.write("Terminate local job {0} \n".format(self._jobid))
+            sys.stdout.flush()
+            self.cancel()
+            try:
+                self._done.result(5.)
+            except FutureTimeoutError:
+                self._pool.cancel(self, signal.SIGKILL)
+                self._done.result()
         if not silent:
-            sys.stdout.write("\nDone\n")
+            if self._waiting_steps > 0 or self._running_steps > 0:
+                sys.stdout.write("\n")
+            sys.stdout.write("End local job {0} Status: {1}\n".format(
+                self._jobid, self.state))
             sys.stdout.flush()
-        self._is_terminated = True
 
+    async def wait_async(self, silent=True):
+        """Wait for the job completion without blocking the event loop.
+
+        Parameters
+        ----------
+        slient : bool (default=True)
+            Display or not the final job state.
+        """
+        if not self._is_started:
+            return
+        try:
+            # The job future is only completed by the pool
+            await asyncio.shield(asyncio.wrap_future(self._done))
+        except asyncio.CancelledError:
+            await asyncio.get_running_loop().run_in_executor(None, self.cancel)
+            raise
+        if not silent:
+            sys.stdout.write("End local job {0} Status: {1}\n".format(
+                self._jobid, self.state))
+            sys.stdout.flush()
+
+    def _read_job_file(self, path):
+        """Read a job output file."""
+        try:
+            with open(path, 'rb') as f:
+                return py3compat.bytes_to_str(f.read())
+        except (IOError, OSError):
+            return ''
+
+    @traced('output')
     def get_output(self):
-        """Get job output
+        """Get the job output and error.
 
         Returns
         -------
         stdout: str
-            Job standard output
+            Job standard output.
         stderr: str
-            Job standard errput
+            Job standard errput.
         """
-        if self._is_terminated:
-            if self.out is None and self.err is None:
-                self.out = py3compat.bytes_to_str(b''.join(self.p.stdout.readlines()))
-                self.err = py3compat.bytes_to_str(b''.join(self.p.stderr.readlines()))
-            return(self.out, self.err)
-        else:
-            return None
+        if not self._is_terminated:
+            return None, None
+        if self.out is None and self.err is None:
+            self.out = self._read_job_file(self._files + '.out')
+            self.err = self._read_job_file(self._files + '.err') + self._message
+        return self.out, self.err
 
+    @traced('output')
+    def get_output_view(self, full=False):
+        """Get views of the job output and error files.
 
-class SlurmMgr(BaseMgr):
-    """Slurm workload manager.
-
-    It enforces the slurm standard output and error files to be read and
-    display in Cell output after completion.
+        Parameters
+        ----------
+        full : bool (default=False)
+            Unused, the output is only displayed after completion.
+        """
+        if not self._is_terminated:
+            return OutputView(b''), OutputView(b'')
+        views = []
+        for ext in ('.out', '.err'):
+            path = self._files + ext
+            views.append(OutputView(path) if os.path.exists(path)
+                         else OutputView(b''))
+        if self._message:
+            views[1] = OutputView(str(views[1]).encode(views[1].encoding) +
+                                  self._message.encode('utf8', 'replace'))
+        return tuple(views)
+
+    def cancel(self):
+        """Remove the job from the pool queue, or terminate it."""
+        if self._is_started and not self._is_terminated:
+            self._pool.cancel(self)
+
+    @property
+    def cache_cmd(self):
+        """Shell command line with the task and core counts."""
+        return self.cmd + ['--ntasks={0}'.format(self.ntasks),
+                           '--cpus-per-task={0}'.format(self.cpus_per_task)]
+
+    @property
+    def succeeded(self):
+        """Whether the job script exited with status 0."""
+        return self.state == 'COMPLETED'
+
+
+class SSHMasterPool(object):
+    """Pool of persistent SSH master connections.
+
+    A master connection is started in background for each reached host.
+    Its control socket lives in a session temporary directory and all
+    later ssh commands to this host are multiplexed through it, saving
+    the connection and authentication time.
+
+    At most ``_DEFAULT_SSH_MAX_MASTERS`` masters exist at once, the least
+    recently used one being stopped when a new host is reached. Setting
+    it to 0 disables connection multiplexing.
+    """
 
+    def __init__(self, max_masters=None):
+        """Initialize an empty pool.
 
-    Slurm output and error files are stored in ``$HOME/python-execute-slurm.${SLURM_JOB_ID}.[out|err]``.
+        Parameters
+        ----------
+        max_masters : int
+            Maximal number of master connections (default from
+            ``_DEFAULT_SSH_MAX_MASTERS``).
+        """
+        self._max_masters = max_masters
+        self._lock = threading.Lock()
+        self._dir = None
+        # Reached hosts in least recently used order
+        self._hosts = collections.OrderedDict()
+        # Locks of the master connection start of each host
+        self._host_locks = {}
+
+    @property
+    def max_masters(self):
+        """Maximal number of master connections."""
+        if self._max_masters is None:
+            from . import _DEFAULT_SSH_MAX_MASTERS
+            return _DEFAULT_SSH_MAX_MASTERS
+        return self._max_masters
+
+    def _control_opts(self):
+        # %C is a hash of the connection parameters, short enough to fit
+        # unix socket path length limit
+        return ['-o', 'ControlPath=' + os.path.join(self._dir, '%C')]
+
+    def _control(self, host, command):
+        """Send a control command to the master connection of host."""
+        with open(os.devnull, 'wb') as devnull:
+            Popen(['ssh'] + self._control_opts() + ['-O', command, host],
+                  stdout=devnull, stderr=devnull).wait()
+
+    def options(self, host):
+        """Get ssh options to reach a host through its master connection.
+
+        The master connection is started if needed. Masters of different
+        hosts are started concurrently, a single one for each host.
 
-    .. todo::
-        Add a way to change out/err slurm files location.
+        Parameters
+        ----------
+        host : str
+            Host to reach.
 
+        Returns
+        -------
+        options : list of str
+            ssh command options (empty if no master connection is available).
+        """
+        with self._lock:
+            if self.max_masters <= 0:
+                return []
+            if self._dir is None:
+                self._dir = tempfile.mkdtemp(prefix='ipython-execute-ssh-')
+            host_lock = self._host_locks.setdefault(host, threading.Lock())
+        # A missing master socket makes ssh connect on its own
+        options = ['-o', 'ControlMaster=no'] + self._control_opts()
+        with host_lock:
+            with self._lock:
+                if host in self._hosts:
+                    self._hosts.move_to_end(host)
+                    return options
+            with open(os.devnull, 'wb') as devnull:
+                master = Popen(
+                    ['ssh', '-f', '-N', '-o', 'BatchMode=yes',
+                     '-o', 'ControlMaster=yes', '-o', 'ControlPersist=yes']
+                    + self._control_opts() + [host],
+                    stdin=devnull, stdout=devnull, stderr=devnull)
+                if master.wait() != 0:
+                    return []
+            with self._lock:
+                self._hosts[host] = True
+                stopped = []
+                while len(self._hosts) > self.max_masters:
+                    stopped.append(self._hosts.popitem(last=False)[0])
+        for old in stopped:
+            with self._host_locks[old]:
+                # Stopped master exits when its sessions are done
+                with self._lock:
+                    if old in self._hosts:
+                        continue
+                self._control(old, 'stop')
+        return options
+
+    def close(self):
+        """Exit all the master connections."""
+        with self._lock:
+            while self._hosts:
+                self._control(self._hosts.popitem()[0], 'exit')
+            if self._dir is not None:
+                shutil.rmtree(self._dir, ignore_errors=True)
+                self._dir = None
+
+
+class SSHSession(object):
+    """Persistent remote shell running cells one after another.
+
+    A single ``ssh`` process runs a remote ``bash`` worker, started by
+    the first cell of the session. Cells are sent on its standard input
+    as ``CELL <id> <size>`` frames followed by the cell content, and are
+    sourced in the worker shell, so that its environment, current
+    directory and loaded modules are kept between cells. Once a cell is
+    over, the worker answers a ``DONE <id> <status> <out size> <err
+    size>`` frame followed by the cell output and error.
+
+    Cells of a session run in submission order. A cell exiting the
+    shell, or a cancelled cell, ends the session, which is started again
+    by the next cell.
     """
 
-    _wlbin = ['sbatch', '-n', '1', ]
-    _end_states = ('CANCELLED', 'COMPLETED', 'FAILED',
-                   'NODE_FAIL', 'PREEMPTED', 'TIMEOUT')
-    _wait_states = ('CONFIGURING', 'PENDING')
-    _run_states = ('COMPLETING', 'RUNNING', 'SUSPENDED')
-
-    def __init__(self, args, shell, userns):
-        """Initialize the slurm submission.
+    # Sessions by host and name
+    _sessions = {}
+    _sessions_lock = threading.Lock()
+
+    # Remote worker loop, reading cell frames on its standard input
+    _worker = """\
+__d=$(mktemp -d "${TMPDIR:-/tmp}/python-execute-session.XXXXXX") || exit 1
+trap 'rm -rf "$__d"' EXIT
+EXECUTE_SESSION_DIR=$PWD
+printf 'READY %s\\n' "$$"
+while IFS=' ' read -r __tag __id __size; do
+  [ "$__tag" = CELL ] || break
+  head -c "$__size" > "$__d/cell"
+  . "$__d/cell" > "$__d/out" 2> "$__d/err" < /dev/null
+  __rc=$?
+  printf 'DONE %s %s %s %s\\n' "$__id" "$__rc" \\
+    $(($(wc -c < "$__d/out"))) $(($(wc -c < "$__d/err")))
+  cat "$__d/out" "$__d/err"
+done
+"""
 
-        The ``sbatch`` command is achieved through a :py:class:`subprocess.Popen` object
+    def __init__(self, ssh):
+        """Initialize a session, not started yet.
 
         Parameters
         ----------
-        args : str
-            String containing workload scheduler specific arguments.
-        shell : str
-            Shell to use whithin the workload scheduler
-        userns : dict
-            User namespace from cell_magics
+        ssh : list of str
+            ssh command with its options, ending with the remote host.
         """
-        super(SlurmMgr, self).__init__(args, shell, userns)
+        self.ssh = list(ssh)
+        #: Remote worker pid, None until started
+        self.pid = None
+        self._p = None
+        self._errors = None
+        self._lock = threading.Lock()
+        self._cells = itertools.count(1)
+        # Cells are run one after another
+        self._executor = ThreadPoolExecutor(1)
+
+    @classmethod
+    def get(cls, host, name, ssh):
+        """Get the named session of a host, created if needed.
+
+        The given ssh command is used when the session is (re)started.
+        """
+        with cls._sessions_lock:
+            if (host, name) not in cls._sessions:
+                cls._sessions[(host, name)] = cls(ssh)
+            session = cls._sessions[(host, name)]
+            session.ssh = list(ssh)
+            return session
+
+    @classmethod
+    def close_all(cls):
+        """End all the sessions."""
+        with cls._sessions_lock:
+            sessions = list(cls._sessions.values())
+            cls._sessions.clear()
+        for session in sessions:
+            session.close()
+
+    def _start(self):
+        """Start the remote worker and wait until it is ready."""
+        self._p = Popen(self.ssh + ['exec bash -c ' + shlex.quote(self._worker)],
+                        stdin=PIPE, stdout=PIPE, stderr=PIPE)
+        self._errors = PipeDrainer(self._p.stderr)
+        while True:
+            line = self._p.stdout.readline()
+            if not line:
+                raise EOFError("remote shell exited")
+            # Lines written by the remote profiles are skipped
+            if line.startswith(b'READY '):
+                self.pid = int(line.split()[1])
+                return
 
-        from . import _DEFAULT_SLURM_OUTERR_FILE
-        if _DEFAULT_SLURM_OUTERR_FILE is None:
-            self._outerr_files = os.path.join(os.environ['HOME'], "python-execute-slurm.%J")
+    def _copy(self, spool, size):
+        """Copy a frame of the worker output to a spool."""
+        while size > 0:
+            data = self._p.stdout.read(min(size, 65536))
+            if not data:
+                raise EOFError("remote shell exited")
+            spool.append(data)
+            size -= len(data)
+
+    def _stop(self):
+        """Kill the ssh process, return its error output."""
+        p, self._p, self.pid = self._p, None, None
+        if p is None:
+            return ''
+        if p.poll() is None:
+            p.kill()
+        p.wait()
+        self._errors.join()
+        return py3compat.bytes_to_str(self._errors.read()).strip()
+
+    def run(self, content, out, err):
+        """Run a cell in the worker shell, starting it if needed.
+
+        Parameters
+        ----------
+        content : str
+            Shell commands of the cell.
+        out, err : :py:class:`~execute_batch_scheduler.streams.Spool`
+            Spools receiving the cell output and error.
+
+        Returns
+        -------
+        status: int
+            Exit status of the cell, 255 when the session ended.
+        """
+        data = content.encode('utf8')
+        with self._lock:
+            try:
+                if self._p is None or self._p.poll() is not None:
+                    self._stop()
+                    self._start()
+                cell = next(self._cells)
+                self._p.stdin.write('CELL {0} {1}\n'.format(
+                    cell, len(data)).encode() + data)
+                self._p.stdin.flush()
+                header = self._p.stdout.readline().split()
+                if len(header) != 5 or header[:2] != [b'DONE', str(cell).encode()]:
+                    raise EOFError("remote shell exited")
+                self._copy(out, int(header[3]))
+                self._copy(err, int(header[4]))
+                return int(header[2])
+            except (OSError, ValueError, EOFError) as e:
+                message = self._stop() or str(e)
+                err.append("SSH session ended: {0}\n".format(message).encode())
+                return 255
+
+    def submit(self, content, out, err):
+        """Queue a cell, return a future of its exit status (see
+        :py:meth:`run`)."""
+        return self._executor.submit(self.run, content, out, err)
+
+    def cancel(self):
+        """Kill the running cell and end the session."""
+        pid, p = self.pid, self._p
+        if pid is not None:
+            with open(os.devnull, 'wb') as devnull:
+                Popen(self.ssh + ['pkill -TERM -P {0}; kill -TERM {0}'.format(pid)],
+                      stdin=devnull, stdout=devnull, stderr=devnull).wait()
+        if p is not None and p.poll() is None:
+            p.kill()
+
+    def close(self):
+        """End the session once its running cell is over."""
+        p = self._p
+        if p is not None and p.poll() is None:
+            try:
+                p.stdin.close()
+            except (IOError, OSError):
+                pass
+        with self._lock:
+            try:
+                if p is not None:
+                    p.wait(5.)
+            except TimeoutExpired:
+                pass
+            self._stop()
+
+
+class SSHFanout(object):
+    """Concurrent run of a cell on many hosts.
+
+    The cell runs on at most ``fanout`` hosts at once, through an ssh
+    command of its own on each host. Hosts still running after
+    ``timeout`` seconds are killed and reported as timed out.
+
+    Once all the hosts are done, their outputs are gathered like
+    ``clush -b``: identical outputs are displayed once, under the folded
+    list of their hosts (see :py:func:`fold_hostlist`), and failed hosts
+    are reported by exit status.
+    """
+
+    # Separator line of the gathered outputs
+    _separator = '-' * 15
+
+    def __init__(self, hosts, ssh, fanout=None, timeout=None):
+        """Initialize a fan-out.
+
+        Parameters
+        ----------
+        hosts : list of str
+            Hosts to reach.
+        ssh : list of str
+            ssh command with its options, the host and the remote command
+            being appended.
+        fanout : int
+            Maximal number of hosts reached at once (default from
+            ``_DEFAULT_SSH_FANOUT``).
+        timeout : float
+            Time limit in seconds of the command on each host (default
+            None, no limit).
+        """
+        if fanout is None:
+            from . import _DEFAULT_SSH_FANOUT
+            fanout = _DEFAULT_SSH_FANOUT
+        self.hosts = list(hosts)
+        self.ssh = list(ssh)
+        self.fanout = max(1, fanout)
+        self.timeout = timeout
+        #: ``(status, out, err, elapsed)`` by host, ``status`` being None
+        #: for timed out hosts
+        self.results = collections.OrderedDict()
+        self._procs = {}
+        self._lock = threading.Lock()
+        self._cancelled = False
+
+    def _run_host(self, host, content):
+        """Run the command on a host."""
+        start = time.time()
+        with self._lock:
+            if self._cancelled:
+                return None
+            # Own process group, killed with the processes sharing its pipes
+            p = Popen(self.ssh + [host, content], stdout=PIPE, stderr=PIPE,
+                      start_new_session=True)
+            self._procs[host] = p
+        try:
+            out, err = p.communicate(timeout=self.timeout)
+            status = p.returncode
+        except TimeoutExpired:
+            self._kill(p)
+            out, err = p.communicate()
+            status = None
+        finally:
+            with self._lock:
+                self._procs.pop(host, None)
+        return status, out, err, time.time() - start
+
+    @staticmethod
+    def _kill(p):
+        """Kill the process group of a command."""
+        try:
+            os.killpg(p.pid, signal.SIGKILL)
+        except OSError:
+            pass
+
+    def _failure(self, host):
+        """Failure message of a host, None if it succeeded."""
+        result = self.results.get(host)
+        if result is None:
+            return "not run"
+        status = result[0]
+        if status is None:
+            return "timed out after {0:g}s".format(self.timeout)
+        if status < 0:
+            return "killed by signal {0}".format(-status)
+        if status > 0:
+            return "exited with status {0}".format(status)
+        return None
+
+    def _gather(self, index, spool):
+        """Write the identical outputs of the hosts once each."""
+        groups = collections.OrderedDict()
+        for host, result in self.results.items():
+            if result is not None and result[index]:
+                groups.setdefault(result[index], []).append(host)
+        for data, hosts in groups.items():
+            spool.append("{0}\n{1} ({2})\n{0}\n".format(
+                self._separator, fold_hostlist(hosts), len(hosts)).encode())
+            spool.append(data if data.endswith(b'\n') else data + b'\n')
+
+    def run(self, content, out, err):
+        """Run a cell on all the hosts.
+
+        Parameters
+        ----------
+        content : str
+            Remote command.
+        out, err : :py:class:`~execute_batch_scheduler.streams.Spool`
+            Spools receiving the gathered output and error, followed by
+            the failures.
+
+        Returns
+        -------
+        status: int
+            0 when the command succeeded on all the hosts, its greatest
+            exit status otherwise, 255 if a host timed out, was killed or
+            not run.
+        """
+        with ThreadPoolExecutor(min(self.fanout, len(self.hosts))) as pool:
+            futures = [(h, pool.submit(self._run_host, h, content))
+                       for h in self.hosts]
+            for host, future in futures:
+                self.results[host] = future.result()
+        self._gather(1, out)
+        self._gather(2, err)
+        failures = collections.OrderedDict()
+        for host in self.hosts:
+            message = self._failure(host)
+            if message is not None:
+                failures.setdefault(message, []).append(host)
+        for message, hosts in failures.items():
+            err.append("{0}: {1}\n".format(fold_hostlist(hosts),
+                                           message).encode())
+        statuses = [r[0] if r is not None else None
+                    for r in self.results.values()]
+        if any(st is None or st < 0 for st in statuses):
+            return 255
+        return max(statuses)
+
+    def submit(self, content, out, err):
+        """Start the run in background, return a future of its exit status
+        (see :py:meth:`run`)."""
+        executor = ThreadPoolExecutor(1)
+        try:
+            return executor.submit(self.run, content, out, err)
+        finally:
+            executor.shutdown(wait=False)
+
+    def cancel(self):
+        """Kill the running commands, the remaining hosts being not run."""
+        with self._lock:
+            self._cancelled = True
+            procs = list(self._procs.values())
+        for p in procs:
+            self._kill(p)
+
+
+class SSHMgr(BaseMgr):
+    """SSH based manager.
+
+    Reach a distant machine through SSH to execute cell content as a script.
+    SSH is running in batch mode without standard input interaction with
+    user, so it must connect without password or passphrase.
+
+    Connections to a same host are multiplexed through a persistent master
+    connection managed by :py:class:`SSHMasterPool`, started on the first
+    submission to the host. With ``--session``,
+    cells are run one after another by a long-lived remote shell managed
+    by :py:class:`SSHSession` instead of a new ssh command each. With
+    ``--hosts``, the cell runs on many hosts at once through
+    :py:class:`SSHFanout`, their outputs being gathered.
+
+    Command output and error are continuously drained by background
+    threads, so that large outputs never block the remote command, and
+    forwarded to the cell while the command runs.
+
+    With ``--stage`` or ``--fetch``, the cell runs in a remote working
+    directory (``--workdir``, default ``_DEFAULT_SSH_WORKDIR``). Staged
+    local files are sent there before the cell runs, and fetched files are
+    brought back once it is over, both incrementally through
+    :py:class:`~execute_batch_scheduler.staging.Stager`.
+
+
+    .. todo::
+        Add a `user` argument to change from default user connexion.
+    """
+
+    _wlbin = ['ssh', '-n']
+    # Delay between two forwardings of the command output
+    _forward_interval = 0.2
+    # Master connections are shared among all the instances
+    _masters = SSHMasterPool()
+
+    def __init__(self, args, shell, userns):
+        """Initialize the workload manager interface for SSH.
+
+        It rely on ``ssh -n`` so ssh must connect without any password
+        and passphrase. The ssh command is achieved through a :py:class:`subprocess.Popen` object
+
+        Parameters
+        ----------
+        args : str
+            String containing workload scheduler specific arguments.
+        shell : str
+            Shell to use whithin the workload scheduler
+        userns : dict
+            User namespace from cell_magics
+        """
+        super(SSHMgr, self).__init__(args, shell, userns)
+        parser = MagicArgumentParser()
+        parser.add_argument('--host', type=str,
+                            help='Machine to reach (default = localhost)')
+        parser.add_argument('--hosts', type=str,
+                            help='Machines to reach at once, as a hostlist '
+                            'expression like node[001-064]')
+        parser.add_argument('--fanout', type=int,
+                            help='Maximal number of machines reached at once '
+                            '(default from _DEFAULT_SSH_FANOUT)')
+        parser.add_argument('--host-timeout', type=float,
+                            help='Time limit in seconds of the command on '
+                            'each machine')
+        parser.add_argument('--pid', type=str,
+                            help='Variable to store SSH process pid')
+        parser.add_argument('--stage', type=str,
+                            help='Comma separated local paths sent to the '
+                            'remote working directory before the cell runs')
+        parser.add_argument('--fetch', type=str,
+                            help='Comma separated remote paths brought back '
+                            'once the cell is over')
+        parser.add_argument('--workdir', type=str,
+                            help='Remote working directory of staged cells')
+        parser.add_argument('--session', type=str, nargs='?', const='default',
+                            help='Run the cell in the given persistent '
+                            'remote shell')
+        _args, cmd = parser.parse_known_args(args)
+        self._fanout = None
+        if _args.hosts is not None:
+            if _args.host or _args.session or _args.stage or _args.fetch \
+                    or _args.workdir:
+                parser.error("--hosts cannot be combined with --host, "
+                             "--session, --stage, --fetch or --workdir")
+            try:
+                hosts = expand_hostlist(_args.hosts)
+            except ValueError as e:
+                parser.error(str(e))
+            # Master connections are kept for single host cells
+            self._fanout = SSHFanout(hosts, self._wlbin + cmd, _args.fanout,
+                                     _args.host_timeout)
+            self.cmd = self._wlbin + cmd
+            _args.host = _args.hosts
+        else:
+            _args.host = _args.host or 'localhost'
+            # Master connection options are added on submission
+            self.cmd = self._wlbin + [_args.host, ] + cmd
+        self._ssh_args = cmd
+        # Master connection options change with each session
+        self._cache_cmd = self._wlbin + [_args.host, ] + cmd
+        self._args_pid = _args.pid
+        self._followers = None
+        self._stage = [p for p in (_args.stage or '').split(',') if p]
+        self._fetch = [p for p in (_args.fetch or '').split(',') if p]
+        self._stager = None
+        if self._stage or self._fetch or _args.workdir:
+            from . import _DEFAULT_SSH_WORKDIR
+            self._stager = Stager(['ssh'] + cmd + [_args.host],
+                                  _args.workdir or _DEFAULT_SSH_WORKDIR)
+        #: Files sent and brought back by the last run
+        self.staged, self.fetched = [], []
+        self._session = None
+        if _args.session is not None:
+            self._session = SSHSession.get(
+                _args.host, _args.session, ['ssh'] + cmd + [_args.host])
+        self._host, self._session_name = _args.host, _args.session
+        # Runner of session and fan-out cells, and future of their status
+        self._runner = self._session or self._fanout
+        self._done = None
+        # SSH Cannot fork into background without a command to execute.
+        # Popen instance is created in submit
+
+    def _connect(self):
+        """Reach the host through its master connection, started if
+        needed, in the ssh commands of the cell."""
+        if self._fanout is not None:
+            return
+        options = self._masters.options(self._host)
+        self.cmd = self._wlbin + options + [self._host, ] + self._ssh_args
+        ssh = ['ssh'] + options + self._ssh_args + [self._host]
+        if self._stager is not None:
+            self._stager.ssh = ssh
+        if self._session is not None:
+            self._session.ssh = ssh
+
+    def _remote_command(self, content):
+        """Remote command running the cell content.
+
+        The data directory is exported in the remote environment, as ssh
+        does not forward the local one, and the working directory of
+        staged cells is entered.
+        """
+        if self._session is not None:
+            # Session shells keep their directory between cells
+            if self._stager is not None:
+                content = "cd \"$EXECUTE_SESSION_DIR\" && mkdir -p {0} && " \
+                    "cd {0} || return 1\n{1}".format(
+                        shlex.quote(self._stager.workdir), content)
+        elif self._stager is not None:
+            content = "mkdir -p {0} && cd {0} || exit 1\n{1}".format(
+                shlex.quote(self._stager.workdir), content)
+        if self._data_dir is None:
+            return content
+        return "export EXECUTE_DATA_DIR={0}\n{1}".format(
+            shlex.quote(self._data_dir), content)
+
+    def _stage_files(self):
+        """Send the staged files, return an error message on failure."""
+        if not self._stage:
+            return None
+        try:
+            with self.trace.span('stage'):
+                self.staged = self._stager.stage(self._stage)
+        except (ValueError, StageError) as e:
+            self.p = None
+            self._drainers = (Spool(), Spool())
+            self._is_terminated = True
+            return "Staging failed: {0}\n".format(e)
+        return None
+
+    def _fetch_files(self, silent=True):
+        """Bring back the fetched files once the command is over."""
+        if not self._fetch:
+            return
+        try:
+            with self.trace.span('fetch'):
+                self.fetched = self._stager.fetch(self._fetch)
+        except (ValueError, StageError) as e:
+            sys.stderr.write("Fetching failed: {0}\n".format(e))
+            sys.stderr.flush()
+            return
+        if not silent:
+            sys.stdout.write("Fetched {0} file(s)\n".format(len(self.fetched)))
+            sys.stdout.flush()
+
+    def _started(self):
+        """Submission message of the started command."""
+        if self._session is not None:
+            message = "SSH session '{0}' on {1}\n".format(
+                self._session_name, self._host)
+        elif self._fanout is not None:
+            message = "SSH started on {0} hosts: {1}\n".format(
+                len(self._fanout.hosts), fold_hostlist(self._fanout.hosts))
+        else:
+            message = "SSH started with pid: {0}\n".format(self.p.pid)
+        if self._stage:
+            message = "Staged {0} file(s) to {1}\n".format(
+                len(self.staged), self._stager.workdir) + message
+        return message
+
+    def submit(self, content):
+        """Submit the cell content to the Popen instance.
+
+        Parameters
+        ----------
+        content: str
+            IPython cell content.
+
+        """
+        self._is_terminated = False
+        self.trace.mark('submit')
+        self._connect()
+        error = self._stage_files()
+        if error is not None:
+            return ('', error)
+        if self._runner is not None:
+            return self._submit_runner(content)
+
+        # Build Popen instance
+        try:
+            self.p = Popen(self.cmd + [self._remote_command(content), ],
+                           stdout=PIPE, stderr=PIPE)
+        except OSError as e:
+            if e.errno == errno.ENOENT:
+                print("Couldn't find program: %r" % self.cmd[0])
+                return
+            else:
+                raise e
+        except KeyboardInterrupt:
+            self._interrupt()
+            self._is_terminated = True
+        self.trace.mark('popen')
+        self.trace.mark('running')
+        self.trace.label = self.p.pid
+        # SSH output is bind to Popen command output
+        self._drainers = (PipeDrainer(self.p.stdout), PipeDrainer(self.p.stderr))
+        self.trace.mark('submitted')
+        if self.p.poll() is None:
+            if self._args_pid:
+                self._userns[self._args_pid] = self.p.pid
+            return (self._started(), '')
+        else:
+            self._fetch_files()
+            self._is_terminated = True
+            self.trace.mark('end')
+            return self.get_output()
+
+    async def submit_async(self, content):
+        """Submit the cell content to an asyncio subprocess.
+
+        Parameters
+        ----------
+        content: str
+            IPython cell content.
+
+        """
+        self._is_terminated = False
+        self.trace.mark('submit')
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self._connect)
+        error = await loop.run_in_executor(None, self._stage_files)
+        if error is not None:
+            return ('', error)
+        if self._runner is not None:
+            return self._submit_runner(content)
+        try:
+            self.p = await asyncio.create_subprocess_exec(
+                *(self.cmd + [self._remote_command(content), ]),
+                stdout=PIPE, stderr=PIPE)
+        except OSError as e:
+            if e.errno == errno.ENOENT:
+                print("Couldn't find program: %r" % self.cmd[0])
+                return
+            else:
+                raise e
+        self.trace.mark('popen')
+        self.trace.mark('running')
+        self.trace.label = self.p.pid
+        self.trace.mark('submitted')
+        self._drainers = (Spool(), Spool())
+        self._drain_tasks = [
+            asyncio.ensure_future(self._drain_async(stream, spool))
+            for stream, spool in zip((self.p.stdout, self.p.stderr),
+                                     self._drainers)]
+        if self._args_pid:
+            self._userns[self._args_pid] = self.p.pid
+        return (self._started(), '')
+
+    def _submit_runner(self, content):
+        """Queue the cell content in the persistent remote shell, or start
+        it on all the hosts."""
+        self.p = None
+        self._drainers = (Spool(), Spool())
+        self._done = self._runner.submit(self._remote_command(content),
+                                         *self._drainers)
+        self.trace.mark('submitted')
+        return (self._started(), '')
+
+    @staticmethod
+    async def _drain_async(stream, spool):
+        """Drain an asyncio stream into a spool."""
+        while True:
+            data = await stream.read(65536)
+            if not data:
+                break
+            spool.append(data)
+
+    async def wait_async(self, silent=True):
+        """Wait for the asyncio subprocess completion.
+
+        Parameters
+        ----------
+        slient : bool (default=True)
+            Display or not a progression state.
+        """
+        if self._done is not None:
+            try:
+                await asyncio.shield(asyncio.wrap_future(self._done))
+            except asyncio.CancelledError:
+                await asyncio.get_running_loop().run_in_executor(
+                    None, self.cancel)
+                raise
+        elif self.p is None:
+            return
+        elif isinstance(self.p, Popen):
+            return await super(SSHMgr, self).wait_async(silent=silent)
+        else:
+            try:
+                await self.p.wait()
+                await asyncio.gather(*self._drain_tasks)
+            except asyncio.CancelledError:
+                self.p.kill()
+                raise
+        await asyncio.get_running_loop().run_in_executor(None, self._fetch_files)
+        self.trace.mark('end')
+        if not silent:
+            sys.stdout.write("Done\n")
+            sys.stdout.flush()
+        self._is_terminated = True
+
+    def _write_stream(self, final=False):
+        """Write the new chunks of command output and error to the cell.
+
+        At most ``_DEFAULT_OUTPUT_MAX_SIZE`` bytes of each of them are
+        written, the rest being left to :py:meth:`get_output_view`.
+        """
+        from . import _DEFAULT_OUTPUT_MAX_SIZE
+        for follower, out in zip(self._followers, (sys.stdout, sys.stderr)):
+            while follower.offset < _DEFAULT_OUTPUT_MAX_SIZE:
+                follower.chunk_size = min(
+                    65536, _DEFAULT_OUTPUT_MAX_SIZE - follower.offset)
+                chunk = follower.read()
+                if not chunk:
+                    break
+                out.write(chunk)
+            if follower.offset >= _DEFAULT_OUTPUT_MAX_SIZE:
+                if follower not in self._truncated:
+                    self._truncated.append(follower)
+                    out.write("\n[... display truncated at {0} bytes, the rest "
+                              "is summarized at the end ...]\n".format(
+                                  follower.offset))
+            elif final:
+                out.write(follower.flush())
+            out.flush()
+
+    def wait_progress(self, silent=False):
+        """Wait for progression.
+
+        Unless silent, command output and error are displayed while the
+        command runs, up to ``_DEFAULT_OUTPUT_MAX_SIZE`` bytes each.
+
+        Parameters
+        ----------
+        slient : bool (default=False)
+            Display or not a progression state.
+        """
+        if self._done is not None:
+            # Session and fan-out outputs are only available once over
+            try:
+                self._done.result()
+            except KeyboardInterrupt:
+                self.cancel()
+                self._done.result()
+            return self._ended(silent)
+        if self.p is None:
+            return
+        if not silent:
+            self._followers = tuple(d.follower() for d in self._drainers)
+            self._truncated = []
+        while True:
+            try:
+                self.p.wait(None if silent else self._forward_interval)
+                break
+            except TimeoutExpired:
+                self._write_stream()
+        for d in self._drainers:
+            d.join()
+        if not silent:
+            self._write_stream(final=True)
+        self._ended(silent)
+
+    def _ended(self, silent):
+        """Fetch the files of the ended command and mark it terminated."""
+        self._fetch_files(silent)
+        self.trace.mark('end')
+        if not silent:
+            sys.stdout.write("Done\n")
+            sys.stdout.flush()
+        self._is_terminated = True
+
+    @traced('output')
+    def get_output(self):
+        """Get job output
+
+        When the output was displayed during :py:meth:`wait_progress`,
+        only the part not already displayed is returned.
+
+        Returns
+        -------
+        stdout: str
+            Job standard output
+        stderr: str
+            Job standard errput
+        """
+        if self._is_terminated:
+            if self.out is None and self.err is None:
+                offsets = (0, 0)
+                if self._followers is not None:
+                    offsets = [f.offset for f in self._followers]
+                for d in self._drainers:
+                    d.join()
+                self.out, self.err = [py3compat.bytes_to_str(d.read(o))
+                                      for d, o in zip(self._drainers, offsets)]
+            return(self.out, self.err)
+        else:
+            return None
+
+    @traced('output')
+    def get_full_output(self):
+        """Get the whole command output and error, including the parts
+        displayed during :py:meth:`wait_progress`."""
+        if not self._is_terminated:
+            return None, None
+        for d in self._drainers:
+            d.join()
+        return tuple(py3compat.bytes_to_str(d.read()) for d in self._drainers)
+
+    @traced('output')
+    def get_output_view(self, full=False):
+        """Get views of the command output and error spools.
+
+        Parameters
+        ----------
+        full : bool (default=False)
+            Include the parts displayed during :py:meth:`wait_progress`.
+        """
+        if not self._is_terminated:
+            return OutputView(b''), OutputView(b'')
+        offsets = (0, 0)
+        if self._followers is not None and not full:
+            offsets = [f.offset for f in self._followers]
+        for d in self._drainers:
+            d.join()
+        return tuple(d.view(o) for d, o in zip(self._drainers, offsets))
+
+    @property
+    def cache_cmd(self):
+        """ssh command line without the master connection options."""
+        return self._cache_cmd
+
+    @property
+    def succeeded(self):
+        """Whether the remote command exited with status 0."""
+        if self._done is not None:
+            return self._is_terminated and self._done.result() == 0
+        return self._is_terminated and self.p is not None and \
+            self.p.returncode == 0
+
+    @property
+    def results(self):
+        """``(status, out, err, elapsed)`` by host of a ``--hosts`` cell
+        (see :py:class:`SSHFanout`), None for other cells."""
+        if self._fanout is None:
+            return None
+        return self._fanout.results
+
+    def cancel(self):
+        """Interrupt the command, end the session of a session cell, or
+        kill the commands of a fan-out."""
+        if self._done is not None:
+            if not self._done.done():
+                self._runner.cancel()
+        else:
+            super(SSHMgr, self).cancel()
+
+
+class SlurmStatePoller(object):
+    """Process-wide Slurm job state poller.
+
+    Every live :py:class:`SlurmMgr` registers its job id here. When a
+    manager asks for a state older than the poller tick, the states of
+    all registered jobs are resolved at once with a single ``sacct`` call
+    (and a single ``squeue`` call for jobs not yet known by accounting),
+    or a single slurmrestd request (see
+    :py:mod:`~execute_batch_scheduler.slurmrest`).
+    Other managers then read their state from the shared cache without
+    spawning any subprocess.
+
+    For job arrays, the states of all the tasks are tracked and the array
+    state is an aggregate of them (see :py:meth:`get_task_states`).
+    """
+
+    def __init__(self, tick=None):
+        """Initialize an empty poller.
+
+        Parameters
+        ----------
+        tick : float
+            Minimal delay in seconds between two scheduler queries
+            (default from ``_DEFAULT_SLURM_POLL_TICK``).
+        """
+        self._tick = tick
+        self._lock = threading.RLock()
+        self._jobids = set()
+        self._states = {}
+        self._tasks = {}
+        self._last_refresh = 0.
+        # Scheduler queries are recorded in the session traces, only the
+        # latest ones being kept
+        from . import _DEFAULT_TRACE_MAX
+        self.trace = Trace(type(self).__name__, maxlen=_DEFAULT_TRACE_MAX)
+        BaseMgr._traces.attach(self.trace)
+
+    @property
+    def tick(self):
+        """Minimal delay in seconds between two scheduler queries."""
+        if self._tick is None:
+            from . import _DEFAULT_SLURM_POLL_TICK
+            return _DEFAULT_SLURM_POLL_TICK
+        return self._tick
+
+    def register(self, jobid):
+        """Add a job to the set of polled jobs."""
+        with self._lock:
+            self._jobids.add(str(jobid))
+
+    def unregister(self, jobid):
+        """Remove a job from the set of polled jobs."""
+        with self._lock:
+            self._jobids.discard(str(jobid))
+            self._states.pop(str(jobid), None)
+            self._tasks.pop(str(jobid), None)
+
+    def get_state(self, jobid, max_age=None):
+        """Get a job state from the shared cache.
+
+        The cache is refreshed for all registered jobs when it is older
+        than ``max_age`` or when the job was not part of the last query.
+
+        Parameters
+        ----------
+        jobid : int or str
+            Slurm job id.
+        max_age : float
+            Maximal age of the cached state (default to the poller tick).
+
+        Returns
+        -------
+        state: str
+            Job state as reported by ``sacct`` or ``squeue``.
+        """
+        jobid = str(jobid)
+        if max_age is None:
+            max_age = self.tick
+        with self._lock:
+            self._jobids.add(jobid)
+            if jobid not in self._states or \
+                    time.time() - self._last_refresh >= max_age:
+                self.refresh()
+            return self._states.get(jobid, '')
+
+    def get_task_states(self, jobid, max_age=None):
+        """Get the states of the tasks of a job array.
+
+        Parameters
+        ----------
+        jobid : int or str
+            Slurm array job id.
+        max_age : float
+            Maximal age of the cached states (default to the poller tick).
+
+        Returns
+        -------
+        states: dict
+            Task states by task index.
+        """
+        with self._lock:
+            self.get_state(jobid, max_age=max_age)
+            return dict(self._tasks.get(str(jobid), {}))
+
+    @staticmethod
+    def _expand_tasks(spec):
+        """Expand array task indices like ``3`` or ``[1,4-6%2]``."""
+        tasks = []
+        for r in spec.strip('[]').split('%')[0].split(','):
+            if '-' in r:
+                start, stop = r.split('-')
+                tasks.extend(range(int(start), int(stop) + 1))
+            elif r:
+                tasks.append(int(r))
+        return tasks
+
+    def _parse(self, line, sep, states, tasks):
+        """Store the state of a job or job array task from a query output
+        line."""
+        jobid, _, state = line.strip().partition(sep)
+        jobid, _, task = jobid.strip().partition('_')
+        if jobid not in states:
+            return
+        if task:
+            for t in self._expand_tasks(task):
+                tasks.setdefault(jobid, {})[t] = state.strip()
+        else:
+            states[jobid] = state.strip()
+
+    @staticmethod
+    def _aggregate(task_states):
+        """Aggregate the task states of a job array in a single state."""
+        states = set(s.split(' ')[0] for s in task_states.values())
+        if all(s in SlurmMgr._end_states for s in states):
+            return ' '.join(sorted(states))
+        if states.intersection(SlurmMgr._run_states):
+            return 'RUNNING'
+        return 'PENDING'
+
+    def refresh(self):
+        """Query the scheduler for all registered jobs at once."""
+        with self._lock:
+            jobids = sorted(self._jobids)
+            states = dict((j, '') for j in jobids)
+            tasks = {}
+            rest = SlurmRestClient.default()
+            if jobids and rest is not None:
+                with self.trace.span('slurmrestd'):
+                    rows = rest.job_states(jobids)
+                for row in rows:
+                    self._parse('|'.join(row), '|', states, tasks)
+                for jobid, task_states in tasks.items():
+                    states[jobid] = self._aggregate(task_states)
+            elif jobids:
+                sacct = ['sacct', '-j', ','.join(jobids),
+                         '--format=JobID,State', '-n', '-X', '-P']
+                with self.trace.span('sacct'):
+                    out = check_output(sacct)
+                for line in py3compat.bytes_to_str(out).splitlines():
+                    self._parse(line, '|', states, tasks)
+                missing = [j for j in jobids if not (states[j] or j in tasks)]
+                if missing:
+                    # squeue fails when one of the jobs is already purged,
+                    # its output is still valid for the others.
+                    squeue = ['squeue', '-j', ','.join(missing),
+                              '-h', '-r', '-o', '%i %T']
+                    with self.trace.span('squeue'):
+                        out, _ = Popen(squeue, stdout=PIPE,
+                                       stderr=PIPE).communicate()
+                    for line in py3compat.bytes_to_str(out).splitlines():
+                        self._parse(line, ' ', states, tasks)
+                for jobid, task_states in tasks.items():
+                    states[jobid] = self._aggregate(task_states)
+            self._states = states
+            self._tasks = tasks
+            self._last_refresh = time.time()
+
+
+class SlurmStartEstimator(object):
+    """Start time estimates of a job on candidate partitions.
+
+    Estimates are given by ``sbatch --test-only``, run concurrently on all
+    the candidate partitions: ``_DEFAULT_SLURM_AUTO_PARTITIONS``, or all
+    the partitions listed by ``sinfo``. They are cached for
+    ``_DEFAULT_SLURM_AUTO_CACHE`` seconds, keyed by the submission
+    arguments and the ``#SBATCH`` directives of the script, so that
+    repeated cells do not probe the scheduler again.
+    """
+
+    _start_re = re.compile(r'to start at (\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d)')
+
+    def __init__(self):
+        """Initialize an empty estimate cache."""
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def _cached(self, key, compute):
+        """Get a cached value, computed when missing or expired."""
+        from . import _DEFAULT_SLURM_AUTO_CACHE
+        now = time.time()
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is not None and now - entry[0] < _DEFAULT_SLURM_AUTO_CACHE:
+                return entry[1]
+        value = compute()
+        with self._lock:
+            self._cache[key] = (now, value)
+        return value
+
+    @staticmethod
+    def _sinfo_partitions():
+        try:
+            out = check_output(['sinfo', '--noheader', '--format=%R'])
+        except (OSError, CalledProcessError):
+            return []
+        return list(collections.OrderedDict.fromkeys(
+            py3compat.bytes_to_str(out).split()))
+
+    def partitions(self):
+        """Get the candidate partitions."""
+        from . import _DEFAULT_SLURM_AUTO_PARTITIONS
+        if _DEFAULT_SLURM_AUTO_PARTITIONS:
+            return [p.strip() for p in _DEFAULT_SLURM_AUTO_PARTITIONS.split(',')
+                    if p.strip()]
+        return self._cached(('sinfo', ), self._sinfo_partitions)
+
+    def _estimate(self, args, script, partition):
+        """Estimated start time of the job on a partition, None when it is
+        not eligible."""
+        p = Popen(['sbatch', '--test-only', '--partition=' + partition] + args,
+                  stdin=PIPE, stdout=PIPE, stderr=PIPE)
+        out, err = p.communicate(script)
+        m = self._start_re.search(py3compat.bytes_to_str(out + err))
+        if p.returncode != 0 or m is None:
+            return None
+        return datetime.datetime.strptime(m.group(1), '%Y-%m-%dT%H:%M:%S')
+
+    def estimates(self, args, script, partitions=None):
+        """Get the start time estimates of a job.
+
+        Parameters
+        ----------
+        args : list of str
+            ``sbatch`` arguments, without partition.
+        script : bytes
+            Job script.
+        partitions : list of str
+            Candidate partitions (default from :py:meth:`partitions`).
+
+        Returns
+        -------
+        estimates: dict
+            Estimated start :py:class:`datetime.datetime` by partition in
+            candidate order, None for partitions where the job is not
+            eligible.
+        """
+        partitions = list(partitions or self.partitions())
+        directives = tuple(line for line in script.splitlines()
+                           if line.startswith(b'#SBATCH'))
+
+        def probe():
+            if not partitions:
+                return collections.OrderedDict()
+            with ThreadPoolExecutor(min(8, len(partitions))) as pool:
+                starts = pool.map(lambda p: self._estimate(args, script, p),
+                                  partitions)
+                return collections.OrderedDict(zip(partitions, starts))
+        return self._cached((tuple(args), directives, tuple(partitions)), probe)
+
+    def choose(self, args, script, partitions=None):
+        """Choose the partition with the earliest estimated start.
+
+        Parameters are those of :py:meth:`estimates`. Ties go to the first
+        candidate.
+
+        Returns
+        -------
+        partition: str
+            Chosen partition.
+        estimates: dict
+            Estimates of all the candidates (see :py:meth:`estimates`).
+
+        Raises
+        ------
+        ValueError
+            If the job is eligible on no candidate partition.
+        """
+        estimates = self.estimates(args, script, partitions)
+        eligible = [(start, i, p) for i, (p, start) in enumerate(estimates.items())
+                    if start is not None]
+        if not eligible:
+            raise ValueError("no eligible partition among '{0}'".format(
+                ','.join(estimates)))
+        return min(eligible)[2], estimates
+
+
+class SlurmMgr(BaseMgr):
+    """Slurm workload manager.
+
+    It enforces the slurm standard output and error files to be read and
+    display in Cell output after completion.
+
+
+    Slurm output and error files are stored in ``$HOME/python-execute-slurm.${SLURM_JOB_ID}.[out|err]``.
+
+    With the ``--stream`` argument, output and error files are followed
+    while the job runs and displayed in the cell as they grow. The same
+    stream is available by iterating over the manager instance (see
+    :py:meth:`iter_output`).
+
+    A parameter sweep (see :py:meth:`set_sweep`) is submitted as a single
+    job array and tracked as one job with per-task states. Output files
+    are then ``$HOME/python-execute-slurm.${SLURM_ARRAY_JOB_ID}_${SLURM_ARRAY_TASK_ID}.[out|err]``.
+
+    A cell queued in a bundle (see :py:meth:`set_bundle`) is only
+    submitted when the bundle is flushed, as a ``srun`` step of the bundle
+    job. Its manager then follows this step only.
+
+    With the ``--session[=NAME]`` argument, the cell runs as a ``srun``
+    step of a held allocation (see :py:class:`SlurmAllocation`) instead of
+    a new job, avoiding the queue wait.
+
+    With ``--partition=auto`` (or ``auto:PART1,PART2`` to give the
+    candidates), the job is submitted to the partition where it is
+    estimated to start first (see :py:class:`SlurmStartEstimator`).
+
+    When ``_DEFAULT_SLURMREST_URL`` is set, jobs are submitted, cancelled
+    and queried through slurmrestd over pooled HTTP connections (see
+    :py:mod:`~execute_batch_scheduler.slurmrest`) instead of the Slurm
+    commands. Held allocations still use ``salloc`` and ``srun``.
+
+    With the ``--efficiency`` argument, the CPU and memory usage of the
+    job and its steps is read from Slurm accounting once the job is over
+    (see :py:meth:`get_efficiency`) and summarized after its state.
+
+    Submitted jobs are recorded in the job journal (see
+    :py:class:`~execute_batch_scheduler.journal.JobJournal`), so that the
+    jobs left by a dead kernel are followed again with :py:meth:`reattach`.
+
+    For POSIX shells, the job script touches a sentinel file
+    ``$HOME/python-execute-slurm.${SLURM_JOB_ID}.done`` on exit. Job
+    completion is then noticed as soon as this file appears, the
+    scheduler being only polled as a fallback.
+
+    .. todo::
+        Add a way to change out/err slurm files location.
+
+    """
+
+    _wlbin = ['sbatch', '-n', '1', ]
+    _end_states = ('CANCELLED', 'COMPLETED', 'FAILED',
+                   'NODE_FAIL', 'PREEMPTED', 'TIMEOUT')
+    _wait_states = ('CONFIGURING', 'PENDING')
+    _run_states = ('COMPLETING', 'RUNNING', 'SUSPENDED')
+    # Job states are shared among all the instances
+    _poller = SlurmStatePoller()
+    # Start time estimates are shared among all the instances
+    _estimator = SlurmStartEstimator()
+
+    def __init__(self, args, shell, userns):
+        """Initialize the slurm submission.
+
+        The ``sbatch`` command is achieved through a :py:class:`subprocess.Popen` object
+
+        Parameters
+        ----------
+        args : str
+            String containing workload scheduler specific arguments.
+        shell : str
+            Shell to use whithin the workload scheduler
+        userns : dict
+            User namespace from cell_magics
+        """
+        super(SlurmMgr, self).__init__(args, shell, userns)
+
+        from . import _DEFAULT_SLURM_OUTERR_FILE
+        if _DEFAULT_SLURM_OUTERR_FILE is None:
+            self._outerr_files = os.path.join(os.environ['HOME'], "python-execute-slurm.%J")
         else:
             self._outerr_files = _DEFAULT_SLURM_OUTERR_FILE
         _outerr_pardir = os.path.abspath(os.path.join(self._outerr_files, os.pardir))
@@ -359,29 +2356,308 @@ class SlurmMgr(BaseMgr):
         parser = MagicArgumentParser()
         parser.add_argument('--jobid', type=str,
                             help='Variable to store Slurm Job Id')
+        parser.add_argument('--stream', action='store_true',
+                            help='Display job output while the job runs')
+        parser.add_argument('--session', type=str, nargs='?', const='default',
+                            help='Run the cell as a step of the given held allocation')
+        parser.add_argument('--efficiency', action='store_true',
+                            help='Report CPU and memory efficiency once the job is over')
         _args, cmd = parser.parse_known_args(args)
-        self.cmd = self._wlbin + cmd + [
+        self._cmd_args = cmd
+        # Candidate partitions of --partition=auto (empty for all of them)
+        self._auto_partitions = None
+        rest, partition = self._split_partition(cmd)
+        if partition == 'auto' or (partition or '').startswith('auto:'):
+            self._cmd_args = rest
+            self._auto_partitions = [p for p in partition[5:].split(',') if p]
+        #: Chosen partition and start estimates of --partition=auto
+        self.partition, self.partition_estimates = None, None
+        self._sweep = None
+        self._sweep_file = None
+        self.task_states = {}
+        self._task_outputs = {}
+        self._bundle = None
+        self._step_files = None
+        self._session = None
+        if _args.session:
+            self._session = SlurmAllocation.get(_args.session)
+        # Jobs waited for, and dependency graph once submitted
+        self._after = None
+        self.graph = None
+        # Final job state
+        self.state = None
+        self._build_cmd()
+        self._is_started = False
+        self._is_terminated = False
+        self._args_jobid = _args.jobid
+        self._stream = _args.stream
+        from . import _DEFAULT_SLURM_EFFICIENCY
+        self._report_efficiency = _args.efficiency or _DEFAULT_SLURM_EFFICIENCY
+        #: Resource usage reports by job id (see :py:meth:`get_efficiency`)
+        self.efficiency = None
+        self._followers = None
+        # Drainers of the srun command of a held allocation step
+        self._drainers = None
+        # slurmrestd client, None to use the Slurm commands
+        self._rest = SlurmRestClient.default()
+        # Job journal, None when disabled, and whether the job is recorded
+        self._journal = JobJournal.default()
+        self._journaled = False
+        #: Namespace variable and description recorded in the job journal
+        self.name, self.description = None, None
+
+    @staticmethod
+    def _split_partition(args):
+        """Remove the partition option from ``sbatch`` arguments.
+
+        Returns
+        -------
+        args: list of str
+            Other arguments.
+        partition: str
+            Partition, None if not given.
+        """
+        rest, partition, i = [], None, 0
+        while i < len(args):
+            arg = args[i]
+            if arg in ('-p', '--partition') and i + 1 < len(args):
+                partition = args[i + 1]
+                i += 1
+            elif arg.startswith('--partition='):
+                partition = arg.split('=', 1)[1]
+            elif arg.startswith('-p') and not arg.startswith('--'):
+                partition = arg[2:]
+            else:
+                rest.append(arg)
+            i += 1
+        return rest, partition
+
+    def _place(self, content):
+        """Add the partition with the earliest estimated start to the
+        submission arguments of a ``--partition=auto`` job.
+
+        Returns
+        -------
+        error: str
+            Error message when no partition is eligible, None otherwise.
+        """
+        if self._auto_partitions is None:
+            return None
+        with self.trace.span('placement'):
+            try:
+                self.partition, self.partition_estimates = \
+                    self._estimator.choose(self.cmd[1:],
+                                           self._build_script(content, b''),
+                                           self._auto_partitions)
+            except ValueError as e:
+                return "Partition auto: {0}\n".format(e)
+        self._cmd_args = self._cmd_args + ['--partition=' + self.partition]
+        self._auto_partitions = None
+        self._build_cmd()
+        return None
+
+    def _placed(self, out, err):
+        """Prepend the chosen partition to the submission output."""
+        if self.partition is not None and self._is_started:
+            out = "Partition {0} selected, estimated start {1}\n".format(
+                self.partition,
+                self.partition_estimates[self.partition].isoformat()) + out
+        return out, err
+
+    def _build_cmd(self):
+        """Build submission command line."""
+        self.cmd = self._wlbin + self._cmd_args + [
             '--output=' + self._outerr_files + '.out',
             '--error=' + self._outerr_files + '.err']
-        self._is_started = False
-        self._is_terminated = False
-        self._args_jobid = _args.jobid
+        if self._sweep:
+            self.cmd.append('--array=0-{0}'.format(len(self._sweep) - 1))
+
+    def set_sweep(self, values):
+        """Run the cell once for each parameter value, as a job array.
+
+        Values are written one per line in a file whose path is exported
+        in the ``EXECUTE_SWEEP_FILE`` environment variable. The value of
+        a task is at line ``$SLURM_ARRAY_TASK_ID + 1`` and, for POSIX
+        shells, is also exported in the ``SWEEP_VALUE`` environment
+        variable.
+
+        Parameters
+        ----------
+        values : list
+            Parameter values (see :py:func:`parse_sweep`).
+
+        Raises
+        ------
+        ValueError
+            If there is no value.
+        """
+        if not values:
+            raise ValueError("A parameter sweep needs at least one value")
+        self._sweep = [str(v) for v in values]
+        self._outerr_files = self._outerr_files.replace(
+            '%J', '%A_%a').replace('%j', '%A_%a')
+        if self._stream:
+            sys.stderr.write("Output streaming is not available for parameter sweeps\n")
+            sys.stderr.flush()
+            self._stream = False
+        self._build_cmd()
+
+    def set_label(self, name, description):
+        """Name the job in the job journal.
+
+        Parameters
+        ----------
+        name : str
+            Namespace variable of the manager, where it is stored again
+            when reattached.
+        description : str
+            Short description of the cell.
+        """
+        self.name, self.description = name, description
+
+    def set_bundle(self, name):
+        """Queue the cell in a bundle instead of submitting it.
+
+        Parameters
+        ----------
+        name : str
+            Bundle name (see :py:class:`SlurmBundle`).
+        """
+        self._bundle = SlurmBundle.get(name)
+
+    def set_dependency(self, after):
+        """Submit the job at once, to be started once other jobs are over.
+
+        The job is submitted with ``--dependency``, and with
+        ``--kill-on-invalid-dep=yes`` so that it is cancelled when an
+        ``afterok`` dependency fails instead of pending forever. Jobs
+        already over are not waited for. Once submitted, the job belongs
+        to the graph of the jobs it waits for (see :py:class:`SlurmJobGraph`).
+
+        Parameters
+        ----------
+        after : list of tuple
+            Managers of the jobs to wait for, with the dependency type:
+            ``afterok`` (start once they completed) or ``afterany``
+            (start once they are over).
+
+        Raises
+        ------
+        ValueError
+            If a dependency type is unknown, if a manager is not a
+            submitted Slurm job, if an ``afterok`` dependency is over
+            without completing, or for a step of a held allocation.
+        """
+        if self._session is not None:
+            raise ValueError("steps of held allocations cannot wait for jobs")
+        deps = []
+        for job_mgr, kind in after:
+            if kind not in ('afterok', 'afterany'):
+                raise ValueError("unknown dependency type '{0}'".format(kind))
+            if not isinstance(job_mgr, SlurmMgr) or not job_mgr._is_started \
+                    or job_mgr._session is not None \
+                    or job_mgr._step_files is not None:
+                raise ValueError("only submitted slurm jobs can be waited for")
+            if not job_mgr._is_terminated:
+                deps.append('{0}:{1}'.format(kind, job_mgr._jobid))
+            elif kind == 'afterok' and not job_mgr.succeeded:
+                raise ValueError("job {0} ended with state {1}".format(
+                    job_mgr._jobid, job_mgr.state))
+        self._after = list(after)
+        if deps:
+            self._cmd_args = self._cmd_args + [
+                '--dependency=' + ','.join(deps), '--kill-on-invalid-dep=yes']
+            self._build_cmd()
+
+    def _bundle_submitted(self, job_mgr, step_files):
+        """Follow the step of a submitted bundle job.
+
+        Parameters
+        ----------
+        job_mgr : :py:class:`SlurmMgr`
+            Manager of the bundle job.
+        step_files : str
+            Step output, error and sentinel files base name.
+        """
+        self._step_files = step_files
+        self._is_started = job_mgr._is_started
+        self._is_terminated = job_mgr._is_terminated
+        # Bundle job submission stands for the submission of its steps
+        for phase in ('submit', 'popen', 'submitted'):
+            if job_mgr.trace.first(phase) is not None:
+                self.trace.mark(phase, job_mgr.trace.first(phase))
+        if self._is_started:
+            self._jobid = job_mgr._jobid
+            self.trace.label = "{0} {1}".format(
+                self._jobid, os.path.basename(step_files))
+            # Sentinel file is written by the bundle job script
+            self._sentinel = True
+            if self._args_jobid:
+                self._userns[self._args_jobid] = self._jobid
+
+    def _submit_env(self):
+        """Environment of the submission command."""
+        if not self._sweep:
+            return self._job_env()
+        fd, self._sweep_file = tempfile.mkstemp(
+            prefix='python-execute-sweep.',
+            dir=os.path.abspath(os.path.join(self._outerr_files, os.pardir)))
+        with os.fdopen(fd, 'w') as f:
+            f.write('\n'.join(self._sweep) + '\n')
+        return dict(self._job_env() or os.environ,
+                    EXECUTE_SWEEP_FILE=self._sweep_file)
+
+    def submit(self, content):
+        """Submission of the cell content to the workload manager.
+
+        Use a Popen instance.
+        Return the output and error of submission.
+
+        Parameters
+        ----------
+        content: str
+            IPython cell content.
+
+        Returns
+        -------
+        stdout: str
+            Submission command standard output.
+        stderr: str
+            Submission command standard errput.
 
+        """
+        if self._bundle is not None:
+            return self._bundle.add(self, content)
+        self.trace.mark('submit')
+        if self._session is not None:
+            return self._submit_step(content)
+        error = self._place(content)
+        if error is not None:
+            return self._submitted('', error)
+        if self._rest is not None:
+            return self._placed(*self._submit_rest(content))
         # Build Popen instance
         try:
-            self.p = Popen(self.cmd, stdout=PIPE, stderr=PIPE, stdin=PIPE,)
+            self.p = Popen(self.cmd, stdout=PIPE, stderr=PIPE, stdin=PIPE,
+                           env=self._submit_env())
         except OSError as e:
             if e.errno == errno.ENOENT:
                 print("Couldn't find program: %r" % self.cmd[0])
                 return
             else:
                 raise e
+        self.trace.mark('popen')
+        try:
+            out, err = self.p.communicate(
+                self._build_script(content, self._prologue()))
+        except KeyboardInterrupt:
+            self._interrupt()
+            return
+        return self._placed(*self._submitted(py3compat.bytes_to_str(out),
+                                             py3compat.bytes_to_str(err)))
 
-    def submit(self, content):
-        """Submission of the cell content to the workload manager.
-
-        Use a Popen instance.
-        Return the output and error of submission.
+    async def submit_async(self, content):
+        """Submission of the cell content through an asyncio subprocess.
 
         Parameters
         ----------
@@ -396,80 +2672,696 @@ class SlurmMgr(BaseMgr):
             Submission command standard errput.
 
         """
-        script = self.shebang
-        script += content.encode('utf8', 'replace')
-        if not script.endswith(b'\n'):
-            script += b'\n'
+        if self._bundle is not None:
+            return self._bundle.add(self, content)
+        self.trace.mark('submit')
+        loop = asyncio.get_running_loop()
+        if self._session is not None:
+            return await loop.run_in_executor(None, self._submit_step, content)
+        error = await loop.run_in_executor(None, self._place, content)
+        if error is not None:
+            return self._submitted('', error)
+        if self._rest is not None:
+            return self._placed(*await loop.run_in_executor(
+                None, self._submit_rest, content))
+        try:
+            self.p = await asyncio.create_subprocess_exec(
+                *self.cmd, stdout=PIPE, stderr=PIPE, stdin=PIPE,
+                env=self._submit_env())
+        except OSError as e:
+            if e.errno == errno.ENOENT:
+                print("Couldn't find program: %r" % self.cmd[0])
+                return
+            else:
+                raise e
+        self.trace.mark('popen')
+        out, err = await self.p.communicate(
+            self._build_script(content, self._prologue()))
+        return self._placed(*self._submitted(py3compat.bytes_to_str(out),
+                                             py3compat.bytes_to_str(err)))
+
+    def _submit_rest(self, content):
+        """Submit the job script through slurmrestd.
+
+        Returns
+        -------
+        stdout: str
+            Submission message, like the ``sbatch`` one.
+        stderr: str
+            Submission error message.
+        """
+        try:
+            job = job_description(self.cmd[1:], self._submit_env() or os.environ)
+            script = self._build_script(content, self._prologue())
+            self.trace.mark('popen')
+            jobid = self._rest.submit(script.decode('utf8', 'replace'), job)
+        except (ValueError, SlurmRestError) as e:
+            return self._submitted('', "{0}\n".format(e))
+        return self._submitted("Submitted batch job {0}\n".format(jobid), '')
+
+    def _scancel(self):
+        """Cancel the job with slurmrestd or ``scancel``."""
+        if self._rest is not None:
+            try:
+                self._rest.cancel(self._jobid)
+            except SlurmRestError as e:
+                sys.stderr.write("{0}\n".format(e))
+                sys.stderr.flush()
+        else:
+            check_call(['scancel', str(self._jobid)])
+
+    def _submit_step(self, content):
+        """Run the cell content as a step of the held allocation.
+
+        The allocation is acquired, or reacquired if expired, first.
+
+        Returns
+        -------
+        stdout: str
+            Step start message.
+        stderr: str
+            Allocation error message.
+        """
+        jobid = self._session.jobid()
+        if jobid is None:
+            self._is_terminated = True
+            return ('', "Cannot acquire allocation '{0}'\n".format(
+                self._session.name))
+        self._jobid = jobid
+        fd, script = tempfile.mkstemp(
+            prefix='python-execute-step.', suffix='.sh',
+            dir=os.path.abspath(os.path.join(self._outerr_files, os.pardir)))
+        with os.fdopen(fd, 'wb') as f:
+            f.write(self._build_script(content))
+        os.chmod(script, 0o755)
+        self._step_files = script[:-len('.sh')]
+        self.cmd = ['srun', '--jobid={0}'.format(jobid)] + self._cmd_args + [
+            '--output=' + self._step_files + '.out',
+            '--error=' + self._step_files + '.err', script]
+        try:
+            with open(os.devnull, 'rb') as devnull:
+                self.p = Popen(self.cmd, stdin=devnull, stdout=PIPE,
+                               stderr=PIPE, env=self._job_env())
+        except OSError as e:
+            if e.errno == errno.ENOENT:
+                print("Couldn't find program: %r" % self.cmd[0])
+                return
+            else:
+                raise e
+        self.trace.mark('popen')
+        self._drainers = (PipeDrainer(self.p.stdout), PipeDrainer(self.p.stderr))
+        self._session.step_started()
+        self._is_started = True
+        self.trace.label = jobid
+        self.trace.mark('submitted')
+        if self._args_jobid:
+            self._userns[self._args_jobid] = self._jobid
+        return ("Step started in allocation {0}\n".format(jobid), '')
+
+    def _wait_step(self, silent=False):
+        """Wait for the completion of a step of the held allocation.
+
+        Step state is given by the ``srun`` process, so that completion is
+        noticed without querying the scheduler. Nothing is left to wait
+        for once the step is over, like after :py:meth:`iter_output`.
+        """
+        if self._is_terminated:
+            return
+        stream = self._stream and not silent
+        if stream:
+            job_f = self._job_files()
+            self._followers = (FileFollower(job_f + '.out'),
+                               FileFollower(job_f + '.err'))
+            silent = True
+        next_step = time.time()
         try:
-            out, err = self.p.communicate(script)
+            while True:
+                now = time.time()
+                if now >= next_step:
+                    next_step = now + self._step_running(silent=silent, wait=False)
+                timeout = next_step - now
+                if stream:
+                    timeout = min(timeout, self._poller.tick)
+                try:
+                    self.p.wait(timeout)
+                    break
+                except TimeoutExpired:
+                    if stream:
+                        self._write_stream()
         except KeyboardInterrupt:
+            sys.stdout.write("Terminate step of allocation {0} \n".format(self._jobid))
+            sys.stdout.flush()
+            # srun forwards the signal to the step tasks
             self._interrupt()
-            return
-        out = py3compat.bytes_to_str(out)
-        err = py3compat.bytes_to_str(err)
+        jobstate = self._get_job_state()
+        self._end_step(jobstate)
+        if stream:
+            self._write_stream(final=True)
+        elif not silent:
+            sys.stdout.write("\n")
+        if stream or not silent:
+            self._print_end(jobstate)
+
+    def _end_step(self, jobstate):
+        """Release the held allocation step once its ``srun`` process is
+        over."""
+        for d in self._drainers:
+            d.join()
+        self._session.step_ended()
+        self._end_wait(jobstate)
+        script = self._step_files + '.sh'
+        if os.path.exists(script):
+            os.remove(script)
+
+    def _submitted(self, out, err):
+        """Get the job id from submission command output."""
         # Get the jobid
         self._jobid = 0
+        self.trace.mark('submitted')
         if out.find("Submitted batch job") == 0:
             self._jobid = int(out.split(' ')[-1])
+            self.trace.label = self._jobid
             self._is_started = True
+            self._poller.register(self._jobid)
             if self._args_jobid:
                 self._userns[self._args_jobid] = self._jobid
+            if self._after is not None:
+                SlurmJobGraph.link(self, self._after)
+            self._journaled = self._record('record', self._jobid,
+                                           self._cmd_args, self._shell,
+                                           self._outerr_files, self._sweep,
+                                           self._sweep_file, self.name,
+                                           self.description)
         else:
             sys.stderr.write("Error during job submission\n")
             sys.stderr.write("Submission arguments : {0}\n".format(' '.join(self.cmd)))
             self._is_terminated = True
         return (out, err)
 
-    def _get_job_state(self):
-        """Find job state"""
-        sacct = "sacct -j{0} --format=State -n -X".format(self._jobid)
-        jobstate = check_output(sacct.split(' '))
-        if (jobstate == b''):
-            squeue = "squeue -j{0} -h -o '%T'".format(self._jobid)
-            jobstate = check_output(squeue.split(' '))
-        return py3compat.bytes_to_str(jobstate)
+    def _record(self, method, *args):
+        """Call a job journal method, warning when the journal fails.
+
+        Returns
+        -------
+        recorded: bool
+            Whether the journal was updated.
+        """
+        if self._journal is None:
+            return False
+        try:
+            getattr(self._journal, method)(*args)
+        except (sqlite3.Error, OSError) as e:
+            sys.stderr.write("Job journal {0}: {1}\n".format(
+                self._journal.path, e))
+            return False
+        return True
+
+    @classmethod
+    def reattach(cls, jobs, userns):
+        """Follow again the jobs recorded in the job journal.
+
+        The states of all the jobs are queried at once. Jobs no longer
+        known by the scheduler are over with an ``UNKNOWN`` state.
+
+        Parameters
+        ----------
+        jobs : list of dict
+            Journal records (see
+            :py:meth:`~execute_batch_scheduler.journal.JobJournal.orphans`).
+        userns : dict
+            User namespace from cell_magics
+
+        Returns
+        -------
+        job_mgrs: list of :py:class:`SlurmMgr`
+            Managers of the jobs, those of jobs over being terminated.
+        """
+        job_mgrs = []
+        for job in jobs:
+            job_mgr = cls([], job['shell'], userns)
+            job_mgr._cmd_args = job['args']
+            job_mgr._outerr_files = job['outerr']
+            job_mgr._sweep = job['sweep']
+            job_mgr._sweep_file = job['sweep_file']
+            job_mgr._build_cmd()
+            job_mgr._epilogue()
+            job_mgr._jobid = job['jobid']
+            job_mgr.trace.label = job_mgr._jobid
+            job_mgr.name, job_mgr.description = job['name'], job['description']
+            job_mgr._is_started = True
+            job_mgr._journaled = job_mgr._journal is not None
+            cls._poller.register(job_mgr._jobid)
+            job_mgrs.append(job_mgr)
+        for i, job_mgr in enumerate(job_mgrs):
+            # First query refreshes the states of all the jobs
+            jobstate = job_mgr._get_job_state(max_age=0 if i == 0 else None)
+            if not jobstate or job_mgr._is_end_state(jobstate):
+                job_mgr._end_wait(jobstate or 'UNKNOWN')
+        return job_mgrs
+
+    def _job_files(self, task=None):
+        """Slurm output and error files base name for the submitted job
+        (or one of its tasks for a job array, or its bundle step)"""
+        if self._step_files is not None:
+            return self._step_files
+        job_f = self._outerr_files
+        for pattern in ('%J', '%j', '%A'):
+            job_f = job_f.replace(pattern, str(self._jobid))
+        if task is not None:
+            job_f = job_f.replace('%a', str(task))
+        return job_f
+
+    def _prologue(self):
+        """Script lines inserted after the cell leading directives."""
+        prologue = self._epilogue()
+        if self._sweep and self._is_posix_shell:
+            prologue += (b'SWEEP_VALUE=$(sed -n "$((SLURM_ARRAY_TASK_ID + 1))p"'
+                         b' "$EXECUTE_SWEEP_FILE")\nexport SWEEP_VALUE\n')
+        return prologue
+
+    def _epilogue(self):
+        """Script lines running the job script again as a child, then
+        touching the sentinel file once the child is over.
+
+        The cell runs in the child, so that its own ``EXIT`` traps do not
+        replace the sentinel. Empty when the shell is not a POSIX shell,
+        when the output files path cannot be safely quoted or for job
+        arrays.
+        """
+        self._sentinel = not self._sweep and self._is_posix_shell and not any(
+            c in self._outerr_files for c in '\'"$`\\')
+        if not self._sentinel:
+            return b''
+        sentinel = self._outerr_files.replace('%J', '${SLURM_JOB_ID}').replace(
+            '%j', '${SLURM_JOB_ID}') + '.done'
+        return ('if [ -z "${{EXECUTE_SENTINEL_CHILD:-}}" ]; then\n'
+                '  EXECUTE_SENTINEL_CHILD=1 {0} "$0" "$@"\n'
+                '  EXECUTE_RC=$?\n'
+                '  touch "{1}"\n'
+                '  exit $EXECUTE_RC\n'
+                'fi\n').format(self._shell, sentinel).encode('utf8', 'replace')
+
+    def _get_job_state(self, max_age=None):
+        """Find job state, recording the query and the first running and
+        end states in the trace."""
+        with self.trace.span('state_query'):
+            jobstate = self._query_job_state(max_age)
+        if self._is_end_state(jobstate):
+            self.trace.mark('end')
+        elif any(s in jobstate for s in self._run_states):
+            self.trace.mark('running')
+        return jobstate
+
+    def _query_job_state(self, max_age=None):
+        """Find job state from the shared poller cache"""
+        if self._session is not None and self._is_started:
+            rc = self.p.poll()
+            if rc is None:
+                return 'RUNNING'
+            return 'COMPLETED' if rc == 0 else (
+                'CANCELLED' if rc < 0 else 'FAILED')
+        if self._step_files is not None:
+            # Bundle step exit code is written in the sentinel file
+            try:
+                with open(self._step_files + '.done') as f:
+                    rc = f.read().strip()
+                return 'COMPLETED' if rc == '0' else 'FAILED'
+            except (IOError, OSError):
+                pass
+        if self._sweep:
+            self.task_states = self._poller.get_task_states(
+                self._jobid, max_age=max_age)
+        return self._poller.get_state(self._jobid, max_age=max_age)
+
+    def _is_end_state(self, jobstate):
+        return any([jobstate.find(s) >= 0 for s in self._end_states])
 
     def wait_progress(self, silent=False):
         """Interact with workload manager to notify job
         progression and states
 
+        Progression display is independent from job state checks. The
+        job state is checked as soon as the job output files or sentinel
+        file appear, and otherwise at an increasing interval bounded by
+        ``_DEFAULT_SLURM_FALLBACK_POLL`` seconds.
+
+        In stream mode, the job output is displayed while the job runs
+        instead of the progression.
+
         Parameters
         ----------
         slient : bool (default=False)
             Display or not a progression state.
         """
-        if self._is_started:
+        from . import _DEFAULT_SLURM_FALLBACK_POLL
+        if self._is_started and self._session is not None:
+            self._wait_step(silent=silent)
+        elif self._is_started:
+            job_f = self._job_files()
+            sentinel = job_f + '.done'
+            watched = [] if self._sweep else [job_f + '.out', job_f + '.err']
+            if self._sentinel:
+                watched.append(sentinel)
+            watcher = FileWatcher(watched)
+            stream = self._stream and not silent
+            if stream:
+                self._followers = (FileFollower(job_f + '.out'),
+                                   FileFollower(job_f + '.err'))
+                silent = True
+            seen = set()
             jobstate = self._get_job_state()
+            poll, max_poll = self._poller.tick, _DEFAULT_SLURM_FALLBACK_POLL
+            next_step = time.time()
+            next_check = next_step + poll
             try:
-                while all([jobstate.find(s) < 0 for s in self._end_states]):
-                    if any([jobstate.find(s) >= 0 for s in self._wait_states]):
-                        self._step_waiting(silent=silent)
-                    if any([jobstate.find(s) >= 0 for s in self._run_states]):
-                        if(self._waiting_steps > 0 and self._running_steps == 0):
-                            if not silent:
-                                sys.stdout.write("\n")
-                        self._step_running(silent=silent)
-                    jobstate = self._get_job_state()
+                while not self._is_end_state(jobstate):
+                    now = time.time()
+                    if now >= next_step:
+                        delay = 1
+                        if any([jobstate.find(s) >= 0 for s in self._wait_states]):
+                            delay = self._step_waiting(silent=silent, wait=False)
+                        if any([jobstate.find(s) >= 0 for s in self._run_states]):
+                            if(self._waiting_steps > 0 and self._running_steps == 0):
+                                if not silent:
+                                    sys.stdout.write("\n")
+                            delay = self._step_running(silent=silent, wait=False)
+                        next_step = now + delay
+                    changed = watcher.wait(min(next_step, next_check) - now)
+                    if sentinel in changed:
+                        # Job script is over, wait for Slurm to notice it
+                        poll = max_poll = self._poller.tick
+                        next_check = time.time()
+                    if changed - seen or time.time() >= next_check:
+                        jobstate = self._get_job_state(
+                            max_age=0 if sentinel in changed else None)
+                        next_check = time.time() + poll
+                        poll = min(2 * poll, max_poll)
+                    seen |= changed
+                    if stream:
+                        self._write_stream()
             except KeyboardInterrupt:
                 sys.stdout.write("Terminate job {0} \n".format(self._jobid))
                 sys.stdout.flush()
-                check_call((['scancel', str(self._jobid)]))
+                self._scancel()
                 time.sleep(1)
-                jobstate = self._get_job_state()
-            self._is_terminated = True
+                jobstate = self._get_job_state(max_age=0)
+            finally:
+                watcher.close()
+            self._end_wait(jobstate)
+            if stream:
+                self._write_stream(final=True)
+            elif not silent and (self._waiting_steps > 0 or self._running_steps > 0):
+                sys.stdout.write("\n")
+            if stream or not silent:
+                self._print_end(jobstate)
+            self._efficiency_report(silent=not (stream or not silent))
+
+    async def wait_async(self, silent=True):
+        """Wait for job completion without blocking the event loop.
+
+        Job state is read from the shared poller cache in the loop default
+        executor. It is checked at the poller tick as soon as the job
+        sentinel file appears, and otherwise at an increasing interval
+        bounded by ``_DEFAULT_SLURM_FALLBACK_POLL`` seconds. Steps of held
+        allocations are waited for from the loop until their ``srun``
+        process exits.
 
-            if not silent:
-                if(self._waiting_steps > 0 or self._running_steps > 0):
-                    sys.stdout.write("\n")
-                sys.stdout.write("End batch job {0} Status: {1}\n".format(
-                    self._jobid, jobstate))
-                sys.stdout.write("Slurm command was : " + " ".join(self.cmd) + "\n")
-                sys.stdout.flush()
+        Parameters
+        ----------
+        slient : bool (default=True)
+            Display or not the final job state.
+        """
+        from . import _DEFAULT_SLURM_FALLBACK_POLL
+        if not self._is_started:
+            return
+        if self._session is not None:
+            return await super(SlurmMgr, self).wait_async(silent=silent)
+        loop = asyncio.get_running_loop()
+        sentinel = self._job_files() + '.done'
+        poll = self._poller.tick
+        next_check = time.time() + poll
+        try:
+            jobstate = await loop.run_in_executor(None, self._get_job_state)
+            while not self._is_end_state(jobstate):
+                await asyncio.sleep(self._poller.tick)
+                done = self._sentinel and os.path.exists(sentinel)
+                if done or time.time() >= next_check:
+                    # Cache is at most one tick old, so that states of jobs
+                    # ending together are still queried at once.
+                    jobstate = await loop.run_in_executor(
+                        None, self._get_job_state)
+                    poll = min(2 * poll, _DEFAULT_SLURM_FALLBACK_POLL)
+                    next_check = time.time() + poll
+        except asyncio.CancelledError:
+            await loop.run_in_executor(None, self._scancel)
+            raise
+        self._end_wait(jobstate)
+        if not silent:
+            self._print_end(jobstate)
+        await self._efficiency_report_async(silent)
+
+    def _end_wait(self, jobstate):
+        """Release job monitoring resources once the job is over."""
+        self.trace.mark('end')
+        self.state = jobstate
+        self._is_terminated = True
+        self._poller.unregister(self._jobid)
+        if self._journaled:
+            self._journaled = not self._record('finish', self._jobid, jobstate)
+        sentinel = self._job_files() + '.done'
+        if os.path.exists(sentinel):
+            os.remove(sentinel)
+        if self._sweep_file is not None and os.path.exists(self._sweep_file):
+            os.remove(self._sweep_file)
+
+    def get_efficiency(self):
+        """Get the resource usage of the job and its steps from Slurm
+        accounting.
+
+        The reports are also stored in the ``efficiency`` attribute. They
+        are only complete once the job is over.
+
+        Returns
+        -------
+        efficiency: collections.OrderedDict
+            Reports by job id, or by ``jobid_task`` for the tasks of a
+            job array (see
+            :py:func:`~execute_batch_scheduler.accounting.job_efficiency`).
+
+        Raises
+        ------
+        subprocess.CalledProcessError
+            If ``sacct`` fails.
+        """
+        with self.trace.span('accounting'):
+            self.efficiency = accounting.job_efficiency(self._jobid)
+        return self.efficiency
+
+    def _efficiency_report(self, silent=False):
+        """Get and display the resource usage of a job over, when asked
+        with ``--efficiency``.
+
+        As the usage of the steps is accounted a few seconds after the
+        job end, accounting is queried again at an increasing interval
+        until it is complete, for at most ``_DEFAULT_SLURM_EFFICIENCY_WAIT``
+        seconds.
+
+        Steps of bundles and held allocations are not reported, their job
+        being shared with other cells.
+        """
+        if not self._reports_efficiency:
+            return
+        try:
+            for delay in self._efficiency_queries():
+                time.sleep(delay)
+        except (CalledProcessError, OSError) as e:
+            sys.stderr.write("Accounting query failed: {0}\n".format(e))
+            return
+        self._print_efficiency(silent)
+
+    async def _efficiency_report_async(self, silent=False):
+        """Asynchronous counterpart of :py:meth:`_efficiency_report`,
+        waiting between the accounting queries from the event loop."""
+        if not self._reports_efficiency:
+            return
+        loop = asyncio.get_running_loop()
+        queries = self._efficiency_queries()
+        try:
+            while True:
+                delay = await loop.run_in_executor(None, next, queries, None)
+                if delay is None:
+                    break
+                await asyncio.sleep(delay)
+        except (CalledProcessError, OSError) as e:
+            sys.stderr.write("Accounting query failed: {0}\n".format(e))
+            return
+        self._print_efficiency(silent)
+
+    @property
+    def _reports_efficiency(self):
+        """Whether the resource usage of the job is reported."""
+        return self._report_efficiency and self._is_started and \
+            self._step_files is None
+
+    def _efficiency_queries(self):
+        """Query accounting until the usage is complete, yielding the
+        delay to wait before each new query."""
+        from . import _DEFAULT_SLURM_EFFICIENCY_WAIT
+        deadline = time.time() + _DEFAULT_SLURM_EFFICIENCY_WAIT
+        delay = self._poller.tick
+        while True:
+            self.get_efficiency()
+            if accounting.is_complete(self.efficiency) or \
+                    time.time() + delay > deadline:
+                return
+            yield delay
+            delay *= 2
+
+    def _print_efficiency(self, silent=False):
+        """Display the resource usage report."""
+        if not silent:
+            sys.stdout.write(accounting.summary(self.efficiency))
+            sys.stdout.flush()
+
+    def _print_end(self, jobstate):
+        """Display final job state."""
+        sys.stdout.write("End batch job {0} Status: {1}\n".format(
+            self._jobid, jobstate))
+        if self._sweep:
+            counts = collections.Counter(
+                s.split(' ')[0] for s in self.task_states.values())
+            sys.stdout.write("Tasks: " + ", ".join(
+                "{0} {1}".format(n, s) for s, n in sorted(counts.items())) + "\n")
+        sys.stdout.write("Slurm command was : " + " ".join(self.cmd) + "\n")
+        sys.stdout.flush()
 
+    def _write_stream(self, final=False):
+        """Write the new chunks of job output and error to the cell."""
+        for follower, out in zip(self._followers, (sys.stdout, sys.stderr)):
+            for chunk in follower.chunks():
+                out.write(chunk)
+            if final:
+                out.write(follower.flush())
+            out.flush()
+
+    def iter_output(self):
+        """Iterate over the job output and error while the job runs.
+
+        Files are read by chunks of bounded size as they grow, until the
+        job reaches an end state. The job is then over for the manager,
+        as after :py:meth:`wait_progress`. For a step of a held
+        allocation, the step output files are read until its ``srun``
+        process exits, and the ``srun`` messages come last.
+
+        Yields
+        ------
+        name: str
+            ``'stdout'`` or ``'stderr'``
+        chunk: str
+            New data of the job standard output or errput.
+        """
+        if not self._is_started or self._sweep:
+            return
+        job_f = self._job_files()
+        followers = (('stdout', FileFollower(job_f + '.out')),
+                     ('stderr', FileFollower(job_f + '.err')))
+        watcher = FileWatcher([f.path for _, f in followers])
+        try:
+            while True:
+                done = self._is_terminated
+                if not done:
+                    jobstate = self._get_job_state()
+                    done = self._is_end_state(jobstate)
+                    if done and self._session is not None:
+                        self._end_step(jobstate)
+                    elif done:
+                        self._end_wait(jobstate)
+                for name, follower in followers:
+                    for chunk in follower.chunks():
+                        yield name, chunk
+                if done:
+                    for name, follower in followers:
+                        chunk = follower.flush()
+                        if chunk:
+                            yield name, chunk
+                    messages = self._step_messages() \
+                        if self._session is not None else (b'', b'')
+                    for (name, _), message in zip(followers, messages):
+                        if message:
+                            yield name, py3compat.bytes_to_str(message)
+                    return
+                watcher.wait(self._poller.tick)
+        finally:
+            watcher.close()
+
+    __iter__ = iter_output
+
+    def _read_job_file(self, path, offset=0):
+        """Read a job file from the given offset."""
+        try:
+            with open(path, 'rb') as f:
+                f.seek(offset)
+                return py3compat.bytes_to_str(f.read())
+        except FileNotFoundError:
+            sys.stderr.write("File not found : {0}\n".format(path))
+            sys.stderr.flush()
+            return ""
+
+    def _step_messages(self):
+        """Output and error of the ``srun`` command of a held allocation
+        step, like step creation errors."""
+        if self._drainers is None:
+            return b'', b''
+        for d in self._drainers:
+            d.join()
+        return tuple(d.read() for d in self._drainers)
+
+    def get_task_output(self, task):
+        """Get the output and error of a job array task.
+
+        Task files are read on first call only.
+
+        Parameters
+        ----------
+        task : int
+            Task index in the parameter sweep.
+
+        Returns
+        -------
+        stdout: str
+            Task standard output read from slurm output file.
+        stderr: str
+            Task standard errput read from slurm error file.
+        """
+        if task not in self._task_outputs:
+            job_f = self._job_files(task)
+            self._task_outputs[task] = (self._read_job_file(job_f + '.out'),
+                                        self._read_job_file(job_f + '.err'))
+        return self._task_outputs[task]
+
+    def _get_sweep_output(self):
+        """Gather the outputs of all tasks, reading their files in parallel."""
+        tasks = range(len(self._sweep))
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            outputs = list(pool.map(self.get_task_output, tasks))
+        out, err = [], []
+        for task, (task_out, task_err) in zip(tasks, outputs):
+            header = "==> task {0}: SWEEP_VALUE={1} <==\n".format(
+                task, self._sweep[task])
+            out.append(header + task_out)
+            if task_err:
+                err.append(header + task_err)
+        return ''.join(out), ''.join(err)
+
+    @traced('output')
     def get_output(self):
         """Get the job output and error.
 
-        Read slurm standard and output files.
+        Read slurm standard and output files. In stream mode, only the
+        part not already displayed in the cell is returned. For a
+        parameter sweep, outputs of all the tasks are concatenated.
+        Files are read in memory as a whole, see :py:meth:`get_output_view`
+        for large outputs.
 
         Returns
         -------
@@ -479,25 +3371,400 @@ class SlurmMgr(BaseMgr):
             Job standard errput read from slurm error file.
         """
         if self._is_started and self._is_terminated:
-            job_f = self._outerr_files.replace('%J', str(self._jobid))
-            job_out_f = job_f + '.out'
-            job_err_f = job_f + '.err'
-            job_out = ""
+            job_f = self._job_files()
+            offsets = (0, 0)
+            if self._followers is not None:
+                offsets = [f.offset for f in self._followers]
+            if self.out is None and self.err is None and self._sweep:
+                self.out, self.err = self._get_sweep_output()
             if self.out is None and self.err is None:
-                try:
-                    with open(job_out_f, 'r') as f:
-                        job_out = f.read()
-                except FileNotFoundError:
-                    sys.stderr.write("File not found : {0}\n".format(job_out_f))
-                    sys.stderr.flush()
-                    job_err = ""
-                try:
-                    with open(job_err_f, 'r') as f:
-                        job_err = f.read()
-                except FileNotFoundError:
-                    sys.stderr.write("File not found : {0}\n".format(job_err_f))
-                    sys.stderr.flush()
-                self.out, self.err = job_out, job_err
+                out, err = self._step_messages()
+                self.out = self._read_job_file(job_f + '.out', offsets[0]) + \
+                    py3compat.bytes_to_str(out)
+                self.err = self._read_job_file(job_f + '.err', offsets[1]) + \
+                    py3compat.bytes_to_str(err)
             return(self.out, self.err)
         else:
             return(None, None)
+
+    @traced('output')
+    def get_output_view(self, full=False):
+        """Get views of the slurm output and error files.
+
+        For a parameter sweep, task outputs are concatenated in memory.
+        Messages of the ``srun`` command of a held allocation step are
+        appended to the views, loaded in memory then.
+
+        Parameters
+        ----------
+        full : bool (default=False)
+            Include the parts displayed in stream mode.
+        """
+        if not (self._is_started and self._is_terminated):
+            return OutputView(b''), OutputView(b'')
+        if self._sweep:
+            return super(SlurmMgr, self).get_output_view(full)
+        offsets = (0, 0)
+        if self._followers is not None and not full:
+            offsets = [f.offset for f in self._followers]
+        views = []
+        for ext, offset, msg in zip(('.out', '.err'), offsets,
+                                    self._step_messages()):
+            path = self._job_files() + ext
+            if not os.path.exists(path):
+                sys.stderr.write("File not found : {0}\n".format(path))
+                sys.stderr.flush()
+            view = OutputView(path, offset)
+            if msg:
+                view = OutputView(str(view).encode(view.encoding) + msg)
+            views.append(view)
+        return tuple(views)
+
+    @traced('output')
+    def get_full_output(self):
+        """Get the whole job output and error, including the parts
+        displayed in stream mode."""
+        if self._followers is None or self._sweep:
+            return self.get_output()
+        if self._is_started and self._is_terminated:
+            job_f = self._job_files()
+            out, err = self._step_messages()
+            return (self._read_job_file(job_f + '.out') +
+                    py3compat.bytes_to_str(out),
+                    self._read_job_file(job_f + '.err') +
+                    py3compat.bytes_to_str(err))
+        return(None, None)
+
+    def cancel(self):
+        """Cancel the job with ``scancel`` (or slurmrestd), or interrupt the
+        step of a held allocation."""
+        if not self._is_started or self._is_terminated:
+            return
+        if self._session is not None:
+            self._interrupt()
+        else:
+            self._scancel()
+
+    @property
+    def succeeded(self):
+        """Whether the job (or all the tasks of a job array) completed."""
+        return self.state is not None and \
+            self.state.split(' ') == ['COMPLETED']
+
+
+class SlurmBundle(object):
+    """Client-side queue of cells to run as steps of a single Slurm job.
+
+    Cells are queued with :py:meth:`SlurmMgr.set_bundle` and submitted
+    together by :py:meth:`flush` as a single ``sbatch`` job, running each
+    cell as a ``srun`` step with the cell own arguments. Each cell manager
+    then follows its own step output files and exit code.
+    """
+
+    # Bundles with queued cells by name
+    _bundles = {}
+
+    def __init__(self, name):
+        """Initialize an empty bundle.
+
+        Parameters
+        ----------
+        name : str
+            Bundle name.
+        """
+        self.name = name
+        self.steps = []
+
+    @classmethod
+    def get(cls, name):
+        """Get the named bundle, created if needed."""
+        if name not in cls._bundles:
+            cls._bundles[name] = cls(name)
+        return cls._bundles[name]
+
+    def add(self, job_mgr, content):
+        """Queue a cell.
+
+        Parameters
+        ----------
+        job_mgr : :py:class:`SlurmMgr`
+            Manager of the cell.
+        content: str
+            IPython cell content.
+
+        Returns
+        -------
+        stdout: str
+            Queuing message.
+        stderr: str
+            Empty errput.
+        """
+        self.steps.append((job_mgr, content))
+        return ("Cell queued as step {0} of bundle '{1}'\n".format(
+            len(self.steps) - 1, self.name), '')
+
+    def flush(self, args, userns, concurrent=False):
+        """Submit all the queued cells as a single job.
+
+        Parameters
+        ----------
+        args : list of str
+            ``sbatch`` arguments of the bundle job.
+        userns : dict
+            User namespace from cell_magics
+        concurrent : bool
+            Run steps concurrently (with ``srun --exact``) instead of
+            successively.
+
+        Returns
+        -------
+        job_mgr: :py:class:`SlurmMgr`
+            Manager of the bundle job.
+        stdout: str
+            Submission command standard output.
+        stderr: str
+            Submission command standard errput.
+        """
+        if self._bundles.get(self.name) is self:
+            del self._bundles[self.name]
+        job_mgr = SlurmMgr(args, '/bin/bash', userns)
+        # Steps are followed through their originating cells only
+        job_mgr._journal = None
+        bundle_dir = tempfile.mkdtemp(
+            prefix='python-execute-bundle.',
+            dir=os.path.abspath(os.path.join(job_mgr._outerr_files, os.pardir)))
+        lines, step_files = [], []
+        for i, (step_mgr, content) in enumerate(self.steps):
+            step_f = os.path.join(bundle_dir, 'step{0}'.format(i))
+            with open(step_f + '.sh', 'wb') as f:
+                f.write(step_mgr._build_script(content))
+            os.chmod(step_f + '.sh', 0o755)
+            srun = ['srun'] + step_mgr._cmd_args + \
+                (['--exact'] if concurrent else []) + [
+                    '--output=' + step_f + '.out', '--error=' + step_f + '.err',
+                    step_f + '.sh']
+            # Exit code is moved to the sentinel file once fully written
+            line = "{0}; echo $? > {1}.rc && mv {1}.rc {1}.done".format(
+                ' '.join(shlex.quote(a) for a in srun), shlex.quote(step_f))
+            lines.append("( {0} ) &".format(line) if concurrent else line)
+            step_files.append(step_f)
+        if concurrent:
+            lines.append('wait')
+        out, err = job_mgr.submit('\n'.join(lines))
+        for (step_mgr, _), step_f in zip(self.steps, step_files):
+            step_mgr._bundle_submitted(job_mgr, step_f)
+        return job_mgr, out, err
+
+
+class SlurmJobGraph(object):
+    """Slurm jobs linked by dependencies, tracked together.
+
+    A job submitted with :py:meth:`SlurmMgr.set_dependency` joins the
+    graph of the jobs it waits for, graphs being merged when they belong
+    to different ones. All the managers of a graph share it in their
+    ``graph`` attribute. Job states are read from the shared poller cache
+    and aggregated in a single pipeline state.
+    """
+
+    def __init__(self, jobs=None):
+        """Initialize a graph.
+
+        Parameters
+        ----------
+        jobs : list of :py:class:`SlurmMgr`
+            Managers of the graph jobs.
+        """
+        self.jobs = list(jobs or [])
+        # Dependencies as (upstream job id, downstream job id, type)
+        self.edges = []
+
+    @classmethod
+    def link(cls, job_mgr, after):
+        """Add a submitted job to the graph of the jobs it waits for.
+
+        Parameters
+        ----------
+        job_mgr : :py:class:`SlurmMgr`
+            Manager of the submitted job.
+        after : list of tuple
+            Managers of the jobs it waits for, with the dependency type.
+        """
+        graphs = []
+        for up, _ in after:
+            if up.graph is None:
+                up.graph = cls([up])
+            if up.graph not in graphs:
+                graphs.append(up.graph)
+        graph = graphs[0] if graphs else cls()
+        for other in graphs[1:]:
+            graph.jobs.extend(other.jobs)
+            graph.edges.extend(other.edges)
+            for m in other.jobs:
+                m.graph = graph
+        graph.jobs.append(job_mgr)
+        graph.edges.extend((up._jobid, job_mgr._jobid, kind)
+                           for up, kind in after)
+        job_mgr.graph = graph
+
+    def states(self):
+        """Get the state of each job of the graph.
+
+        Returns
+        -------
+        states: dict
+            Job states by job id.
+        """
+        states = collections.OrderedDict()
+        for m in self.jobs:
+            states[m._jobid] = m.state if m._is_terminated else \
+                SlurmMgr._poller.get_state(m._jobid)
+        return states
+
+    @property
+    def state(self):
+        """Aggregated state of the graph: the end states once all the jobs
+        are over, ``RUNNING`` while one of them runs, ``PENDING``
+        otherwise."""
+        return SlurmStatePoller._aggregate(self.states())
+
+
+class SlurmAllocation(object):
+    """Held Slurm allocation in which cells run as job steps.
+
+    The allocation is acquired once with ``salloc --no-shell`` and cells
+    then run as ``srun --jobid=<id>`` steps, without waiting in the queue.
+    It is released after ``idle_timeout`` seconds without any running
+    step, and transparently reacquired when a cell needs it again or
+    when it has expired.
+    """
+
+    # Allocations by name
+    _allocations = {}
+
+    def __init__(self, name, args=None, idle_timeout=None):
+        """Initialize an allocation, not acquired yet.
+
+        Parameters
+        ----------
+        name : str
+            Allocation name.
+        args : list of str
+            ``salloc`` arguments (default from ``_DEFAULT_SLURM_SESSION_ARGS``).
+        idle_timeout : float
+            Idle time in seconds before release (default from
+            ``_DEFAULT_SLURM_SESSION_IDLE``).
+        """
+        self.name = name
+        self.args = args
+        self.idle_timeout = idle_timeout
+        self._jobid = None
+        self._steps = 0
+        self._timer = None
+        self._lock = threading.RLock()
+
+    @classmethod
+    def get(cls, name, args=None, idle_timeout=None):
+        """Get the named allocation, created if needed.
+
+        Given arguments and idle timeout replace the previous ones.
+        """
+        if name not in cls._allocations:
+            cls._allocations[name] = cls(name)
+        alloc = cls._allocations[name]
+        if args is not None:
+            alloc.args = args
+        if idle_timeout is not None:
+            alloc.idle_timeout = idle_timeout
+        return alloc
+
+    def acquire(self):
+        """Acquire a new allocation, waiting for resources.
+
+        Returns
+        -------
+        jobid: int
+            Allocation job id, None on failure.
+        """
+        from . import _DEFAULT_SLURM_SESSION_ARGS
+        args = self.args
+        if args is None:
+            args = shlex.split(_DEFAULT_SLURM_SESSION_ARGS)
+        with self._lock:
+            self._jobid = None
+            p = Popen(['salloc', '--no-shell'] + args, stdout=PIPE, stderr=PIPE)
+            out, err = p.communicate()
+            m = re.search(r'Granted job allocation (\d+)',
+                          py3compat.bytes_to_str(out + err))
+            if m is None:
+                sys.stderr.write(py3compat.bytes_to_str(err))
+                sys.stderr.flush()
+                return None
+            self._jobid = int(m.group(1))
+            SlurmMgr._poller.register(self._jobid)
+            return self._jobid
+
+    def jobid(self):
+        """Get the job id of a live allocation, acquired if needed.
+
+        Returns
+        -------
+        jobid: int
+            Allocation job id, None on failure.
+        """
+        with self._lock:
+            if self._jobid is not None:
+                state = SlurmMgr._poller.get_state(self._jobid)
+                # An empty state is a transient miss of the scheduler
+                # queries, the allocation is kept
+                if state and not any(state.find(s) >= 0
+                                     for s in SlurmMgr._run_states):
+                    # Cancelled in case it still holds resources
+                    self.release()
+            if self._jobid is None:
+                self.acquire()
+            return self._jobid
+
+    def step_started(self):
+        """Notify a step start, disarming the idle timer."""
+        with self._lock:
+            self._steps += 1
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+
+    def step_ended(self):
+        """Notify a step end, arming the idle timer if no step is running."""
+        from . import _DEFAULT_SLURM_SESSION_IDLE
+        with self._lock:
+            self._steps -= 1
+            if self._steps == 0:
+                timeout = self.idle_timeout
+                if timeout is None:
+                    timeout = _DEFAULT_SLURM_SESSION_IDLE
+                self._timer = threading.Timer(timeout, self._release_idle)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def _release_idle(self):
+        with self._lock:
+            if self._steps == 0:
+                self.release()
+
+    def release(self):
+        """Release the allocation."""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if self._jobid is not None:
+                with open(os.devnull, 'wb') as devnull:
+                    Popen(['scancel', str(self._jobid)],
+                          stdout=devnull, stderr=devnull).wait()
+                SlurmMgr._poller.unregister(self._jobid)
+                self._jobid = None
+
+    @classmethod
+    def release_all(cls):
+        """Release all the allocations."""
+        for alloc in list(cls._allocations.values()):
+            alloc.release()
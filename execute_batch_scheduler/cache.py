@@ -0,0 +1,263 @@
+"""Content-addressed cache of cell execution results.
+
+List of defined class:
+
+- :py:class:`ResultCache` : On-disk cache of successful cell outputs.
+- :py:class:`CachedMgr` : Workload manager replaying a cached output.
+
+A result is keyed on a hash of the cell shebang and content, the resolved
+workload manager command line and the fingerprints (path and SHA-256
+digest of the content) of declared input files.
+"""
+import os
+import time
+import json
+import shutil
+import hashlib
+import tempfile
+
+from .backends import BaseMgr
+from .streams import OutputView
+
+
+class ResultCache(object):
+    """On-disk cache of successful cell outputs.
+
+    Each entry is a directory named after its key and holding the cell
+    output and error. Entries older than ``max_age`` seconds are evicted,
+    then the least recently used ones until the cache size is below
+    ``max_size`` bytes.
+    """
+
+    # Content digests of input files with their status, by path
+    _digests = {}
+
+    def __init__(self, directory=None, max_size=None, max_age=None):
+        """Open a cache directory.
+
+        Parameters
+        ----------
+        directory : str
+            Cache directory (default from ``_DEFAULT_CACHE_DIR``).
+        max_size : int
+            Maximal cache size in bytes (default from ``_DEFAULT_CACHE_MAX_SIZE``).
+        max_age : float
+            Maximal entry age in seconds (default from ``_DEFAULT_CACHE_MAX_AGE``).
+        """
+        from . import (_DEFAULT_CACHE_DIR, _DEFAULT_CACHE_MAX_SIZE,
+                       _DEFAULT_CACHE_MAX_AGE)
+        if directory is None:
+            directory = _DEFAULT_CACHE_DIR
+        if directory is None:
+            directory = os.path.join(os.path.expanduser('~'), '.cache',
+                                     'ipython-execute')
+        self.directory = directory
+        self.max_size = _DEFAULT_CACHE_MAX_SIZE if max_size is None else max_size
+        self.max_age = _DEFAULT_CACHE_MAX_AGE if max_age is None else max_age
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+
+    @classmethod
+    def _digest(cls, path):
+        """SHA-256 digest of a file content, None if it cannot be read.
+
+        Digests are kept along with the file status, so that a file is
+        hashed again only once its size, inode or modification or change
+        times differ.
+        """
+        try:
+            st = os.stat(path)
+            status = (st.st_size, st.st_ino, st.st_mtime_ns, st.st_ctime_ns)
+            known = cls._digests.get(path)
+            if known is not None and known[0] == status:
+                return known[1]
+            h = hashlib.sha256()
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 20), b''):
+                    h.update(chunk)
+        except (IOError, OSError):
+            return None
+        cls._digests[path] = (status, h.hexdigest())
+        return h.hexdigest()
+
+    @classmethod
+    def _fingerprints(cls, paths):
+        """Fingerprints of input files, recursing into directories."""
+        prints = []
+        for path in paths:
+            path = os.path.abspath(os.path.expanduser(path))
+            files = [path]
+            if os.path.isdir(path):
+                files = sorted(os.path.join(d, f)
+                               for d, _, fs in os.walk(path) for f in fs)
+            for f in files:
+                prints.append([f, cls._digest(f)])
+        return prints
+
+    def key(self, shebang, content, cmd, inputs=()):
+        """Compute the key of a cell execution.
+
+        Parameters
+        ----------
+        shebang : bytes
+            Script shebang.
+        content : str
+            IPython cell content.
+        cmd : list of str
+            Resolved workload manager command line.
+        inputs : list of str
+            Input files or directories of the cell.
+
+        Returns
+        -------
+        key: str
+            Hexadecimal digest.
+        """
+        h = hashlib.sha256()
+        h.update(shebang)
+        h.update(b'\0')
+        h.update(content.encode('utf8', 'replace'))
+        h.update(b'\0')
+        h.update(json.dumps([cmd, self._fingerprints(inputs)]).encode('utf8'))
+        return h.hexdigest()
+
+    def get(self, key):
+        """Get a cached result.
+
+        Returns
+        -------
+        result: tuple
+            Views of the cached output and error
+            (see :py:class:`~execute_batch_scheduler.streams.OutputView`),
+            None on cache miss.
+        """
+        entry = os.path.join(self.directory, key)
+        try:
+            if time.time() - os.stat(entry).st_mtime > self.max_age:
+                shutil.rmtree(entry, ignore_errors=True)
+                return None
+            result = []
+            for name in ('out', 'err'):
+                with open(os.path.join(entry, name), 'rb') as f:
+                    result.append(OutputView(f))
+        except (IOError, OSError):
+            return None
+        # Access time is used for least recently used eviction
+        atime = time.time()
+        os.utime(os.path.join(entry, 'out'), (atime, atime))
+        return tuple(result)
+
+    def put(self, key, out, err, cmd=None):
+        """Store a result and evict old entries.
+
+        Parameters
+        ----------
+        key : str
+            Key of the cell execution.
+        out : str or :py:class:`~execute_batch_scheduler.streams.OutputView`
+            Cell output.
+        err : str or :py:class:`~execute_batch_scheduler.streams.OutputView`
+            Cell error.
+        cmd : list of str
+            Command line, stored for information.
+        """
+        tmp = tempfile.mkdtemp(dir=self.directory, prefix='.tmp-')
+        for name, data in (('out', out), ('err', err)):
+            with open(os.path.join(tmp, name), 'wb') as f:
+                if isinstance(data, OutputView):
+                    data.write_to(f)
+                else:
+                    f.write((data or '').encode('utf8', 'replace'))
+        with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+            json.dump({'created': time.time(), 'cmd': cmd}, f)
+        entry = os.path.join(self.directory, key)
+        shutil.rmtree(entry, ignore_errors=True)
+        try:
+            os.rename(tmp, entry)
+        except OSError:
+            # Concurrently stored by another kernel
+            shutil.rmtree(tmp, ignore_errors=True)
+        self.evict()
+
+    def evict(self):
+        """Evict expired entries, then least recently used ones until the
+        cache fits in its maximal size."""
+        now = time.time()
+        entries = []
+        for key in os.listdir(self.directory):
+            entry = os.path.join(self.directory, key)
+            try:
+                mtime = os.stat(entry).st_mtime
+                atime = os.stat(os.path.join(entry, 'out')).st_atime
+                size = sum(os.path.getsize(os.path.join(entry, f))
+                           for f in os.listdir(entry))
+            except OSError:
+                continue
+            if key.startswith('.tmp-'):
+                # Leftover of an interrupted store
+                if now - mtime > 3600:
+                    shutil.rmtree(entry, ignore_errors=True)
+                continue
+            if now - mtime > self.max_age:
+                shutil.rmtree(entry, ignore_errors=True)
+            else:
+                entries.append((atime, size, entry))
+        total = sum(e[1] for e in entries)
+        for atime, size, entry in sorted(entries):
+            if total <= self.max_size:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+
+
+class CachedMgr(BaseMgr):
+    """Workload manager replaying a cached cell output.
+
+    Stored with ``--amgr`` on a cache hit, so that the cell output is
+    available as if the cell had run.
+    """
+
+    def __init__(self, out, err, key=None, shell='/bin/bash', userns=None):
+        """Initialize from a cached result.
+
+        Parameters
+        ----------
+        out : :py:class:`~execute_batch_scheduler.streams.OutputView`
+            Cached output.
+        err : :py:class:`~execute_batch_scheduler.streams.OutputView`
+            Cached error.
+        key : str
+            Cache key.
+        shell : str
+            Shell of the cached cell.
+        userns : dict
+            User namespace from cell_magics
+        """
+        super(CachedMgr, self).__init__([], shell, {} if userns is None else userns)
+        self._views = (out, err)
+        self.key = key
+        if key is not None:
+            self.trace.label = key[:12]
+
+    def submit(self, content):
+        """Nothing to submit, return cached output."""
+        return self.get_output()
+
+    def wait_progress(self, silent=False):
+        """Nothing to wait for."""
+        pass
+
+    def get_output(self):
+        """Get cached output and error."""
+        if self.out is None and self.err is None:
+            self.out, self.err = [str(v) for v in self._views]
+        return (self.out, self.err)
+
+    def get_output_view(self, full=False):
+        """Get views of the cached output and error."""
+        return self._views
+
+    @property
+    def succeeded(self):
+        """Only successful results are cached."""
+        return True
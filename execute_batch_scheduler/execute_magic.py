@@ -3,13 +3,18 @@
 """
 from __future__ import print_function
 import sys
-from IPython.core.magic import (Magics, magics_class, cell_magic)
+import time
+import atexit
+import shutil
+import asyncio
+from IPython.core.magic import (Magics, magics_class, cell_magic, line_magic)
 from IPython.core import magic_arguments
 from IPython.utils.process import arg_split
-from IPython.lib.backgroundjobs import BackgroundJobManager
+from IPython.display import display
 
-# Import all known backends
-from .backends import (BasicMgr, SSHMgr, SlurmMgr)
+# Backends are imported when a cell first selects them
+from .registry import BackendRegistry
+from .jobs import JobRegistry
 from . import _DEFAULT_MGR
 
 # The class MUST call this class decorator at creation time
@@ -17,23 +22,30 @@ from . import _DEFAULT_MGR
 class ExecuteMagics(Magics):
     """Magics for cell execution through workload manager
 
-    List of available workload managers:
+    List of built-in workload managers:
 
     * :class:`execute_batch_scheduler.backends.BasicMgr`
 
+    * :class:`execute_batch_scheduler.backends.LocalMgr`
+
     * :class:`execute_batch_scheduler.backends.SSHMgr`
 
     * :class:`execute_batch_scheduler.backends.SlurmMgr`
 
+    Other workload managers are provided by packages through entry points
+    (see :py:class:`~execute_batch_scheduler.registry.BackendRegistry`).
     """
 
     # Available workload managers
-    _wlmgr = {'': BasicMgr, 'ssh': SSHMgr, 'slurm': SlurmMgr}
+    _backends = BackendRegistry()
+    # Background cells are shared among all the instances
+    _jobs = JobRegistry()
 
     @magic_arguments.magic_arguments()
     @magic_arguments.argument(
         '--wlm', type=str, default=_DEFAULT_MGR,
-        help="""Workload manager.""")
+        help="""Workload manager: built-in ``local``, ``ssh`` or ``slurm``,
+        or a backend provided through entry points.""")
     @magic_arguments.argument(
         '--shell', type=str, default='/bin/bash',
         help="""Shell to use.""")
@@ -41,38 +53,155 @@ class ExecuteMagics(Magics):
         '--amgr', type=str,
         help="""The variable in which to store workload manager instance.
         If the script is backgrounded, this will be used to get cell output/error
-        using `get_output()` method.""")
+        using `get_output()` method, or `get_output_view()` for large outputs.""")
+    @magic_arguments.argument(
+        '--sweep', type=str,
+        help="""Parameter sweep: comma separated values or integer range
+        (``1-500`` or ``0-100:10``). The cell is run once for each value,
+        as a single job array with the slurm workload manager.""")
+    @magic_arguments.argument(
+        '--bundle', type=str, nargs='?', const='default',
+        help="""Queue the cell in the given bundle (default to 'default')
+        instead of submitting it. Queued cells are submitted together
+        with ``%%execute_flush``, as steps of a single slurm job.""")
+    @magic_arguments.argument(
+        '--after', type=str,
+        help="""Comma separated managers (``--amgr`` variables) of jobs to
+        wait for, each with an optional dependency type:
+        ``VAR[:afterok|afterany]`` (default to ``afterok``). The cell is
+        submitted at once and starts when these jobs are over, with the
+        slurm workload manager.""")
+    @magic_arguments.argument(
+        '--push', type=str,
+        help="""Comma separated namespace variables given to the job.
+        They are saved in the directory of the ``EXECUTE_DATA_DIR``
+        environment variable of the job (see
+        :py:mod:`~execute_batch_scheduler.jobdata`).""")
+    @magic_arguments.argument(
+        '--pull', type=str,
+        help="""Comma separated variables saved by the job, loaded in the
+        namespace once the job is over.""")
+    @magic_arguments.argument(
+        '--cache', action="store_true",
+        help="""Replay the stored output of an identical successful cell
+        instead of submitting it.""")
+    @magic_arguments.argument(
+        '--cache-inputs', type=str,
+        help="""Comma separated input files or directories of the cell.
+        The digests of their contents are part of the cache key.
+        Implies ``--cache``.""")
+    @magic_arguments.argument(
+        '--rerun', action="store_true",
+        help="""Submit the cell even if its result is cached, and store
+        the new result.""")
     @magic_arguments.argument(
         '--bg', action="store_true",
         help="""Whether to run the script in the background.
-        If given, the only way to see the output of the command is
-        with  `--amgr`.""")
+        If given, the output of the command is available with
+        ``%%jobs --output`` or with `--amgr`.""")
     @cell_magic
     def execute(self, line, cell):
         """Execute given cell content through configured workload scheduler.
 
-        Keep some arguments : ``--wlm``, ``--shell``, ``--bg`` and ``--amgr``.
+        Keep some arguments : ``--wlm``, ``--shell``, ``--sweep``,
+        ``--bundle``, ``--after``, ``--push``, ``--pull``, ``--cache``,
+        ``--cache-inputs``, ``--rerun``, ``--bg`` and ``--amgr``.
         Other arguments are passed to workload manager backend.
 
         Get some extra command line arguments from variable that
         may be overrided in IPython profile configuration file.
         """
-        from . import _DEFAULT_LINE_CMD_ARGS
         args, cmd = self.execute.parser.parse_known_args(arg_split(line))
 
-        extra_cmd = []
-        if args.wlm == _DEFAULT_MGR:
-            if isinstance(_DEFAULT_LINE_CMD_ARGS, dict):
-                if args.wlm in _DEFAULT_LINE_CMD_ARGS.keys():
-                    extra_cmd = arg_split(
-                        _DEFAULT_LINE_CMD_ARGS[args.wlm])
-            else:
-                extra_cmd = arg_split(_DEFAULT_LINE_CMD_ARGS)
+        try:
+            wlmgr = self._backends.get(args.wlm)
+        except KeyError:
+            sys.stderr.write("Unknown workload manager '{0}', available: "
+                             "{1}\n".format(args.wlm, ', '.join(
+                                 repr(n) for n in self._backends.names())))
+            sys.stderr.flush()
+            return
+        extra_cmd = self._default_cmd_args(args.wlm)
         # Build workload manager instance
-        job_mgr = self._wlmgr[args.wlm](
-            extra_cmd + cmd, args.shell, userns=self.shell.user_ns)
+        job_mgr = wlmgr(extra_cmd + cmd, args.shell, userns=self.shell.user_ns)
+        if hasattr(job_mgr, 'set_label'):
+            job_mgr.set_label(args.amgr, self._describe(None, cell))
+        if args.sweep:
+            if not hasattr(job_mgr, 'set_sweep'):
+                sys.stderr.write("Parameter sweep is not supported by '{0}' "
+                                 "workload manager\n".format(args.wlm))
+                sys.stderr.flush()
+                return
+            if args.bundle:
+                sys.stderr.write("Parameter sweeps cannot be bundled\n")
+                sys.stderr.flush()
+                return
+            from .backends import parse_sweep
+            try:
+                job_mgr.set_sweep(parse_sweep(args.sweep))
+            except ValueError as e:
+                sys.stderr.write("Invalid parameter sweep: {0}\n".format(e))
+                sys.stderr.flush()
+                return
+        if args.bundle:
+            if not hasattr(job_mgr, 'set_bundle'):
+                sys.stderr.write("Cell bundling is not supported by '{0}' "
+                                 "workload manager\n".format(args.wlm))
+                sys.stderr.flush()
+                return
+            job_mgr.set_bundle(args.bundle)
+        if args.after:
+            if not hasattr(job_mgr, 'set_dependency'):
+                sys.stderr.write("Job dependencies are not supported by '{0}' "
+                                 "workload manager\n".format(args.wlm))
+                sys.stderr.flush()
+                return
+            if args.bundle or args.cache or args.cache_inputs:
+                sys.stderr.write("Bundled or cached cells cannot wait for "
+                                 "jobs\n")
+                sys.stderr.flush()
+                return
+            try:
+                job_mgr.set_dependency(self._resolve_after(args.after))
+            except ValueError as e:
+                sys.stderr.write("Invalid dependency: {0}\n".format(e))
+                sys.stderr.flush()
+                return
+        data_dir = None
+        pull = [n for n in (args.pull or '').split(',') if n]
+        if args.push or pull:
+            if args.bundle or args.cache or args.cache_inputs:
+                sys.stderr.write("Variables cannot be exchanged with bundled "
+                                 "or cached cells\n")
+                sys.stderr.flush()
+                return
+            if args.sweep and pull:
+                sys.stderr.write("Variables cannot be pulled from parameter "
+                                 "sweeps\n")
+                sys.stderr.flush()
+                return
+            data_dir = self._push(
+                job_mgr, [n for n in (args.push or '').split(',') if n])
+            if data_dir is None:
+                return
+        cache, cache_key = None, None
+        if (args.cache or args.cache_inputs) and not args.bundle:
+            from .cache import ResultCache
+            cache = ResultCache()
+            inputs = [i for i in (args.cache_inputs or '').split(',') if i]
+            cache_key = cache.key(job_mgr.shebang, cell,
+                                  job_mgr.cache_cmd + [args.sweep or ''],
+                                  inputs)
+            result = None if args.rerun else cache.get(cache_key)
+            if result is not None:
+                self._replay(result, cache_key, args.amgr, args.shell)
+                return
         # Submit the cell as job script
-        sub_out, sub_err = job_mgr.submit(cell)
+        if args.bg and not args.bundle:
+            # Background cell subprocesses belong to the registry loop
+            sub_out, sub_err = self._jobs.run(job_mgr.submit_async(cell))
+        else:
+            sub_out, sub_err = job_mgr.submit(cell)
         sys.stdout.write(sub_out)
         sys.stdout.flush()
         sys.stderr.write(sub_err)
@@ -80,29 +209,496 @@ class ExecuteMagics(Magics):
 
         if args.amgr:
             self.shell.user_ns[args.amgr] = job_mgr
+        if args.bundle:
+            # Cell output is displayed here once the bundle job is over
+            job_mgr._display = display(
+                {'text/plain': 'Waiting for bundle submission'},
+                raw=True, display_id=True)
+            return
         if args.bg:
-            self.job_manager = BackgroundJobManager()
-            if not args.amgr:
-                sys.stderr.write("""Warning: --bg argument specified without
- --amgr (only way to get cell output)\n""")
-                sys.stderr.flush()
-            self.job_manager.new(job_mgr.wait_progress, kw=dict(silent=True))
+            waiter = None
+            if cache is not None:
+                waiter = self._wait_and_store(job_mgr, cache, cache_key)
+            if data_dir is not None:
+                waiter = self._wait_and_pull(job_mgr, data_dir, pull)
+            job = self._jobs.add(job_mgr, waiter,
+                                 self._describe(args.amgr, cell))
+            sys.stdout.write("Background job {0}\n".format(job.id))
+            sys.stdout.flush()
             return
         else:
             try:
                 job_mgr.wait_progress()
             except KeyboardInterrupt:
-                job_mgr.interrupt()
+                job_mgr.cancel()
+                self._pull(data_dir, [])
+                return
 
         # Get job output
-        job_out, job_err = job_mgr.get_output()
-        if job_out:
-            sys.stdout.write(job_out)
+        self._write_output(*job_mgr.get_output_view())
+        self._pull(data_dir, pull)
+        if cache is not None and job_mgr.succeeded:
+            job_out, job_err = job_mgr.get_output_view(full=True)
+            cache.put(cache_key, job_out, job_err, job_mgr.cache_cmd)
+
+    @staticmethod
+    def _summary(view):
+        """Text of an output view, or its head and tail when too large."""
+        from . import (_DEFAULT_OUTPUT_MAX_SIZE, _DEFAULT_OUTPUT_HEAD_LINES,
+                       _DEFAULT_OUTPUT_TAIL_LINES)
+        return view.summary(_DEFAULT_OUTPUT_MAX_SIZE, _DEFAULT_OUTPUT_HEAD_LINES,
+                            _DEFAULT_OUTPUT_TAIL_LINES)
+
+    def _write_output(self, out, err):
+        """Display job output and error views in the cell.
+
+        Large outputs are summarized, the whole output remaining available
+        from the workload manager ``get_output_view()`` method.
+        """
+        if out is not None and out.size:
+            sys.stdout.write(self._summary(out))
             sys.stdout.flush()
-        if job_err:
-            sys.stderr.write(job_err)
+        if err is not None and err.size:
+            sys.stderr.write(self._summary(err))
             sys.stderr.flush()
 
+    def _replay(self, result, key, amgr=None, shell='/bin/bash'):
+        """Display a cached cell result."""
+        from .cache import CachedMgr
+        sys.stdout.write("Cached result {0}\n".format(key[:12]))
+        sys.stdout.flush()
+        self._write_output(*result)
+        if amgr:
+            self.shell.user_ns[amgr] = CachedMgr(result[0], result[1], key,
+                                                 shell, self.shell.user_ns)
+
+    def _resolve_after(self, spec):
+        """Get the managers and dependency types of a ``--after`` value.
+
+        Raises
+        ------
+        ValueError
+            If a variable is not defined.
+        """
+        after = []
+        for item in spec.split(','):
+            name, _, kind = item.strip().partition(':')
+            if name not in self.shell.user_ns:
+                raise ValueError("undefined variable '{0}'".format(name))
+            after.append((self.shell.user_ns[name], kind or 'afterok'))
+        return after
+
+    def _push(self, job_mgr, names):
+        """Save namespace variables in a new data directory of the job.
+
+        Returns
+        -------
+        path: str
+            Data directory, None if a variable is not defined.
+        """
+        from . import jobdata
+        missing = [n for n in names if n not in self.shell.user_ns]
+        if missing:
+            sys.stderr.write("Undefined variables: {0}\n".format(
+                ', '.join(missing)))
+            sys.stderr.flush()
+            return None
+        path = jobdata.new_dir()
+        try:
+            for name in names:
+                jobdata.save(name, self.shell.user_ns[name], path)
+        except Exception:
+            shutil.rmtree(path, ignore_errors=True)
+            raise
+        job_mgr.set_data_dir(path)
+        return path
+
+    def _pull(self, data_dir, names):
+        """Load the variables saved by a job in the namespace, then remove
+        its data directory.
+
+        Loaded arrays stay mapped once their files are removed.
+        """
+        from . import jobdata
+        if data_dir is None:
+            return
+        try:
+            for name in names:
+                try:
+                    self.shell.user_ns[name] = jobdata.load(name, data_dir)
+                except FileNotFoundError:
+                    sys.stderr.write("Variable '{0}' was not saved by the "
+                                     "job\n".format(name))
+                    sys.stderr.flush()
+        finally:
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+    async def _wait_and_pull(self, job_mgr, data_dir, names):
+        """Wait for a background cell and load the variables it saved."""
+        try:
+            await job_mgr.wait_async(silent=True)
+        except asyncio.CancelledError:
+            names = []
+            raise
+        finally:
+            await asyncio.get_running_loop().run_in_executor(
+                None, self._pull, data_dir, names)
+
+    @staticmethod
+    async def _wait_and_store(job_mgr, cache, key):
+        """Wait for a background cell and cache its result on success."""
+        await job_mgr.wait_async(silent=True)
+        if job_mgr.succeeded:
+            out, err = job_mgr.get_output_view(full=True)
+            await asyncio.get_running_loop().run_in_executor(
+                None, cache.put, key, out, err, job_mgr.cache_cmd)
+
+    @staticmethod
+    def _describe(name, cell):
+        """Short description of a background cell."""
+        lines = [l.strip() for l in cell.splitlines() if l.strip()]
+        desc = lines[0] if lines else ''
+        if len(desc) > 40:
+            desc = desc[:37] + '...'
+        return "{0}: {1}".format(name, desc) if name else desc
+
+
+    @magic_arguments.magic_arguments()
+    @magic_arguments.argument(
+        '--name', type=str, default='default',
+        help="""Bundle to submit.""")
+    @magic_arguments.argument(
+        '--concurrent', action="store_true",
+        help="""Run the cells concurrently instead of successively.""")
+    @magic_arguments.argument(
+        '--bg', action="store_true",
+        help="""Whether to wait for the bundle job in the background.""")
+    @line_magic
+    def execute_flush(self, line):
+        """Submit the cells queued with ``%%execute --bundle`` as a single
+        slurm job.
+
+        Each cell runs as a ``srun`` step with its own arguments. Other
+        arguments are passed to ``sbatch`` for the bundle job. Once the job
+        is over, the output of each step is displayed in its originating
+        cell and available from its workload manager instance.
+        """
+        from .backends import SlurmBundle
+        args, cmd = self.execute_flush.parser.parse_known_args(arg_split(line))
+        bundle = SlurmBundle._bundles.get(args.name)
+        if bundle is None or not bundle.steps:
+            sys.stderr.write("Bundle '{0}' is empty\n".format(args.name))
+            sys.stderr.flush()
+            return
+        job_mgr, sub_out, sub_err = bundle.flush(
+            self._default_cmd_args('slurm') + cmd, self.shell.user_ns,
+            concurrent=args.concurrent)
+        sys.stdout.write(sub_out)
+        sys.stdout.flush()
+        sys.stderr.write(sub_err)
+        sys.stderr.flush()
+        if args.bg:
+            job = self._jobs.add(
+                job_mgr, self._wait_bundle_async(job_mgr, bundle),
+                "bundle {0}".format(args.name))
+            sys.stdout.write("Background job {0}\n".format(job.id))
+            sys.stdout.flush()
+        else:
+            try:
+                job_mgr.wait_progress()
+            except KeyboardInterrupt:
+                job_mgr.cancel()
+            self._dispatch_bundle(bundle)
+
+    @classmethod
+    async def _wait_bundle_async(cls, job_mgr, bundle):
+        """Wait for a bundle job in background and dispatch step outputs."""
+        await job_mgr.wait_async(silent=True)
+        await asyncio.get_running_loop().run_in_executor(
+            None, cls._dispatch_bundle, bundle, True)
+
+    @classmethod
+    def _dispatch_bundle(cls, bundle, silent=False):
+        """Dispatch the step outputs of a bundle job to their cells."""
+        for i, (step_mgr, _) in enumerate(bundle.steps):
+            step_mgr.wait_progress(silent=True)
+            out, err = step_mgr.get_output_view()
+            step_mgr._display.update(
+                {'text/plain': cls._summary(out) + cls._summary(err)},
+                raw=True)
+            if not silent:
+                sys.stdout.write("Step {0}: {1}\n".format(i, step_mgr.state))
+                sys.stdout.flush()
+
+    @magic_arguments.magic_arguments()
+    @magic_arguments.argument(
+        '--name', type=str, default='default',
+        help="""Allocation name.""")
+    @magic_arguments.argument(
+        '--idle-timeout', type=float,
+        help="""Idle time in seconds before the allocation is released.""")
+    @magic_arguments.argument(
+        '--release', action="store_true",
+        help="""Release the allocation.""")
+    @line_magic
+    def execute_session(self, line):
+        """Acquire a held slurm allocation for ``%%execute --session`` cells.
+
+        Other arguments are passed to ``salloc``. They are kept to
+        reacquire the allocation when it expires or after an idle release.
+        """
+        from .backends import SlurmAllocation
+        args, cmd = self.execute_session.parser.parse_known_args(arg_split(line))
+        if args.release:
+            SlurmAllocation.get(args.name).release()
+            return
+        alloc = SlurmAllocation.get(
+            args.name, args=self._default_cmd_args('slurm') + cmd,
+            idle_timeout=args.idle_timeout)
+        alloc.release()
+        jobid = alloc.acquire()
+        if jobid is not None:
+            sys.stdout.write("Granted allocation {0}\n".format(jobid))
+            sys.stdout.flush()
+
+    @magic_arguments.magic_arguments()
+    @magic_arguments.argument(
+        'ids', type=int, nargs='*',
+        help="""Background job numbers (default to all the jobs).""")
+    @magic_arguments.argument(
+        '--wait', action="store_true",
+        help="""Wait for the completion of the jobs.""")
+    @magic_arguments.argument(
+        '--timeout', type=float,
+        help="""Maximal time to wait in seconds.""")
+    @magic_arguments.argument(
+        '--cancel', action="store_true",
+        help="""Cancel the running jobs.""")
+    @magic_arguments.argument(
+        '--output', action="store_true",
+        help="""Display the output of the finished jobs.""")
+    @magic_arguments.argument(
+        '--var', type=str,
+        help="""Variable in which to store views of the output and error
+        of the finished jobs, as a dictionnary indexed by job number.""")
+    @magic_arguments.argument(
+        '--clear', action="store_true",
+        help="""Forget the finished jobs.""")
+    @line_magic
+    def jobs(self, line):
+        """Manage the background cells run with ``%%execute --bg``.
+
+        List the jobs with their status, after waiting for or cancelling
+        them if asked. Outputs of finished jobs are mapped concurrently
+        and summarized when too large.
+        """
+        args = magic_arguments.parse_argstring(self.jobs, line)
+        jobs = self._jobs.select(args.ids)
+        if args.cancel:
+            self._jobs.cancel(jobs)
+        if args.wait:
+            try:
+                if not self._jobs.wait(jobs, args.timeout):
+                    sys.stderr.write("Timeout while waiting for jobs\n")
+                    sys.stderr.flush()
+            except KeyboardInterrupt:
+                pass
+        if args.output or args.var:
+            done = [j for j in jobs if j.status == 'done']
+            outputs = self._jobs.outputs(done)
+            if args.var:
+                self.shell.user_ns[args.var] = dict(
+                    (j.id, o) for j, o in zip(done, outputs))
+            if args.output:
+                for job, (out, err) in zip(done, outputs):
+                    sys.stdout.write("==> job {0}: {1} <==\n".format(
+                        job.id, job.description))
+                    sys.stdout.flush()
+                    self._write_output(out, err)
+        if args.clear:
+            self._jobs.clear()
+        if not (args.output or args.var or args.clear):
+            self._print_jobs(jobs)
+
+    @staticmethod
+    def _print_jobs(jobs):
+        """Display the status of background jobs."""
+        for job in jobs:
+            mgr = job.mgr
+            ref = getattr(mgr, '_jobid', None)
+            if ref is None and getattr(mgr, 'p', None) is not None:
+                ref = 'pid {0}'.format(mgr.p.pid)
+            status = job.status
+            if status == 'done' and getattr(mgr, 'state', None):
+                status = mgr.state
+            sys.stdout.write("{0:>4}  {1:<10} {2:>8.1f}s  {3:<14} {4}\n".format(
+                job.id, status, job.elapsed,
+                "{0} {1}".format(type(mgr).__name__, ref or ''),
+                job.description))
+        sys.stdout.flush()
+
+    @magic_arguments.magic_arguments()
+    @magic_arguments.argument(
+        'jobids', type=int, nargs='*',
+        help="""Slurm job ids (default to all the jobs left).""")
+    @magic_arguments.argument(
+        '--list', action="store_true",
+        help="""List the jobs left without reattaching them.""")
+    @magic_arguments.argument(
+        '--forget', action="store_true",
+        help="""Remove the jobs from the journal without reattaching them.
+        They are not cancelled.""")
+    @magic_arguments.argument(
+        '--wait', action="store_true",
+        help="""Wait for the running jobs instead of following them in
+        background.""")
+    @line_magic
+    def reattach(self, line):
+        """Follow again the slurm jobs left by a dead or restarted kernel.
+
+        Jobs are read from the job journal (see
+        :py:mod:`~execute_batch_scheduler.journal`). Their managers are
+        stored again in their ``--amgr`` variables. The output of the jobs
+        over is displayed at once, the running jobs are followed as
+        background jobs (see ``%%jobs``).
+        """
+        from .backends import SlurmMgr
+        from .journal import JobJournal
+        args = magic_arguments.parse_argstring(self.reattach, line)
+        journal = JobJournal.default()
+        if journal is None:
+            sys.stderr.write("Job journal is disabled\n")
+            sys.stderr.flush()
+            return
+        jobs = journal.orphans()
+        if args.jobids:
+            jobs = [j for j in jobs if j['jobid'] in args.jobids]
+        if not jobs:
+            sys.stdout.write("No job to reattach\n")
+            sys.stdout.flush()
+            return
+        if args.list:
+            for job in jobs:
+                sys.stdout.write("{0:>10}  {1}  {2:<10} {3}\n".format(
+                    job['jobid'], time.strftime(
+                        '%Y-%m-%d %H:%M:%S', time.localtime(job['submitted'])),
+                    job['name'] or '', job['description'] or ''))
+            sys.stdout.flush()
+            return
+        if args.forget:
+            journal.forget([j['jobid'] for j in jobs])
+            sys.stdout.write("Forgot {0} jobs\n".format(len(jobs)))
+            sys.stdout.flush()
+            return
+        journal.adopt([j['jobid'] for j in jobs])
+        for job_mgr in SlurmMgr.reattach(jobs, self.shell.user_ns):
+            if job_mgr.name:
+                self.shell.user_ns[job_mgr.name] = job_mgr
+            description = self._describe(job_mgr.name, job_mgr.description or '')
+            if job_mgr._is_terminated:
+                job_mgr._print_end(job_mgr.state)
+                self._write_output(*job_mgr.get_output_view())
+            elif args.wait:
+                sys.stdout.write("Reattached batch job {0}: {1}\n".format(
+                    job_mgr._jobid, description))
+                sys.stdout.flush()
+                try:
+                    job_mgr.wait_progress()
+                except KeyboardInterrupt:
+                    job_mgr.cancel()
+                    return
+                self._write_output(*job_mgr.get_output_view())
+            else:
+                job = self._jobs.add(job_mgr, None, description)
+                sys.stdout.write("Background job {0}: batch job {1}\n".format(
+                    job.id, job_mgr._jobid))
+                sys.stdout.flush()
+
+    @magic_arguments.magic_arguments()
+    @magic_arguments.argument(
+        '--last', action="store_true",
+        help="""Display the phases of the last cell execution.""")
+    @magic_arguments.argument(
+        '--export', type=str,
+        help="""File in which to export the traces.""")
+    @magic_arguments.argument(
+        '--format', type=str, choices=('chrome', 'jsonl'),
+        help="""Export format: Chrome trace event format or JSON lines
+        (default from the file extension).""")
+    @magic_arguments.argument(
+        '--clear', action="store_true",
+        help="""Forget the recorded traces.""")
+    @line_magic
+    def execute_trace(self, line):
+        """Display the time spent in each phase of the cell executions.
+
+        Without option, display the phase durations aggregated over the
+        session for each workload manager.
+        """
+        from .backends import BaseMgr
+        args = magic_arguments.parse_argstring(self.execute_trace, line)
+        traces = BaseMgr._traces
+        if args.export:
+            fmt = args.format
+            if fmt is None:
+                fmt = 'jsonl' if args.export.endswith('.jsonl') else 'chrome'
+            traces.export(args.export, fmt)
+        if args.last:
+            self._print_last_trace(traces)
+        elif not (args.export or args.clear):
+            self._print_trace_stats(traces.aggregate())
+        if args.clear:
+            traces.clear()
+
+    # Display order of the phases
+    _phases = ('submission', 'queue', 'run', 'total', 'state_query', 'output')
+
+    @classmethod
+    def _print_trace_stats(cls, stats):
+        """Display aggregated phase durations."""
+        order = dict((p, i) for i, p in enumerate(cls._phases))
+        sys.stdout.write("{0:<18} {1:<12} {2:>6} {3:>10} {4:>10} {5:>10}\n".format(
+            'Manager', 'Phase', 'Count', 'Mean (s)', 'Max (s)', 'Total (s)'))
+        for (name, phase), st in sorted(
+                stats.items(),
+                key=lambda i: (i[0][0], order.get(i[0][1], len(order)), i[0][1])):
+            sys.stdout.write(
+                "{0:<18} {1:<12} {2:>6} {3:>10.3f} {4:>10.3f} {5:>10.3f}\n".format(
+                    name, phase, st['count'], st['mean'], st['max'], st['total']))
+        sys.stdout.flush()
+
+    @classmethod
+    def _print_last_trace(cls, traces):
+        """Display the events and phases of the last cell execution."""
+        if not traces.traces:
+            return
+        trace = traces.traces[-1]
+        sys.stdout.write("{0} {1}\n".format(trace.name, trace.label or ''))
+        start = trace.events[0][1] if trace.events else 0.
+        for phase, t, d in trace.events:
+            sys.stdout.write("  {0:>10.3f}s  {1:<12}{2}\n".format(
+                t - start, phase, '' if d is None else ' ({0:.3f}s)'.format(d)))
+        summary = trace.summary()
+        sys.stdout.write("  " + ", ".join(
+            "{0}: {1:.3f}s".format(p, summary[p])
+            for p in cls._phases if p in summary) + "\n")
+        sys.stdout.flush()
+
+    def _default_cmd_args(self, wlm):
+        """Get the default command line arguments of a workload manager.
+
+        They may be overrided in IPython profile configuration file.
+        """
+        from . import _DEFAULT_LINE_CMD_ARGS
+        extra_cmd = []
+        if wlm == _DEFAULT_MGR:
+            if isinstance(_DEFAULT_LINE_CMD_ARGS, dict):
+                if wlm in _DEFAULT_LINE_CMD_ARGS.keys():
+                    extra_cmd = arg_split(
+                        _DEFAULT_LINE_CMD_ARGS[wlm])
+            else:
+                extra_cmd = arg_split(_DEFAULT_LINE_CMD_ARGS)
+        return extra_cmd
 
 
 def load_ipython_extension(ipython):
@@ -116,10 +712,30 @@ def load_ipython_extension(ipython):
     ipython.register_magics(ExecuteMagics)
 
 
-# def unload_ipython_extension(ipython):
-#     """Unload extension
+def unload_ipython_extension(ipython):
+    """Unload extension.
+
+    Stop waiting for background cells and release the resources of the
+    built-in backends.
+    """
+    ExecuteMagics._jobs.close()
+    _close_backends()
+
+
+def _close_backends():
+    """Cancel local jobs, end SSH sessions, exit SSH master connections,
+    release held slurm allocations and close the job journal, if the
+    built-in backends were imported."""
+    backends = sys.modules.get(__package__ + '.backends')
+    if backends is None:
+        return
+    backends.LocalMgr._pool.close()
+    backends.SSHSession.close_all()
+    backends.SSHMgr._masters.close()
+    backends.SlurmAllocation.release_all()
+    backends.JobJournal.close_all()
+
 
-#     Actually doing noting
-#     """
-#     # If you want your extension to be unloadable, put that logic here.
-#     pass
+# Local jobs, SSH sessions, master connections and allocations must not
+# outlive the kernel
+atexit.register(_close_backends)
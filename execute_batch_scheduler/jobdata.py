@@ -0,0 +1,148 @@
+"""Exchange of Python objects between the notebook namespace and jobs.
+
+List of defined functions:
+
+- :py:func:`new_dir` : Create the data directory of a cell.
+- :py:func:`save` : Store an object in a data directory.
+- :py:func:`load` : Load an object from a data directory.
+
+Objects pushed with ``%%execute --push`` are saved in a directory of a
+shared filesystem, whose path is given to the job in the
+``EXECUTE_DATA_DIR`` environment variable. A Python job loads them and
+saves its results with the same functions::
+
+    from execute_batch_scheduler import jobdata
+    x = jobdata.load('x')
+    jobdata.save('result', simulate(x))
+
+Results are loaded back in the namespace with ``%%execute --pull``.
+
+NumPy arrays are stored as ``.npy`` files. Other objects are pickled
+with protocol 5, their out-of-band buffers (like the data of the arrays
+they hold) being written to files of their own without copy. Loaded
+arrays and buffers are copy-on-write memory maps of these files, so
+large data is neither read in memory nor copied until modified.
+
+This module only depends on the standard library, NumPy being used
+when the objects are NumPy arrays, so that jobs may use it without
+IPython.
+"""
+import os
+import sys
+import glob
+import mmap
+import pickle
+import tempfile
+
+#: Environment variable holding the data directory of a job
+DATA_DIR_VAR = 'EXECUTE_DATA_DIR'
+
+
+def new_dir():
+    """Create the data directory of a cell.
+
+    Directories are created in ``_DEFAULT_DATA_DIR``, by default
+    ``$HOME/python-execute-data``, which must be reachable by the jobs.
+
+    Returns
+    -------
+    path: str
+        Absolute path of the new directory.
+    """
+    from . import _DEFAULT_DATA_DIR
+    base = _DEFAULT_DATA_DIR
+    if base is None:
+        base = os.path.join(os.environ['HOME'], 'python-execute-data')
+    if not os.path.exists(base):
+        os.makedirs(base)
+    return os.path.abspath(tempfile.mkdtemp(prefix='cell.', dir=base))
+
+
+def _base(name, directory):
+    """Base path of the files of an object."""
+    if not name.isidentifier():
+        raise ValueError("Invalid variable name '{0}'".format(name))
+    if directory is None:
+        directory = os.environ[DATA_DIR_VAR]
+    return os.path.join(directory, name)
+
+
+def _map(path):
+    """Copy-on-write memory map of a file."""
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return bytearray()
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+
+
+def save(name, obj, directory=None):
+    """Store an object in a data directory.
+
+    Files of a previous object of the same name are replaced. The object
+    is only visible to :py:func:`load` once fully written.
+
+    Parameters
+    ----------
+    name : str
+        Variable name.
+    obj : object
+        NumPy array or picklable object.
+    directory : str
+        Data directory (default from ``EXECUTE_DATA_DIR``).
+    """
+    base = _base(name, directory)
+    for path in glob.glob(base + '.*'):
+        os.remove(path)
+    # NumPy is only used when the object comes from it
+    np = sys.modules.get('numpy')
+    if np is not None and type(obj) is np.ndarray and not obj.dtype.hasobject:
+        with open(base + '.tmp', 'wb') as f:
+            np.save(f, obj, allow_pickle=False)
+        os.replace(base + '.tmp', base + '.npy')
+        return
+    buffers = []
+    if pickle.HIGHEST_PROTOCOL >= 5:
+        data = pickle.dumps(obj, protocol=5, buffer_callback=buffers.append)
+    else:
+        data = pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+    for i, buf in enumerate(buffers):
+        with open('{0}.{1}.buf'.format(base, i), 'wb') as f:
+            f.write(buf.raw())
+    with open(base + '.tmp', 'wb') as f:
+        f.write(data)
+    os.replace(base + '.tmp', base + '.pkl')
+
+
+def load(name, directory=None):
+    """Load an object from a data directory.
+
+    Parameters
+    ----------
+    name : str
+        Variable name.
+    directory : str
+        Data directory (default from ``EXECUTE_DATA_DIR``).
+
+    Returns
+    -------
+    obj: object
+        Stored object, NumPy arrays being copy-on-write memory maps of
+        the data directory files.
+
+    Raises
+    ------
+    FileNotFoundError
+        If no object of this name was saved.
+    """
+    base = _base(name, directory)
+    if os.path.exists(base + '.npy'):
+        import numpy
+        return numpy.load(base + '.npy', mmap_mode='c')
+    with open(base + '.pkl', 'rb') as f:
+        data = f.read()
+    buffers = []
+    while os.path.exists('{0}.{1}.buf'.format(base, len(buffers))):
+        buffers.append(_map('{0}.{1}.buf'.format(base, len(buffers))))
+    if buffers:
+        return pickle.loads(data, buffers=buffers)
+    return pickle.loads(data)
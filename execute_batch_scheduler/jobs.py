@@ -0,0 +1,204 @@
+"""Registry of background cells.
+
+List of defined class:
+
+- :py:class:`BackgroundJob` : A cell waited for in background.
+- :py:class:`JobRegistry` : Drive all background cells from a single event loop.
+
+All background cells are waited for by their workload manager
+asynchronous API (see :py:meth:`~execute_batch_scheduler.backends.BaseMgr.wait_async`)
+in one event loop running in a daemon thread. Blocking calls are run in
+the loop default executor, bounded to ``_DEFAULT_BG_WORKERS`` threads,
+so that the number of threads does not grow with the number of cells.
+Before Python 3.12, asyncio also waits for each running subprocess (like
+the ``ssh`` command of a cell) from a dedicated thread.
+"""
+import time
+import asyncio
+import functools
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor, CancelledError
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+
+class BackgroundJob(object):
+    """A cell waited for in background."""
+
+    def __init__(self, jobid, job_mgr, description=''):
+        """Initialize a background job record.
+
+        Parameters
+        ----------
+        jobid : int
+            Registry job number.
+        job_mgr : :py:class:`~execute_batch_scheduler.backends.BaseMgr`
+            Workload manager of the cell.
+        description : str
+            Short description of the cell.
+        """
+        self.id = jobid
+        self.mgr = job_mgr
+        self.description = description
+        self.start = time.time()
+        self.end = None
+        self.future = None
+
+    @property
+    def status(self):
+        """Job status: ``running``, ``done``, ``cancelled`` or ``error``."""
+        if not self.future.done():
+            return 'running'
+        if self.future.cancelled():
+            return 'cancelled'
+        if self.future.exception() is not None:
+            return 'error'
+        return 'done'
+
+    @property
+    def elapsed(self):
+        """Time since submission or until completion, in seconds."""
+        return (self.end or time.time()) - self.start
+
+    def _done(self, future):
+        self.end = time.time()
+
+
+class JobRegistry(object):
+    """Registry of background cells sharing a single event loop.
+
+    The loop thread is started with the first registered cell.
+    """
+
+    def __init__(self, max_workers=None):
+        """Initialize an empty registry.
+
+        Parameters
+        ----------
+        max_workers : int
+            Number of threads of the loop executor (default from
+            ``_DEFAULT_BG_WORKERS``).
+        """
+        self._max_workers = max_workers
+        self._lock = threading.Lock()
+        self._loop = None
+        self._thread = None
+        self._ids = itertools.count(1)
+        self.jobs = {}
+
+    @property
+    def loop(self):
+        """Event loop driving the background cells, started if needed."""
+        with self._lock:
+            if self._loop is None:
+                from . import _DEFAULT_BG_WORKERS
+                workers = self._max_workers or _DEFAULT_BG_WORKERS
+                self._loop = asyncio.new_event_loop()
+                self._loop.set_default_executor(ThreadPoolExecutor(
+                    max_workers=workers, thread_name_prefix='execute-bg'))
+                self._thread = threading.Thread(
+                    target=self._loop.run_forever, name='execute-bg-loop')
+                self._thread.daemon = True
+                self._thread.start()
+            return self._loop
+
+    def run(self, coro, timeout=None):
+        """Run a coroutine in the registry loop and wait for its result."""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result(timeout)
+
+    def add(self, job_mgr, waiter=None, description=''):
+        """Wait for a submitted cell in background.
+
+        Parameters
+        ----------
+        job_mgr : :py:class:`~execute_batch_scheduler.backends.BaseMgr`
+            Workload manager of the submitted cell.
+        waiter : coroutine
+            Coroutine waiting for the cell (default to
+            ``job_mgr.wait_async(silent=True)``).
+        description : str
+            Short description of the cell.
+
+        Returns
+        -------
+        job: :py:class:`BackgroundJob`
+        """
+        job = BackgroundJob(next(self._ids), job_mgr, description)
+        if waiter is None:
+            waiter = job_mgr.wait_async(silent=True)
+        job.future = asyncio.run_coroutine_threadsafe(waiter, self.loop)
+        job.future.add_done_callback(job._done)
+        self.jobs[job.id] = job
+        return job
+
+    def select(self, ids=None):
+        """Get registered jobs by number (all of them if none given)."""
+        if not ids:
+            return [self.jobs[i] for i in sorted(self.jobs)]
+        return [self.jobs[i] for i in ids if i in self.jobs]
+
+    def wait(self, jobs, timeout=None):
+        """Wait for the completion of some jobs.
+
+        Returns
+        -------
+        done: bool
+            Whether all the jobs are over.
+        """
+        end = None if timeout is None else time.time() + timeout
+        for job in jobs:
+            try:
+                job.future.exception(
+                    None if end is None else max(end - time.time(), 0))
+            except FutureTimeoutError:
+                return False
+            except (CancelledError, Exception):
+                # Failed or cancelled job is over
+                pass
+        return True
+
+    def cancel(self, jobs):
+        """Cancel running jobs.
+
+        Cancellation is handled by the waiting coroutine of each workload
+        manager (e.g. the slurm job is cancelled with ``scancel``, a held
+        allocation step or an ssh command is interrupted).
+        """
+        for job in jobs:
+            job.future.cancel()
+
+    async def _outputs(self, jobs):
+        loop = asyncio.get_running_loop()
+        return await asyncio.gather(
+            *[loop.run_in_executor(
+                None, functools.partial(job.mgr.get_output_view, full=True))
+              for job in jobs])
+
+    def outputs(self, jobs):
+        """Get the outputs of finished jobs concurrently.
+
+        Returns
+        -------
+        outputs: list of tuple
+            Views of the output and error of each job (see
+            :py:class:`~execute_batch_scheduler.streams.OutputView`).
+        """
+        return self.run(self._outputs(jobs))
+
+    def clear(self):
+        """Forget finished jobs."""
+        for i in [i for i, j in self.jobs.items() if j.future.done()]:
+            del self.jobs[i]
+
+    def close(self):
+        """Stop the event loop.
+
+        Running jobs are not cancelled but no longer waited for.
+        """
+        with self._lock:
+            if self._loop is None:
+                return
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join(5.)
+            self._loop = None
+            self._thread = None
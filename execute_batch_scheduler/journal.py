@@ -0,0 +1,210 @@
+"""On-disk journal of the submitted Slurm jobs.
+
+List of defined class:
+
+- :py:class:`JobJournal` : SQLite journal of the submitted batch jobs.
+
+Every batch job submitted by :py:class:`~execute_batch_scheduler.backends.SlurmMgr`
+is recorded with what is needed to follow it again: job id, submission
+arguments, shell, output files and state, along with the kernel owning
+it. Jobs are marked over once their owner saw them end.
+
+When a kernel dies or restarts, its jobs keep running. The jobs left by
+dead kernels are listed by :py:meth:`JobJournal.orphans`, and adopted by
+the ``%reattach`` magic which rebuilds their managers.
+"""
+import os
+import json
+import time
+import uuid
+import socket
+import sqlite3
+import threading
+
+_SCHEMA = """CREATE TABLE IF NOT EXISTS jobs (
+    jobid INTEGER PRIMARY KEY,
+    name TEXT,
+    description TEXT,
+    args TEXT NOT NULL,
+    shell TEXT NOT NULL,
+    outerr TEXT NOT NULL,
+    sweep TEXT,
+    sweep_file TEXT,
+    submitted REAL NOT NULL,
+    state TEXT,
+    host TEXT NOT NULL,
+    pid INTEGER NOT NULL,
+    owner TEXT NOT NULL,
+    over INTEGER NOT NULL DEFAULT 0)"""
+
+_COLUMNS = ('jobid', 'name', 'description', 'args', 'shell', 'outerr',
+            'sweep', 'sweep_file', 'submitted', 'state', 'host', 'pid', 'owner', 'over')
+
+
+def _alive(pid):
+    """Whether a local process exists."""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        pass
+    return True
+
+
+class JobJournal(object):
+    """SQLite journal of the submitted batch jobs.
+
+    The journal is shared by all the kernels of a user. Jobs over since
+    more than ``max_age`` seconds are removed when a new job is recorded.
+    """
+
+    #: Owner token of the jobs submitted by this process
+    token = uuid.uuid4().hex
+    # Journals by path, shared among all the managers
+    _journals = {}
+    _journals_lock = threading.Lock()
+
+    def __init__(self, path=None, max_age=None):
+        """Initialize a journal, opened on first use.
+
+        Parameters
+        ----------
+        path : str
+            Journal file (default from ``_DEFAULT_JOURNAL_FILE``).
+        max_age : float
+            Time in seconds during which jobs over are kept (default from
+            ``_DEFAULT_JOURNAL_MAX_AGE``).
+        """
+        from . import _DEFAULT_JOURNAL_MAX_AGE
+        self.path = path or self._default_path()
+        self.max_age = _DEFAULT_JOURNAL_MAX_AGE if max_age is None else max_age
+        self._lock = threading.Lock()
+        self._conn = None
+
+    @staticmethod
+    def _default_path():
+        """Journal file of ``_DEFAULT_JOURNAL_FILE``, empty when disabled."""
+        from . import _DEFAULT_JOURNAL_FILE
+        if _DEFAULT_JOURNAL_FILE is None:
+            return os.path.join(os.path.expanduser('~'), '.cache',
+                                'ipython-execute', 'journal.sqlite')
+        return _DEFAULT_JOURNAL_FILE
+
+    @classmethod
+    def default(cls):
+        """Get the shared journal of ``_DEFAULT_JOURNAL_FILE``, None when
+        disabled."""
+        path = cls._default_path()
+        if not path:
+            return None
+        with cls._journals_lock:
+            if path not in cls._journals:
+                cls._journals[path] = cls(path)
+            return cls._journals[path]
+
+    def _execute(self, sql, params=()):
+        """Run a statement in its own transaction, return the fetched rows."""
+        with self._lock:
+            if self._conn is None:
+                directory = os.path.dirname(os.path.abspath(self.path))
+                if not os.path.exists(directory):
+                    os.makedirs(directory)
+                self._conn = sqlite3.connect(self.path, timeout=30.,
+                                             check_same_thread=False)
+                self._conn.execute('PRAGMA journal_mode=WAL')
+                self._conn.execute(_SCHEMA)
+            with self._conn:
+                return self._conn.execute(sql, params).fetchall()
+
+    def record(self, jobid, args, shell, outerr, sweep=None, sweep_file=None,
+               name=None, description=None):
+        """Record a submitted job, owned by this process.
+
+        Parameters
+        ----------
+        jobid : int
+            Slurm job id.
+        args : list of str
+            Workload manager arguments.
+        shell : str
+            Cell shell.
+        outerr : str
+            Output and error files base name, with Slurm patterns.
+        sweep : list of str
+            Parameter values of a job array.
+        sweep_file : str
+            File of the parameter values, removed once the job is over.
+        name : str
+            Namespace variable of the manager.
+        description : str
+            Short description of the cell.
+        """
+        now = time.time()
+        self._execute('DELETE FROM jobs WHERE over = 1 AND submitted < ?',
+                      (now - self.max_age, ))
+        self._execute(
+            'INSERT OR REPLACE INTO jobs ({0}) VALUES ({1})'.format(
+                ', '.join(_COLUMNS), ', '.join('?' * len(_COLUMNS))),
+            (jobid, name, description, json.dumps(args), shell, outerr,
+             None if sweep is None else json.dumps(sweep), sweep_file, now,
+             'PENDING',
+             socket.gethostname(), os.getpid(), self.token, 0))
+
+    def finish(self, jobid, state):
+        """Record the end state of a job seen by its owner."""
+        self._execute('UPDATE jobs SET state = ?, over = 1 WHERE jobid = ?',
+                      (state, jobid))
+
+    def orphans(self):
+        """Get the jobs not over left by dead kernels.
+
+        Jobs of kernels still running on this host are not orphans. Jobs
+        of kernels of other hosts are, as their processes cannot be
+        checked.
+
+        Returns
+        -------
+        jobs: list of dict
+            Recorded jobs, in submission order, with their ``args`` and
+            ``sweep`` decoded.
+        """
+        host = socket.gethostname()
+        jobs = []
+        for row in self._execute('SELECT {0} FROM jobs WHERE over = 0 '
+                                 'ORDER BY submitted'.format(', '.join(_COLUMNS))):
+            job = dict(zip(_COLUMNS, row))
+            if job['owner'] == self.token or \
+                    (job['host'] == host and _alive(job['pid'])):
+                continue
+            job['args'] = json.loads(job['args'])
+            job['sweep'] = None if job['sweep'] is None else json.loads(job['sweep'])
+            jobs.append(job)
+        return jobs
+
+    def adopt(self, jobids):
+        """Make this process the owner of jobs."""
+        for jobid in jobids:
+            self._execute('UPDATE jobs SET owner = ?, host = ?, pid = ? '
+                          'WHERE jobid = ?', (self.token, socket.gethostname(),
+                                              os.getpid(), jobid))
+
+    def forget(self, jobids):
+        """Remove jobs from the journal."""
+        for jobid in jobids:
+            self._execute('DELETE FROM jobs WHERE jobid = ?', (jobid, ))
+
+    def close(self):
+        """Close the journal file."""
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    @classmethod
+    def close_all(cls):
+        """Close all the shared journals."""
+        with cls._journals_lock:
+            journals, cls._journals = list(cls._journals.values()), {}
+        for journal in journals:
+            journal.close()
@@ -0,0 +1,128 @@
+"""Registry of the workload manager backends.
+
+List of defined class:
+
+- :py:class:`BackendRegistry` : Backends by name, imported on first use.
+
+Backends are referenced by ``module:Class`` strings and their module is
+only imported when a cell first selects them with ``--wlm``, so that
+loading the extension does not depend on the number of installed
+backends. Besides the built-in backends of
+:py:mod:`~execute_batch_scheduler.backends`, other packages provide
+backends through the ``execute_batch_scheduler.backends`` entry point
+group, e.g. in their ``setup.py``::
+
+    entry_points={
+        'execute_batch_scheduler.backends': [
+            'pbs = mysite.pbs:PBSMgr',
+        ],
+    }
+
+Entry points are only listed, without importing anything, when a cell
+selects a name which is not a built-in backend.
+"""
+import importlib
+import threading
+
+
+def _entry_points(group):
+    """Entry points of a group, from the installed packages metadata."""
+    try:
+        from importlib.metadata import entry_points
+    except ImportError:
+        return []
+    eps = entry_points()
+    if hasattr(eps, 'select'):
+        return eps.select(group=group)
+    return eps.get(group, [])
+
+
+class BackendRegistry(object):
+    """Workload manager backends by name, imported on first use."""
+
+    #: Entry point group of the backends provided by other packages
+    group = 'execute_batch_scheduler.backends'
+    # Built-in backends
+    _builtins = {
+        '': 'execute_batch_scheduler.backends:BasicMgr',
+        'local': 'execute_batch_scheduler.backends:LocalMgr',
+        'ssh': 'execute_batch_scheduler.backends:SSHMgr',
+        'slurm': 'execute_batch_scheduler.backends:SlurmMgr',
+    }
+
+    def __init__(self):
+        """Initialize a registry of the built-in backends."""
+        self._lock = threading.Lock()
+        # Backend classes or 'module:Class' references by name
+        self._backends = dict(self._builtins)
+        self._discovered = False
+
+    def register(self, name, backend):
+        """Register a backend.
+
+        Parameters
+        ----------
+        name : str
+            Backend name, as given to ``--wlm``.
+        backend : str or class
+            Backend class, or its ``module:Class`` reference to be
+            imported on first use.
+        """
+        with self._lock:
+            self._backends[name] = backend
+
+    def _discover(self):
+        """Add the backends of the entry point group, once."""
+        if self._discovered:
+            return
+        self._discovered = True
+        for ep in _entry_points(self.group):
+            # Registered backends take precedence
+            self._backends.setdefault(ep.name, ep.value)
+
+    def names(self):
+        """Names of all the available backends."""
+        with self._lock:
+            self._discover()
+            return sorted(self._backends)
+
+    def get(self, name):
+        """Get a backend class, importing its module if needed.
+
+        Parameters
+        ----------
+        name : str
+            Backend name.
+
+        Returns
+        -------
+        backend: class
+            Backend class (see
+            :py:class:`~execute_batch_scheduler.backends.BaseMgr`).
+
+        Raises
+        ------
+        KeyError
+            If there is no backend of this name.
+        ImportError
+            If the backend cannot be imported.
+        """
+        with self._lock:
+            if name not in self._backends:
+                self._discover()
+            backend = self._backends[name]
+            if isinstance(backend, str):
+                module, _, attr = backend.partition(':')
+                try:
+                    backend = getattr(importlib.import_module(module), attr)
+                except AttributeError:
+                    raise ImportError("cannot import name '{0}' from '{1}'"
+                                      .format(attr, module))
+                self._backends[name] = backend
+            return backend
+
+    def loaded(self):
+        """Names of the backends already imported."""
+        with self._lock:
+            return sorted(n for n, b in self._backends.items()
+                          if not isinstance(b, str))
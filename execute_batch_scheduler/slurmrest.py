@@ -0,0 +1,413 @@
+"""Slurm REST API (slurmrestd) transport.
+
+List of defined class and function:
+
+- :py:class:`SlurmRestClient` : Pooled HTTP connections to slurmrestd.
+- :py:class:`SlurmRestError` : Error reported by slurmrestd.
+- :py:func:`job_description` : Job description of ``sbatch`` arguments.
+
+When ``_DEFAULT_SLURMREST_URL`` is set, :py:class:`~execute_batch_scheduler.backends.SlurmMgr`
+submits and cancels jobs, and the shared state poller queries them,
+through slurmrestd instead of forking ``sbatch``, ``scancel``, ``sacct``
+and ``squeue``. Requests go through a few persistent HTTP/1.1
+connections kept alive between cells. The states of all the polled jobs
+are read from the controller with a single request filtered on their
+ids, and from the accounting database (slurmdbd) with a second one for
+the jobs the controller has already purged.
+
+The URL is ``http://host:port``, ``https://host:port`` or
+``unix:/path/to/slurmrestd.socket``. When the ``SLURM_JWT`` environment
+variable is set (like after ``export $(scontrol token)``), requests are
+authenticated with this token.
+
+slurmrestd does not read ``#SBATCH`` directives: job options are given
+as arguments of the cell, those known by :py:func:`job_description`.
+"""
+import os
+import json
+import time
+import socket
+import getpass
+import threading
+import collections
+import http.client
+from urllib.parse import urlsplit
+
+#: sbatch options of the job description, with their field and type
+_OPTIONS = {
+    '-n': ('tasks', int), '--ntasks': ('tasks', int),
+    '-c': ('cpus_per_task', int), '--cpus-per-task': ('cpus_per_task', int),
+    '-N': ('nodes', str), '--nodes': ('nodes', str),
+    '-p': ('partition', str), '--partition': ('partition', str),
+    '-J': ('name', str), '--job-name': ('name', str),
+    '-A': ('account', str), '--account': ('account', str),
+    '-q': ('qos', str), '--qos': ('qos', str),
+    '-t': ('time_limit', 'minutes'), '--time': ('time_limit', 'minutes'),
+    '--mem': ('memory_per_node', 'megabytes'),
+    '--reservation': ('reservation', str),
+    '--constraint': ('constraints', str), '-C': ('constraints', str),
+    '--output': ('standard_output', str), '-o': ('standard_output', str),
+    '--error': ('standard_error', str), '-e': ('standard_error', str),
+    '--array': ('array', str),
+    '--dependency': ('dependency', str), '-d': ('dependency', str),
+    '--kill-on-invalid-dep': ('kill_on_invalid_dependency', 'yes'),
+}
+
+
+class SlurmRestError(Exception):
+    """Error reported by slurmrestd, or failed request.
+
+    The ``status`` attribute is the HTTP status of the reply, None when
+    the request failed without reply.
+    """
+
+    def __init__(self, message, status=None):
+        super(SlurmRestError, self).__init__(message)
+        self.status = status
+
+
+def _minutes(value):
+    """Minutes of a Slurm time limit (``[days-]hours:minutes:seconds``,
+    ``minutes:seconds`` or ``minutes``)."""
+    days, _, hms = value.rpartition('-')
+    parts = [int(p) for p in hms.split(':')]
+    if days:
+        parts += [0] * (3 - len(parts))
+        h, m, s = parts
+    elif len(parts) == 3:
+        h, m, s = parts
+    elif len(parts) == 2:
+        h, m, s = 0, parts[0], parts[1]
+    else:
+        h, m, s = 0, parts[0], 0
+    return int(days or 0) * 1440 + h * 60 + m + (1 if s else 0)
+
+
+def _megabytes(value):
+    """Megabytes of a Slurm memory size (like ``4G`` or ``500``)."""
+    units = {'K': 1. / 1024, 'M': 1, 'G': 1024, 'T': 1024 * 1024}
+    unit = value[-1].upper()
+    if unit in units:
+        return int(float(value[:-1]) * units[unit])
+    return int(value)
+
+
+def job_description(args, env):
+    """Build the slurmrestd job description of ``sbatch`` arguments.
+
+    Parameters
+    ----------
+    args : list of str
+        ``sbatch`` arguments, ``--opt=value``, ``--opt value`` or ``-o
+        value`` forms.
+    env : dict
+        Job environment.
+
+    Returns
+    -------
+    job: dict
+        Job description.
+
+    Raises
+    ------
+    ValueError
+        If an argument has no job description field.
+    """
+    job = {'environment': ['{0}={1}'.format(k, v) for k, v in env.items()],
+           'current_working_directory': os.getcwd()}
+    i = 0
+    while i < len(args):
+        opt, sep, value = args[i].partition('=')
+        if not sep and opt not in _OPTIONS and opt[:2] in _OPTIONS \
+                and not opt.startswith('--'):
+            # Short option glued to its value, like -n4
+            opt, value, sep = opt[:2], opt[2:], '='
+        if opt not in _OPTIONS:
+            raise ValueError("option '{0}' is not supported by slurmrestd "
+                             "submissions".format(args[i]))
+        if not sep:
+            i += 1
+            if i >= len(args):
+                raise ValueError("option '{0}' needs a value".format(opt))
+            value = args[i]
+        field, kind = _OPTIONS[opt]
+        if kind == 'minutes':
+            job[field] = {'set': True, 'number': _minutes(value)}
+        elif kind == 'megabytes':
+            job[field] = {'set': True, 'number': _megabytes(value)}
+        elif kind == 'yes':
+            job[field] = value == 'yes'
+        else:
+            job[field] = kind(value)
+        i += 1
+    return job
+
+
+def _number(value):
+    """Integer of a slurmrestd field, plain or ``{set, number}``."""
+    if isinstance(value, dict):
+        return value.get('number') if value.get('set', True) else None
+    return value
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    """HTTP connection over a unix socket."""
+
+    def __init__(self, path, timeout):
+        super(_UnixHTTPConnection, self).__init__('localhost', timeout=timeout)
+        self._path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self._path)
+
+
+class SlurmRestClient(object):
+    """Pooled HTTP connections to slurmrestd.
+
+    At most ``_DEFAULT_SLURMREST_CONNECTIONS`` idle connections are kept
+    open for later requests. A request failing on a connection closed by
+    the server is retried once on a new connection.
+    """
+
+    # Clients by URL, shared among all the managers
+    _clients = {}
+    _clients_lock = threading.Lock()
+
+    def __init__(self, url, version=None, max_connections=None, timeout=30.):
+        """Initialize a client without any connection.
+
+        Parameters
+        ----------
+        url : str
+            slurmrestd URL.
+        version : str
+            API version, like ``v0.0.40`` (default from
+            ``_DEFAULT_SLURMREST_VERSION``).
+        max_connections : int
+            Maximal number of idle connections (default from
+            ``_DEFAULT_SLURMREST_CONNECTIONS``).
+        timeout : float
+            Socket timeout in seconds.
+        """
+        from . import _DEFAULT_SLURMREST_VERSION, _DEFAULT_SLURMREST_CONNECTIONS
+        self.url = url
+        self.version = version or _DEFAULT_SLURMREST_VERSION
+        self.max_connections = max_connections or _DEFAULT_SLURMREST_CONNECTIONS
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._idle = collections.deque()
+        # Number of opened connections
+        self.connections = 0
+        # Time of the first state query of the polled jobs, and jobs
+        # unknown by the accounting database
+        self._first_query = {}
+        self._unknown = set()
+
+    @classmethod
+    def default(cls):
+        """Get the shared client of ``_DEFAULT_SLURMREST_URL``, None when not
+        set."""
+        from . import _DEFAULT_SLURMREST_URL
+        if not _DEFAULT_SLURMREST_URL:
+            return None
+        with cls._clients_lock:
+            if _DEFAULT_SLURMREST_URL not in cls._clients:
+                cls._clients[_DEFAULT_SLURMREST_URL] = cls(_DEFAULT_SLURMREST_URL)
+            return cls._clients[_DEFAULT_SLURMREST_URL]
+
+    def _connect(self):
+        """Open a new connection."""
+        with self._lock:
+            self.connections += 1
+        if self.url.startswith('unix:'):
+            return _UnixHTTPConnection(self.url[len('unix:'):], self.timeout)
+        url = urlsplit(self.url)
+        if url.scheme == 'https':
+            return http.client.HTTPSConnection(url.netloc, timeout=self.timeout)
+        return http.client.HTTPConnection(url.netloc, timeout=self.timeout)
+
+    def _headers(self):
+        headers = {'Content-Type': 'application/json',
+                   'Accept': 'application/json'}
+        token = os.environ.get('SLURM_JWT')
+        if token:
+            headers['X-SLURM-USER-NAME'] = getpass.getuser()
+            headers['X-SLURM-USER-TOKEN'] = token
+        return headers
+
+    def request(self, method, path, body=None):
+        """Send a request on a pooled connection.
+
+        Parameters
+        ----------
+        method : str
+            HTTP method.
+        path : str
+            Path below the API version, like ``/slurm/{version}/jobs``.
+        body : dict
+            JSON body.
+
+        Returns
+        -------
+        data: dict
+            Decoded JSON response.
+
+        Raises
+        ------
+        SlurmRestError
+            If the request fails or slurmrestd reports errors.
+        """
+        path = path.format(version=self.version)
+        data = None if body is None else json.dumps(body).encode('utf8')
+        for attempt in (0, 1):
+            with self._lock:
+                conn = self._idle.pop() if self._idle else None
+            reused = conn is not None
+            if conn is None:
+                conn = self._connect()
+            try:
+                conn.request(method, path, body=data, headers=self._headers())
+                resp = conn.getresponse()
+                content = resp.read()
+            except (http.client.HTTPException, OSError) as e:
+                conn.close()
+                # Idle connection may have been closed by the server
+                if reused and attempt == 0:
+                    continue
+                raise SlurmRestError("{0} {1}: {2}".format(method, path, e))
+            if resp.will_close:
+                conn.close()
+            else:
+                with self._lock:
+                    if len(self._idle) < self.max_connections:
+                        self._idle.append(conn)
+                        conn = None
+                if conn is not None:
+                    conn.close()
+            break
+        try:
+            result = json.loads(content.decode('utf8')) if content else {}
+        except ValueError:
+            result = {}
+        errors = [e.get('error') or e.get('description') or str(e)
+                  for e in result.get('errors', []) if e]
+        if resp.status >= 400 or errors:
+            raise SlurmRestError("{0} {1}: {2}".format(
+                method, path, '; '.join(errors) or resp.reason), resp.status)
+        return result
+
+    def submit(self, script, job):
+        """Submit a job script.
+
+        Parameters
+        ----------
+        script : str
+            Job script.
+        job : dict
+            Job description (see :py:func:`job_description`).
+
+        Returns
+        -------
+        jobid: int
+            Slurm job id.
+        """
+        result = self.request('POST', '/slurm/{version}/job/submit',
+                              {'script': script, 'job': job})
+        return int(result['job_id'])
+
+    @staticmethod
+    def _job_state(job):
+        """``(name, state)`` of a job record of the controller or of the
+        accounting database."""
+        if 'state' in job:
+            # slurmdbd record
+            state = job['state'].get('current')
+            array = job.get('array') or {}
+            array, task = _number(array.get('job_id')), (
+                _number(array.get('task_id')), array.get('task'))
+        else:
+            state = job.get('job_state')
+            array, task = _number(job.get('array_job_id')), (
+                _number(job.get('array_task_id')),
+                job.get('array_task_string') or
+                job.get('array_task_id_bitmap'))
+        if isinstance(state, list):
+            state = ' '.join(state)
+        if not array:
+            return str(job.get('job_id')), state
+        task, spec = task
+        if task is None:
+            task = '[{0}]'.format((spec or '').strip('[]'))
+        return '{0}_{1}'.format(array, task), state
+
+    def job_states(self, jobids):
+        """Get the states of jobs.
+
+        The jobs are read from the controller with a single request
+        filtered on their ids. Those the controller has already purged
+        are read with a single request to the accounting database
+        (slurmdbd), over ``_DEFAULT_SLURMREST_DB_WINDOW`` seconds before
+        their first query. Jobs it does not know either are not searched
+        for again. Requests go through the pooled connections.
+
+        Parameters
+        ----------
+        jobids : list of str
+            Job ids.
+
+        Returns
+        -------
+        states: list of tuple
+            ``(name, state)`` pairs, ``name`` being the job id or
+            ``jobid_task`` for job array tasks (``jobid_[2-9]`` for tasks
+            still pending together). Jobs unknown by slurmrestd are
+            missing.
+
+        Raises
+        ------
+        SlurmRestError
+            If a request fails.
+        """
+        from . import _DEFAULT_SLURMREST_DB_WINDOW
+        jobids = sorted(set(str(j) for j in jobids))
+        now = time.time()
+        with self._lock:
+            # Forget the jobs no longer polled
+            self._first_query = dict((j, self._first_query.get(j, now))
+                                     for j in jobids)
+            self._unknown.intersection_update(jobids)
+        if not jobids:
+            return []
+        result = self.request('GET', '/slurm/{version}/jobs/state?job_id='
+                              + ','.join(jobids))
+        states = [self._job_state(job) for job in result.get('jobs', [])]
+        states = [r for r in states if r[0].partition('_')[0] in jobids]
+        found = set(r[0].partition('_')[0] for r in states)
+        with self._lock:
+            missing = [j for j in jobids
+                       if j not in found and j not in self._unknown]
+            start = min([self._first_query[j] for j in missing] or [now])
+        if missing:
+            result = self.request(
+                'GET', '/slurmdb/{{version}}/jobs?step={0}&start_time={1}'
+                .format(','.join(missing),
+                        int(start - _DEFAULT_SLURMREST_DB_WINDOW)))
+            rows = [self._job_state(job) for job in result.get('jobs', [])]
+            rows = [r for r in rows if r[0].partition('_')[0] in missing]
+            states.extend(rows)
+            found = set(r[0].partition('_')[0] for r in rows)
+            with self._lock:
+                self._unknown.update(j for j in missing if j not in found)
+        return states
+
+    def cancel(self, jobid):
+        """Cancel a job."""
+        self.request('DELETE', '/slurm/{{version}}/job/{0}'.format(jobid))
+
+    def close(self):
+        """Close the idle connections."""
+        with self._lock:
+            while self._idle:
+                self._idle.pop().close()
@@ -0,0 +1,276 @@
+"""Incremental staging of files to and from a remote working directory.
+
+List of defined class and function:
+
+- :py:class:`Stager` : Copy files between the local and a remote working
+  directory through ssh.
+- :py:class:`StageError` : Failed transfer.
+- :py:func:`manifest` : Content hashes of local files.
+
+The remote working directory persists between cells, so that it acts as
+a cache of the staged inputs: only the files changed since the last run
+are transferred. With ``rsync`` installed on both sides, files are sent
+with its delta transfer, moving only the changed blocks. Otherwise the
+SHA-256 hashes of the local and remote files are compared and the
+changed files are sent in a tar stream, which only needs ``tar`` and
+``sha256sum`` on the remote host.
+
+Staged and fetched paths are relative to the current directory, and are
+given the same relative path in the remote working directory.
+"""
+import os
+import shlex
+import shutil
+import hashlib
+import tarfile
+import subprocess
+from subprocess import Popen, PIPE
+
+
+class StageError(Exception):
+    """Failed transfer of staged or fetched files."""
+
+
+def _checked(path):
+    """Normalized relative path, refusing paths out of the current
+    directory."""
+    norm = os.path.normpath(path)
+    if os.path.isabs(norm) or norm == '..' or norm.startswith('..' + os.sep):
+        raise ValueError("path '{0}' is not below the current "
+                         "directory".format(path))
+    return norm
+
+
+def _sha256(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def manifest(paths):
+    """Get the content hashes of local files.
+
+    Parameters
+    ----------
+    paths : list of str
+        Files or directories, walked recursively. Missing paths are
+        ignored.
+
+    Returns
+    -------
+    hashes: dict
+        SHA-256 hex digests by normalized relative file path.
+    """
+    hashes = {}
+    for path in paths:
+        if os.path.isfile(path):
+            hashes[_checked(path)] = _sha256(path)
+        for root, _, files in os.walk(path):
+            for name in files:
+                name = os.path.join(root, name)
+                if os.path.isfile(name):
+                    hashes[_checked(name)] = _sha256(name)
+    return hashes
+
+
+class Stager(object):
+    """Copy files between the local and a remote working directory
+    through ssh.
+
+    Transfers go through ``rsync`` when ``_DEFAULT_SSH_RSYNC`` is set and
+    ``rsync`` is installed on both sides, otherwise through tar streams
+    of the files whose content hash differs. Each remote host is probed
+    for ``rsync`` once per session.
+    """
+
+    # Whether rsync is installed on the remote host, by ssh command
+    _remote_rsync = {}
+
+    def __init__(self, ssh, workdir, rsync=None):
+        """Initialize a stager.
+
+        Parameters
+        ----------
+        ssh : list of str
+            ssh command with its options, ending with the remote host.
+        workdir : str
+            Remote working directory, relative to the remote home
+            directory or absolute.
+        rsync : bool
+            Use ``rsync`` when installed (default from
+            ``_DEFAULT_SSH_RSYNC``).
+        """
+        if rsync is None:
+            from . import _DEFAULT_SSH_RSYNC
+            rsync = _DEFAULT_SSH_RSYNC
+        self.ssh = list(ssh)
+        self.workdir = workdir
+        self.rsync = shutil.which('rsync') if rsync else None
+
+    def _run(self, command, **kwargs):
+        """Start a remote shell command."""
+        return Popen(self.ssh + [command], **kwargs)
+
+    def remote_manifest(self, paths):
+        """Get the content hashes of remote files.
+
+        Parameters
+        ----------
+        paths : list of str
+            Files or directories relative to the working directory.
+            Missing paths are ignored.
+
+        Returns
+        -------
+        hashes: dict
+            SHA-256 hex digests by normalized relative file path, empty
+            when ``sha256sum`` is not available.
+        """
+        command = "cd {0} 2>/dev/null && find {1} -type f -exec sha256sum " \
+            "{{}} + 2>/dev/null; true".format(
+                shlex.quote(self.workdir),
+                ' '.join(shlex.quote('./' + p) for p in paths))
+        p = self._run(command, stdin=subprocess.DEVNULL, stdout=PIPE,
+                      stderr=subprocess.DEVNULL)
+        out = p.communicate()[0].decode('utf8', 'surrogateescape')
+        hashes = {}
+        for line in out.splitlines():
+            # Escaped names (with newlines or backslashes) are sent again
+            digest, sep, name = line.partition('  ')
+            if sep and not digest.startswith('\\'):
+                hashes[os.path.normpath(name)] = digest
+        return hashes
+
+    def _use_rsync(self):
+        """Whether rsync is installed on both sides."""
+        if not self.rsync:
+            return False
+        key = tuple(self.ssh)
+        if key not in self._remote_rsync:
+            p = self._run('command -v rsync', stdin=subprocess.DEVNULL,
+                          stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            self._remote_rsync[key] = p.wait() == 0
+        return self._remote_rsync[key]
+
+    def _rsync_cmd(self, sources, dest, options=()):
+        """rsync command line, listing the transferred files."""
+        shell = ' '.join(shlex.quote(a) for a in self.ssh[:-1])
+        return [self.rsync, '-a', '--relative', '--out-format=%n',
+                '--rsync-path=mkdir -p {0} && rsync'.format(
+                    shlex.quote(self.workdir)),
+                '-e', shell] + list(options) + ['--'] + sources + [dest]
+
+    def _rsync_run(self, sources, dest, options=()):
+        p = Popen(self._rsync_cmd(sources, dest, options),
+                  stdin=subprocess.DEVNULL, stdout=PIPE, stderr=PIPE)
+        out, err = p.communicate()
+        if p.returncode != 0:
+            raise StageError("rsync failed: {0}".format(
+                err.decode('utf8', 'replace').strip()))
+        return [n for n in out.decode('utf8', 'replace').splitlines()
+                if n and not n.endswith('/')]
+
+    def stage(self, paths):
+        """Send the changed local files to the remote working directory.
+
+        Parameters
+        ----------
+        paths : list of str
+            Files or directories relative to the current directory.
+
+        Returns
+        -------
+        sent: list of str
+            Transferred files.
+
+        Raises
+        ------
+        ValueError
+            If a path is missing or out of the current directory.
+        StageError
+            If the transfer fails.
+        """
+        paths = [_checked(p) for p in paths]
+        for path in paths:
+            if not os.path.exists(path):
+                raise ValueError("no such file or directory: '{0}'".format(path))
+        if self._use_rsync():
+            return self._rsync_run(paths, '{0}:{1}/'.format(self.ssh[-1],
+                                                            self.workdir))
+        local = manifest(paths)
+        remote = self.remote_manifest(paths)
+        sent = sorted(n for n, h in local.items() if remote.get(n) != h)
+        if not sent:
+            return sent
+        p = self._run("mkdir -p {0} && tar xf - -C {0}".format(
+            shlex.quote(self.workdir)), stdin=PIPE, stdout=subprocess.DEVNULL,
+            stderr=PIPE)
+        try:
+            with tarfile.open(fileobj=p.stdin, mode='w|') as tar:
+                for name in sent:
+                    tar.add(name, recursive=False)
+        except (IOError, OSError):
+            # Remote tar exited early, its error tells why
+            pass
+        err = p.communicate()[1]
+        if p.returncode != 0:
+            raise StageError("staging failed: {0}".format(
+                err.decode('utf8', 'replace').strip()))
+        return sent
+
+    def fetch(self, paths):
+        """Get the remote files differing from the local ones.
+
+        Parameters
+        ----------
+        paths : list of str
+            Files or directories relative to the remote working directory.
+            Missing paths are ignored.
+
+        Returns
+        -------
+        received: list of str
+            Transferred files.
+
+        Raises
+        ------
+        ValueError
+            If a path is out of the working directory.
+        StageError
+            If the transfer fails.
+        """
+        paths = [_checked(p) for p in paths]
+        if self._use_rsync():
+            return self._rsync_run(
+                ['{0}:{1}/./{2}'.format(self.ssh[-1], self.workdir, p)
+                 for p in paths], '.', ['--ignore-missing-args'])
+        remote = self.remote_manifest(paths)
+        local = manifest(paths)
+        wanted = sorted(n for n, h in remote.items() if local.get(n) != h)
+        if not wanted:
+            return wanted
+        p = self._run("cd {0} && tar cf - -- {1}".format(
+            shlex.quote(self.workdir), ' '.join(shlex.quote(n) for n in wanted)),
+            stdin=subprocess.DEVNULL, stdout=PIPE, stderr=PIPE)
+        received = []
+        try:
+            with tarfile.open(fileobj=p.stdout, mode='r|') as tar:
+                for member in tar:
+                    # Only the requested regular files are extracted
+                    if member.isfile() and os.path.normpath(member.name) in wanted:
+                        if hasattr(tarfile, 'data_filter'):
+                            tar.extract(member, filter='data')
+                        else:
+                            tar.extract(member)
+                        received.append(os.path.normpath(member.name))
+        except tarfile.TarError as e:
+            error = e
+        else:
+            error = None
+        err = p.communicate()[1]
+        if p.returncode != 0 or error is not None:
+            raise StageError("fetching failed: {0}".format(
+                err.decode('utf8', 'replace').strip() or error))
+        return received
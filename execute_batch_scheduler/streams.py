@@ -0,0 +1,398 @@
+"""Incremental access to job outputs.
+
+List of defined class:
+
+- :py:class:`FileFollower` : Follow a growing output file from a saved offset.
+- :py:class:`Spool` : Append-only byte buffer stored in a temporary file.
+- :py:class:`PipeDrainer` : Continuously drain a pipe into a spool file.
+- :py:class:`DrainerFollower` : Follow the data of a spool.
+- :py:class:`OutputView` : Lazily decoded view of a complete job output.
+"""
+import os
+import mmap
+import codecs
+import tempfile
+import threading
+
+
+class FileFollower(object):
+    """Follow a growing file.
+
+    The file is read from a saved offset by chunks of bounded size, so
+    that following a huge output never loads it at once in memory. Bytes
+    are decoded incrementally: a multibyte character split over two
+    chunks is returned with the second one.
+    """
+
+    def __init__(self, path, offset=0, chunk_size=65536, encoding='utf8'):
+        """Start following a file.
+
+        Parameters
+        ----------
+        path : str
+            File to follow. It may not exist yet.
+        offset : int
+            Position in bytes from which to read.
+        chunk_size : int
+            Maximal size in bytes of a chunk.
+        encoding : str
+            File encoding.
+        """
+        self.path = path
+        self.offset = offset
+        self.chunk_size = chunk_size
+        self._decoder = codecs.getincrementaldecoder(encoding)('replace')
+
+    def read(self):
+        """Read next chunk.
+
+        Returns
+        -------
+        chunk: str
+            Decoded data appended since last read, empty if none.
+        """
+        data = self._read_raw()
+        self.offset += len(data)
+        return self._decoder.decode(data)
+
+    def _read_raw(self):
+        """Read at most a chunk of bytes from current offset."""
+        # File is reopened at each read to get the data written from other
+        # hosts on network filesystems
+        try:
+            with open(self.path, 'rb') as f:
+                f.seek(self.offset)
+                return f.read(self.chunk_size)
+        except (IOError, OSError):
+            return b''
+
+    def chunks(self):
+        """Iterate over all the chunks available so far."""
+        chunk = self.read()
+        while chunk:
+            yield chunk
+            chunk = self.read()
+
+    def flush(self):
+        """Return the data pending in the decoder (truncated characters)."""
+        return self._decoder.decode(b'', final=True)
+
+
+class Spool(object):
+    """Append-only byte buffer stored in an anonymous temporary file.
+
+    Memory use stays bounded whatever the amount of data appended.
+    """
+
+    def __init__(self):
+        self.size = 0
+        self._spool = tempfile.TemporaryFile()
+        self._lock = threading.Lock()
+
+    def append(self, data):
+        """Append bytes at the end of the buffer."""
+        with self._lock:
+            self._spool.seek(0, os.SEEK_END)
+            self._spool.write(data)
+            self.size += len(data)
+
+    def read(self, offset=0, size=-1):
+        """Read buffered data.
+
+        Parameters
+        ----------
+        offset : int
+            Position in bytes from which to read.
+        size : int
+            Maximal number of bytes to read (-1 to read all).
+
+        Returns
+        -------
+        data: bytes
+        """
+        with self._lock:
+            self._spool.flush()
+            self._spool.seek(offset)
+            return self._spool.read(size)
+
+    def join(self, timeout=None):
+        """Wait until all the data is buffered."""
+        pass
+
+    def follower(self, offset=0, chunk_size=65536, encoding='utf8'):
+        """Get a follower of the buffered data."""
+        return DrainerFollower(self, offset, chunk_size, encoding)
+
+    def view(self, offset=0, encoding='utf8'):
+        """Get a view of the data buffered so far."""
+        with self._lock:
+            self._spool.flush()
+            return OutputView(self._spool, offset, encoding)
+
+
+class PipeDrainer(Spool):
+    """Drain a pipe from a background thread.
+
+    Data is read as soon as it is available and appended to the spool
+    file, so that the writing process never blocks on a full pipe.
+    """
+
+    def __init__(self, pipe, chunk_size=65536):
+        """Start draining a pipe.
+
+        Parameters
+        ----------
+        pipe : file
+            Readable end of the pipe, closed when drained.
+        chunk_size : int
+            Maximal size in bytes of a single read.
+        """
+        super(PipeDrainer, self).__init__()
+        self._thread = threading.Thread(target=self._drain,
+                                        args=(pipe, chunk_size))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _drain(self, pipe, chunk_size):
+        fd = pipe.fileno()
+        try:
+            while True:
+                data = os.read(fd, chunk_size)
+                if not data:
+                    break
+                self.append(data)
+        finally:
+            pipe.close()
+
+    @property
+    def done(self):
+        """Whether the pipe is closed and fully drained."""
+        return not self._thread.is_alive()
+
+    def join(self, timeout=None):
+        """Wait until the pipe is fully drained."""
+        self._thread.join(timeout)
+
+
+class DrainerFollower(FileFollower):
+    """Follow the data of a :py:class:`Spool`, like the one drained from a
+    pipe by a :py:class:`PipeDrainer`."""
+
+    def __init__(self, drainer, offset=0, chunk_size=65536, encoding='utf8'):
+        super(DrainerFollower, self).__init__(
+            None, offset, chunk_size, encoding)
+        self._drainer = drainer
+
+    def _read_raw(self):
+        return self._drainer.read(self.offset, self.chunk_size)
+
+
+class OutputView(object):
+    """Read-only view of a complete job output, decoded on access.
+
+    The output file is memory-mapped, so that nothing is read until a part
+    of it is accessed. The view is indexed by line::
+
+        out, err = job_mgr.get_output_view()
+        len(out)            # number of lines
+        out[-1]             # last line
+        out[1000:1010]      # list of lines
+        out.tail(20)        # text of the last 20 lines
+        str(out)            # whole text, loaded in memory
+
+    Line positions are found on demand: forward accesses build a sparse
+    index of one line start every ``_stride`` lines, and accesses near the
+    end scan the output backward.
+    """
+
+    # Number of lines between two indexed line starts
+    _stride = 1024
+    # Size in bytes of the chunks scanned to count lines or copy the output
+    _chunk_size = 1 << 20
+
+    def __init__(self, source, offset=0, encoding='utf8'):
+        """Map a job output.
+
+        Parameters
+        ----------
+        source : str, file or bytes
+            Output file path, open file or output data. A missing or
+            empty file gives an empty view.
+        offset : int
+            Position in bytes from which the output is viewed.
+        encoding : str
+            Output encoding.
+        """
+        self.encoding = encoding
+        self._buf = b''
+        if isinstance(source, bytes):
+            self._buf = source
+        else:
+            try:
+                if isinstance(source, str):
+                    with open(source, 'rb') as f:
+                        self._buf = mmap.mmap(f.fileno(), 0,
+                                              access=mmap.ACCESS_READ)
+                else:
+                    self._buf = mmap.mmap(source.fileno(), 0,
+                                          access=mmap.ACCESS_READ)
+            except (IOError, OSError, ValueError):
+                # Missing or empty file cannot be mapped
+                pass
+        self._start = min(offset, len(self._buf))
+        self._end = len(self._buf)
+        self._index = [self._start]
+        self._nlines = None
+
+    @property
+    def size(self):
+        """Output size in bytes."""
+        return self._end - self._start
+
+    def _decode(self, start, stop):
+        return self._buf[start:stop].decode(self.encoding, 'replace')
+
+    def text(self, start=0, stop=None):
+        """Decode a part of the output.
+
+        Parameters
+        ----------
+        start : int
+            Position in bytes of the part in the output.
+        stop : int
+            End position in bytes of the part (default to output end).
+        """
+        stop = self.size if stop is None else min(stop, self.size)
+        return self._decode(self._start + start, self._start + stop)
+
+    def __len__(self):
+        """Number of lines, counted by chunks."""
+        if self._nlines is None:
+            n = 0
+            for pos in range(self._start, self._end, self._chunk_size):
+                n += self._buf[pos:min(pos + self._chunk_size,
+                                       self._end)].count(b'\n')
+            if self.size and self._buf[self._end - 1:self._end] != b'\n':
+                n += 1
+            self._nlines = n
+        return self._nlines
+
+    def _forward(self, pos, n):
+        """Start of the n-th line after the one starting at pos."""
+        for _ in range(n):
+            pos = self._buf.find(b'\n', pos, self._end)
+            if pos < 0:
+                return self._end
+            pos += 1
+        return pos
+
+    def _backward(self, n):
+        """Start of the n-th line from the end of the output."""
+        if n <= 0:
+            return self._end
+        pos = self._end
+        if self.size and self._buf[self._end - 1:self._end] == b'\n':
+            pos -= 1
+        for _ in range(n):
+            pos = self._buf.rfind(b'\n', self._start, pos)
+            if pos < 0:
+                return self._start
+        return pos + 1
+
+    def _locate(self, i):
+        """Start position of line i (0 <= i <= number of lines)."""
+        if self._nlines is not None and i > self._nlines - self._stride:
+            return self._backward(self._nlines - i)
+        block, rest = divmod(i, self._stride)
+        while len(self._index) <= block:
+            pos = self._forward(self._index[-1], self._stride)
+            if pos >= self._end:
+                return self._end
+            self._index.append(pos)
+        return self._forward(self._index[block], rest)
+
+    def _line(self, start):
+        stop = self._buf.find(b'\n', start, self._end)
+        return self._decode(start, self._end if stop < 0 else stop)
+
+    def __getitem__(self, key):
+        """Get a line, or a list of lines for a slice."""
+        if isinstance(key, slice):
+            start, stop, step = key.indices(len(self))
+            if step != 1:
+                return [self[i] for i in range(start, stop, step)]
+            lines = []
+            pos = self._locate(start)
+            for _ in range(start, stop):
+                lines.append(self._line(pos))
+                pos = self._forward(pos, 1)
+            return lines
+        if key < 0:
+            if -key > len(self):
+                raise IndexError('line index out of range')
+            return self._line(self._backward(-key))
+        pos = self._locate(key)
+        if pos >= self._end:
+            raise IndexError('line index out of range')
+        return self._line(pos)
+
+    def __iter__(self):
+        """Iterate over the lines."""
+        pos = self._start
+        while pos < self._end:
+            yield self._line(pos)
+            pos = self._forward(pos, 1)
+
+    def __str__(self):
+        return self._decode(self._start, self._end)
+
+    def __repr__(self):
+        return "<OutputView: {0} bytes>".format(self.size)
+
+    def head(self, n):
+        """Text of the first n lines."""
+        return self._decode(self._start, self._forward(self._start, n))
+
+    def tail(self, n):
+        """Text of the last n lines."""
+        return self._decode(self._backward(n), self._end)
+
+    def summary(self, max_size, head, tail):
+        """Text of the output, or of its head and tail when too large.
+
+        Parameters
+        ----------
+        max_size : int
+            Maximal size in bytes of the output displayed as a whole. It
+            also bounds the size of the head and tail.
+        head : int
+            Number of first lines of a too large output.
+        tail : int
+            Number of last lines of a too large output.
+        """
+        if self.size <= max_size:
+            return str(self)
+        head_end = min(self._forward(self._start, head),
+                       self._start + max_size // 2)
+        tail_start = max(self._backward(tail), self._end - max_size // 2)
+        if head_end >= tail_start:
+            return str(self)
+        text = self._decode(self._start, head_end)
+        if not text.endswith('\n'):
+            text += '\n'
+        text += "[... {0} bytes omitted ...]\n".format(tail_start - head_end)
+        return text + self._decode(tail_start, self._end)
+
+    def write_to(self, f):
+        """Copy the output to a binary file by chunks."""
+        for pos in range(self._start, self._end, self._chunk_size):
+            f.write(self._buf[pos:min(pos + self._chunk_size, self._end)])
+
+    def close(self):
+        """Unmap the output."""
+        if isinstance(self._buf, mmap.mmap):
+            self._buf.close()
+        self._buf = b''
+        self._start = self._end = 0
+        self._index = [0]
+        self._nlines = 0
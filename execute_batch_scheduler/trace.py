@@ -0,0 +1,288 @@
+"""Latency instrumentation of cell executions.
+
+List of defined class and function:
+
+- :py:class:`Trace` : Timestamped phase events of a workload manager.
+- :py:class:`TraceLog` : Traces of a session and their aggregates.
+- :py:func:`traced` : Method decorator recording a span.
+
+Each workload manager records the following events in its ``trace``
+attribute:
+
+- marks ``submit`` (submission start), ``popen`` (submission process
+  created), ``submitted`` (submission returned), ``running`` (first
+  running state) and ``end`` (end state),
+- spans ``state_query`` (each job state lookup) and ``output`` (each
+  output retrieval), with their duration.
+
+Traces are exported in the Chrome trace event format (to be opened in
+``chrome://tracing`` or Perfetto) or as JSON lines.
+"""
+import os
+import json
+import time
+import functools
+import itertools
+import threading
+import collections
+import contextlib
+
+
+class Trace(object):
+    """Timestamped phase events of a workload manager."""
+
+    _ids = itertools.count(1)
+
+    def __init__(self, name, maxlen=None):
+        """Start an empty trace.
+
+        Parameters
+        ----------
+        name : str
+            Traced object name (workload manager class name).
+        maxlen : int
+            Maximal number of events, the oldest ones being dropped
+            (default to unbounded).
+        """
+        self.id = next(self._ids)
+        self.name = name
+        # Job identifier, set on submission
+        self.label = None
+        # Sequence of (phase, timestamp, duration or None)
+        self.events = collections.deque(maxlen=maxlen)
+        self._marks = {}
+        self._active = set()
+
+    def mark(self, phase, t=None):
+        """Record the first occurrence of a phase.
+
+        Parameters
+        ----------
+        phase : str
+            Phase name.
+        t : float
+            Timestamp of the occurrence (default to now).
+
+        Returns
+        -------
+        recorded: bool
+            Whether the phase was not recorded yet.
+        """
+        if phase in self._marks:
+            return False
+        t = time.time() if t is None else t
+        self._marks[phase] = t
+        self.events.append((phase, t, None))
+        return True
+
+    def clear(self):
+        """Forget all the events."""
+        self.events.clear()
+        self._marks = {}
+
+    def first(self, phase):
+        """Timestamp of a mark, None if not recorded."""
+        return self._marks.get(phase)
+
+    @contextlib.contextmanager
+    def span(self, phase):
+        """Record the duration of a block.
+
+        Nested spans of the same phase are only recorded once.
+        """
+        if phase in self._active:
+            yield
+            return
+        self._active.add(phase)
+        start = time.time()
+        try:
+            yield
+        finally:
+            self._active.discard(phase)
+            self.events.append((phase, start, time.time() - start))
+
+    def spans(self, phase):
+        """Durations of the spans of a phase."""
+        return [d for p, _, d in self.events if p == phase and d is not None]
+
+    def summary(self):
+        """Duration of each phase of the execution.
+
+        Returns
+        -------
+        phases: dict
+            Durations in seconds of ``submission`` (submit to submitted),
+            ``queue`` (submitted to running), ``run`` (running to end),
+            ``total`` (submit to end) and of each span phase (sum of
+            its spans, like ``state_query``). Phases not reached are
+            missing.
+        """
+        m = self._marks
+        phases = {}
+        if 'submit' in m and 'submitted' in m:
+            phases['submission'] = m['submitted'] - m['submit']
+        if 'submitted' in m and 'running' in m:
+            phases['queue'] = max(m['running'] - m['submitted'], 0.)
+        if 'running' in m and 'end' in m:
+            phases['run'] = m['end'] - m['running']
+        if 'submit' in m and 'end' in m:
+            phases['total'] = m['end'] - m['submit']
+        for phase in self.span_phases():
+            phases[phase] = sum(self.spans(phase))
+        return phases
+
+    def span_phases(self):
+        """Phases recorded as spans."""
+        return set(p for p, _, d in self.events if d is not None)
+
+    def chrome_events(self, pid=None):
+        """Events in the Chrome trace event format.
+
+        The trace is a thread of the process, marks are instant events
+        and phases between marks are complete events.
+        """
+        pid = os.getpid() if pid is None else pid
+        events = [{'name': 'thread_name', 'ph': 'M', 'pid': pid,
+                   'tid': self.id, 'args': {'name': self._title()}}]
+        for phase, t, d in self.events:
+            event = {'name': phase, 'pid': pid, 'tid': self.id,
+                     'ts': t * 1e6}
+            if d is None:
+                event.update(ph='i', s='t')
+            else:
+                event.update(ph='X', dur=d * 1e6)
+            events.append(event)
+        m = self._marks
+        for phase, start, end in (('submission', 'submit', 'submitted'),
+                                  ('queue', 'submitted', 'running'),
+                                  ('run', 'running', 'end')):
+            if start in m and end in m and m[end] >= m[start]:
+                events.append({'name': phase, 'ph': 'X', 'pid': pid,
+                               'tid': self.id, 'ts': m[start] * 1e6,
+                               'dur': (m[end] - m[start]) * 1e6})
+        return events
+
+    def records(self):
+        """Events as JSON serializable dictionaries."""
+        return [{'trace': self.id, 'mgr': self.name, 'job': self.label,
+                 'phase': phase, 'ts': t, 'dur': d}
+                for phase, t, d in self.events]
+
+    def _title(self):
+        if self.label is None:
+            return "{0} #{1}".format(self.name, self.id)
+        return "{0} {1}".format(self.name, self.label)
+
+
+def traced(phase):
+    """Decorate a workload manager method to record its calls as spans."""
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            with self.trace.span(phase):
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class TraceLog(object):
+    """Traces of the session.
+
+    Only the ``_DEFAULT_TRACE_MAX`` latest traces are kept.
+    """
+
+    def __init__(self, maxlen=None):
+        """Initialize an empty log.
+
+        Parameters
+        ----------
+        maxlen : int
+            Maximal number of traces (default from ``_DEFAULT_TRACE_MAX``).
+        """
+        self._maxlen = maxlen
+        self._lock = threading.Lock()
+        self.traces = collections.deque()
+        # Traces of objects shared by all the managers, never evicted
+        self._attached = []
+
+    @property
+    def maxlen(self):
+        """Maximal number of traces."""
+        if self._maxlen is None:
+            from . import _DEFAULT_TRACE_MAX
+            return _DEFAULT_TRACE_MAX
+        return self._maxlen
+
+    def new(self, name):
+        """Start a new trace in the log."""
+        trace = Trace(name)
+        with self._lock:
+            self.traces.append(trace)
+            while len(self.traces) > self.maxlen:
+                self.traces.popleft()
+        return trace
+
+    def attach(self, trace):
+        """Log a trace living as long as the session.
+
+        Such a trace is never evicted, it should bound its own number of
+        events (see :py:class:`Trace`).
+        """
+        with self._lock:
+            self._attached.append(trace)
+
+    def all(self):
+        """All the logged traces."""
+        with self._lock:
+            return list(self._attached) + list(self.traces)
+
+    def clear(self):
+        """Forget all the traces and events of attached traces."""
+        with self._lock:
+            self.traces.clear()
+            for trace in self._attached:
+                trace.clear()
+
+    def aggregate(self):
+        """Aggregate phase durations over the traces of each manager.
+
+        Returns
+        -------
+        stats: dict
+            For each (manager name, phase): count, total, mean and maximum
+            durations in seconds. For span phases, like ``state_query``,
+            count is the number of spans.
+        """
+        samples = collections.defaultdict(list)
+        for trace in self.all():
+            spans = trace.span_phases()
+            for phase, d in trace.summary().items():
+                if phase in spans:
+                    samples[trace.name, phase].extend(trace.spans(phase))
+                else:
+                    samples[trace.name, phase].append(d)
+        return dict((key, {'count': len(v), 'total': sum(v),
+                           'mean': sum(v) / len(v), 'max': max(v)})
+                    for key, v in samples.items())
+
+    def export(self, path, fmt='chrome'):
+        """Export the traces to a file.
+
+        Parameters
+        ----------
+        path : str
+            Output file.
+        fmt : str
+            ``'chrome'`` for the Chrome trace event format, ``'jsonl'`` for
+            one JSON event per line.
+        """
+        traces = self.all()
+        with open(path, 'w') as f:
+            if fmt == 'jsonl':
+                for trace in traces:
+                    for record in trace.records():
+                        f.write(json.dumps(record) + '\n')
+            else:
+                json.dump({'traceEvents': [e for t in traces
+                                           for e in t.chrome_events()],
+                           'displayTimeUnit': 'ms'}, f)
@@ -0,0 +1,153 @@
+"""File system notifications for job progression.
+
+List of defined class:
+
+- :py:class:`FileWatcher` : Wait for creation or modification of some files.
+
+On Linux, the watcher relies on ``inotify`` (through :py:mod:`ctypes`)
+to be woken up as soon as a watched file changes on a local filesystem.
+Since ``inotify`` does not see writes made by other hosts on network
+filesystems, files are also checked with ``stat`` at a short interval.
+When ``inotify`` is unavailable, only this check is performed.
+"""
+import os
+import sys
+import time
+import errno
+import select
+import ctypes
+import ctypes.util
+
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_NONBLOCK = 0o4000
+_IN_CLOEXEC = 0o2000000
+
+_libc = None
+
+
+def _get_libc():
+    """Load the C library, return None if inotify is not available."""
+    global _libc
+    if _libc is None:
+        _libc = False
+        if sys.platform.startswith('linux'):
+            try:
+                libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6',
+                                   use_errno=True)
+                libc.inotify_init1, libc.inotify_add_watch
+                _libc = libc
+            except (OSError, AttributeError):
+                pass
+    return _libc or None
+
+
+class FileWatcher(object):
+    """Wait for creation or modification of a set of files.
+
+    Parent directories of the files are watched with ``inotify`` when
+    available. Watched files are also checked with ``stat`` every
+    ``stat_interval`` seconds.
+    """
+
+    def __init__(self, paths, stat_interval=1.):
+        """Start watching files.
+
+        Parameters
+        ----------
+        paths : list of str
+            Files to watch. They may not exist yet.
+        stat_interval : float
+            Delay between two ``stat`` checks of the files.
+        """
+        self._paths = [os.path.abspath(p) for p in paths]
+        self._stat_interval = stat_interval
+        self._stats = dict((p, self._stat(p)) for p in self._paths)
+        self._fd = None
+        self._wds = {}
+        libc = _get_libc()
+        if libc is None:
+            return
+        fd = libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+        if fd < 0:
+            return
+        mask = _IN_CREATE | _IN_CLOSE_WRITE | _IN_MOVED_TO
+        for d in set(os.path.dirname(p) for p in self._paths):
+            wd = libc.inotify_add_watch(fd, d.encode('utf8'), mask)
+            if wd >= 0:
+                self._wds[wd] = d
+        if self._wds:
+            self._fd = fd
+        else:
+            os.close(fd)
+
+    @property
+    def uses_inotify(self):
+        """Whether the watcher is notified by the kernel."""
+        return self._fd is not None
+
+    @staticmethod
+    def _stat(path):
+        try:
+            st = os.stat(path)
+            return (st.st_mtime, st.st_size)
+        except OSError:
+            return None
+
+    def _check(self):
+        """Return the files which changed since last check."""
+        changed = set()
+        for p in self._paths:
+            st = self._stat(p)
+            if st != self._stats[p]:
+                self._stats[p] = st
+                changed.add(p)
+        return changed
+
+    def _read_events(self):
+        """Consume pending inotify events.
+
+        Events only wake the watcher up, changes are found by :py:meth:`_check`.
+        """
+        while True:
+            try:
+                if not os.read(self._fd, 65536):
+                    return
+            except OSError as e:
+                if e.errno in (errno.EAGAIN, errno.EINTR):
+                    return
+                raise e
+
+    def wait(self, timeout):
+        """Block until a watched file changes or timeout expires.
+
+        Parameters
+        ----------
+        timeout : float
+            Maximal time to wait in seconds.
+
+        Returns
+        -------
+        changed: set
+            Watched files which were created or modified.
+        """
+        end = time.time() + max(timeout, 0.)
+        while True:
+            delay = min(end - time.time(), self._stat_interval)
+            if delay > 0:
+                if self._fd is not None:
+                    r, _, _ = select.select([self._fd], [], [], delay)
+                    if r:
+                        self._read_events()
+                else:
+                    time.sleep(delay)
+            changed = self._check()
+            if changed or time.time() >= end:
+                return changed
+
+    def close(self):
+        """Stop watching."""
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
@@ -0,0 +1,111 @@
+"""Test fixtures.
+
+The package ``__init__.py`` is generated on install from ``__init__.py.in``
+(see ``setup.py``). When missing, it is rendered here with a ``slurm``
+default workload manager so that the tests run from the source tree.
+
+Tests needing a scheduler use the stand-in commands of
+``benchmarks/fakebin`` through the :py:func:`fake_slurm` fixture.
+"""
+import os
+import sys
+import time
+import types
+import subprocess
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PKG = os.path.join(ROOT, 'execute_batch_scheduler')
+FAKEBIN = os.path.join(ROOT, 'benchmarks', 'fakebin')
+
+sys.path.insert(0, ROOT)
+if not os.path.exists(os.path.join(PKG, '__init__.py')):
+    with open(os.path.join(PKG, '__init__.py.in')) as f:
+        source = f.read().format(default_manager="'slurm'",
+                                 default_cmd_args="''")
+    package = types.ModuleType('execute_batch_scheduler')
+    package.__path__ = [PKG]
+    package.__file__ = os.path.join(PKG, '__init__.py')
+    exec(compile(source, package.__file__, 'exec'), package.__dict__)
+    sys.modules['execute_batch_scheduler'] = package
+
+
+class FakeSlurm(object):
+    """State directory of the stand-in scheduler."""
+
+    def __init__(self, directory):
+        self.dir = directory
+
+    def calls(self, cmd=None):
+        """Logged command calls, as lists of arguments."""
+        try:
+            with open(os.path.join(self.dir, 'calls.log')) as f:
+                lines = [line.split(' ', 2) for line in f]
+        except (IOError, OSError):
+            return []
+        return [line[2].split() for line in lines
+                if cmd is None or line[0] == cmd]
+
+    def sbatch(self, script='#!/bin/bash\ntrue\n', *args):
+        """Submit a script, return its job id."""
+        out = subprocess.check_output(['sbatch'] + list(args),
+                                      input=script.encode())
+        return out.decode().split()[-1]
+
+    def state(self, jobid):
+        try:
+            with open(os.path.join(self.dir, 'jobs',
+                                   '{0}.state'.format(jobid))) as f:
+                return f.read().strip()
+        except (IOError, OSError):
+            return None
+
+    def wait_state(self, jobid, states, timeout=10.):
+        """Wait until a job reaches one of the given states."""
+        end = time.time() + timeout
+        while time.time() < end:
+            state = self.state(jobid)
+            if state in states:
+                return state
+            time.sleep(0.05)
+        raise AssertionError('job {0} stuck in {1}'.format(
+            jobid, self.state(jobid)))
+
+
+@pytest.fixture
+def fake_slurm(tmp_path, monkeypatch):
+    """Stand-in Slurm and SSH commands in front of ``PATH``, job outputs
+    in a temporary directory."""
+    import execute_batch_scheduler
+    from execute_batch_scheduler.backends import (SlurmAllocation, SlurmMgr,
+                                                  SlurmStatePoller)
+    from execute_batch_scheduler.journal import JobJournal
+    directory = str(tmp_path / 'slurm')
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('PATH', FAKEBIN + os.pathsep + os.environ['PATH'])
+    monkeypatch.setenv('FAKE_SLURM_DIR', directory)
+    monkeypatch.setenv('FAKE_DAEMON_IDLE', '2')
+    for name in ('FAKE_QUEUE_DELAY', 'FAKE_STATES', 'FAKE_END_STATE',
+                 'FAKE_ACCT_LAG'):
+        monkeypatch.delenv(name, raising=False)
+    monkeypatch.setattr(execute_batch_scheduler, '_DEFAULT_SLURM_OUTERR_FILE',
+                        str(tmp_path / 'out' / 'python-execute-slurm.%J'))
+    monkeypatch.setattr(execute_batch_scheduler, '_DEFAULT_SLURM_POLL_TICK',
+                        0.05)
+    monkeypatch.setattr(execute_batch_scheduler, '_DEFAULT_JOURNAL_FILE',
+                        str(tmp_path / 'journal.sqlite'))
+    # Jobs of other tests are not polled
+    monkeypatch.setattr(SlurmMgr, '_poller', SlurmStatePoller())
+    yield FakeSlurm(directory)
+    SlurmAllocation.release_all()
+    JobJournal.close_all()
+
+
+@pytest.fixture
+def shell(fake_slurm):
+    """IPython shell with the execution magics loaded."""
+    from IPython.core.interactiveshell import InteractiveShell
+    ip = InteractiveShell.instance()
+    ip.extension_manager.load_extension('execute_batch_scheduler.execute_magic')
+    return ip
@@ -0,0 +1,125 @@
+"""Tests of the job efficiency reports from sacct accounting."""
+import asyncio
+from subprocess import CalledProcessError
+
+import pytest
+
+import execute_batch_scheduler
+from execute_batch_scheduler import accounting
+from execute_batch_scheduler.accounting import parse_duration, parse_size
+from execute_batch_scheduler.backends import SlurmMgr
+
+
+@pytest.fixture
+def usage(fake_slurm, monkeypatch):
+    monkeypatch.setenv('FAKE_TOTAL_CPU', '120')
+    monkeypatch.setenv('FAKE_ELAPSED', '60')
+    monkeypatch.setenv('FAKE_MAX_RSS', '512M')
+    return fake_slurm
+
+
+def _queries(fake_slurm):
+    return [c for c in fake_slurm.calls('sacct') if 'TotalCPU' in ' '.join(c)]
+
+
+def test_parse():
+    assert parse_duration('1-02:03:04') == 93784
+    assert parse_duration('02:03:04') == 7384
+    assert parse_duration('03:04.500') == 184.5
+    assert parse_duration('2-05') == 2 * 86400 + 5 * 3600
+    assert parse_duration('') is None and parse_duration('INVALID') is None
+    assert parse_size('1234K') == 1234 * 1024
+    assert parse_size('100') == 100 * 1024
+    assert parse_size('4G') == 4 << 30
+    assert parse_size('2Gc', cpus=4) == 8 << 30
+    assert parse_size('4000Mn', nodes=2) == 8000 << 20
+    assert parse_size('') is None
+
+
+def test_efficiency_report(usage, capsys):
+    mgr = SlurmMgr(['-n', '4', '--mem=2G', '--efficiency'], '/bin/bash', {})
+    mgr.submit('true')
+    mgr.wait_progress()
+    out = capsys.readouterr().out
+    assert out.endswith("Job {0} COMPLETED: CPU 50.0% of 4 cores for 0:01:00, "
+                        "memory 512.0M of 2.0G (25.0%)\n".format(mgr._jobid))
+    report = mgr.efficiency[str(mgr._jobid)]
+    assert report['elapsed'] == 60 and report['total_cpu'] == 120
+    assert report['alloc_cpus'] == 4 and report['req_mem'] == 2 << 30
+    assert report['max_rss'] == report['max_vmsize'] == 512 << 20
+    assert report['cpu_efficiency'] == 50. and report['mem_efficiency'] == 25.
+    assert list(report['steps']) == ['batch']
+    assert len(_queries(usage)) == 1
+
+
+def test_accounting_lag(usage, capsys, monkeypatch):
+    # The usage of the steps is accounted after the job end
+    monkeypatch.setenv('FAKE_ACCT_LAG', '0.5')
+    mgr = SlurmMgr(['-n', '4', '--mem=2G', '--efficiency'], '/bin/bash', {})
+    mgr.submit('sleep 1')
+    mgr.wait_progress()
+    assert capsys.readouterr().out.endswith(
+        "Job {0} COMPLETED: CPU 50.0% of 4 cores for 0:01:00, "
+        "memory 512.0M of 2.0G (25.0%)\n".format(mgr._jobid))
+    assert list(mgr.efficiency[str(mgr._jobid)]['steps']) == ['batch']
+    assert len(_queries(usage)) > 1
+    # Bounded wait when the usage is never accounted
+    monkeypatch.setenv('FAKE_ACCT_LAG', '60')
+    monkeypatch.setattr(execute_batch_scheduler,
+                        '_DEFAULT_SLURM_EFFICIENCY_WAIT', 0.3)
+    mgr = SlurmMgr(['--efficiency'], '/bin/bash', {})
+    mgr.submit('true')
+    queries = len(_queries(usage))
+    mgr._efficiency_report()
+    assert 1 < len(_queries(usage)) - queries < 5
+    assert mgr.efficiency == {}
+    mgr.cancel()
+
+
+def test_no_report_by_default(usage, capsys, monkeypatch):
+    mgr = SlurmMgr(['--mem-per-cpu=1G', '-n', '2'], '/bin/bash', {})
+    mgr.submit('true')
+    mgr.wait_progress()
+    assert 'Job {0}'.format(mgr._jobid) not in capsys.readouterr().out
+    assert mgr.efficiency is None and not _queries(usage)
+    # Reports are still available on demand
+    report = mgr.get_efficiency()[str(mgr._jobid)]
+    assert report['req_mem'] == 2 << 30 and report['cpu_efficiency'] == 100.
+    # And for every job with the configuration
+    monkeypatch.setattr(execute_batch_scheduler, '_DEFAULT_SLURM_EFFICIENCY', True)
+    mgr = SlurmMgr([], '/bin/bash', {})
+    mgr.submit('true')
+    mgr.wait_progress(silent=True)
+    assert str(mgr._jobid) in mgr.efficiency
+    assert 'Job' not in capsys.readouterr().out
+
+
+def test_sweep_and_async(usage, capsys):
+    mgr = SlurmMgr(['--efficiency'], '/bin/bash', {})
+    mgr.set_sweep(['a', 'b'])
+    asyncio.run(mgr.run_async('echo $SWEEP_VALUE'))
+    assert list(mgr.efficiency) == ['{0}_0'.format(mgr._jobid),
+                                    '{0}_1'.format(mgr._jobid)]
+    # No display in background
+    assert 'Job' not in capsys.readouterr().out
+
+
+def test_unknown_usage(fake_slurm, capsys):
+    mgr = SlurmMgr(['--efficiency'], '/bin/bash', {})
+    mgr.submit('true')
+    mgr.wait_progress()
+    # Job too short for its CPU efficiency, without memory request
+    assert capsys.readouterr().out.endswith(
+        "Job {0} COMPLETED: CPU n/a of 1 cores for 0:00:00, memory 0.0K\n".format(
+            mgr._jobid))
+
+
+def test_accounting_failure(usage, capsys, monkeypatch):
+    def failing(cmd):
+        raise CalledProcessError(1, cmd)
+    monkeypatch.setattr(accounting, 'check_output', failing)
+    mgr = SlurmMgr(['--efficiency'], '/bin/bash', {})
+    mgr.submit('true')
+    mgr.wait_progress()
+    assert 'Accounting query failed' in capsys.readouterr().err
+    assert mgr.state == 'COMPLETED' and mgr.efficiency is None
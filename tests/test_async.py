@@ -0,0 +1,63 @@
+"""Tests of the asynchronous API of the backends."""
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from execute_batch_scheduler.backends import (BasicMgr, SlurmAllocation,
+                                              SlurmMgr, SSHMgr)
+
+
+async def _run_all(mgrs):
+    return await asyncio.gather(*[m.run_async('echo {0}'.format(i))
+                                  for i, m in enumerate(mgrs)])
+
+
+def test_run_concurrently(fake_slurm):
+    mgrs = [SlurmMgr([], '/bin/bash', {}) for _ in range(5)]
+    mgrs += [SSHMgr(['--host=node'], '/bin/bash', {}) for _ in range(2)]
+    mgrs.append(BasicMgr([], '/bin/bash', {}))
+    outputs = asyncio.run(_run_all(mgrs))
+    assert [out for out, _ in outputs] == \
+        ['{0}\n'.format(i) for i in range(len(mgrs))]
+    assert all(m.succeeded for m in mgrs)
+    assert len(fake_slurm.calls('sbatch')) == 5
+
+
+def test_cancel_slurm_job(fake_slurm):
+    mgr = SlurmMgr([], '/bin/bash', {})
+
+    async def run_and_cancel():
+        await mgr.submit_async('sleep 30')
+        task = asyncio.ensure_future(mgr.wait_async())
+        await asyncio.sleep(0.3)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+    asyncio.run(run_and_cancel())
+    assert [str(mgr._jobid)] in fake_slurm.calls('scancel')
+
+
+def test_wait_without_executor_threads(fake_slurm):
+    # Cells submitted synchronously are waited for from the loop, leaving
+    # the single executor thread free.
+    mgrs = [SlurmMgr(['--session=test-async'], '/bin/bash', {}),
+            SSHMgr(['--host=node'], '/bin/bash', {})]
+    for i, mgr in enumerate(mgrs):
+        mgr.submit('sleep 2; echo {0}'.format(i))
+
+    async def wait_all():
+        loop = asyncio.get_running_loop()
+        loop.set_default_executor(ThreadPoolExecutor(max_workers=1))
+        waits = asyncio.gather(*[m.wait_async() for m in mgrs])
+        await asyncio.sleep(0.2)
+        start = time.time()
+        await loop.run_in_executor(None, time.sleep, 0)
+        assert time.time() - start < 1
+        await waits
+
+    asyncio.run(wait_all())
+    assert [m.get_output()[0] for m in mgrs] == ['0\n', '1\n']
+    SlurmAllocation.get('test-async').release()
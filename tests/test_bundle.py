@@ -0,0 +1,19 @@
+"""Tests of cell bundles."""
+
+
+def test_bundle_steps(shell, fake_slurm):
+    shell.run_cell_magic('execute', '--wlm slurm --bundle=t --amgr a', 'echo a')
+    shell.run_cell_magic('execute', '--wlm slurm --bundle=t --amgr b',
+                         'echo b >&2; exit 3')
+    assert not fake_slurm.calls('sbatch')
+    shell.run_line_magic('execute_flush', '--name=t -n 1')
+    assert len(fake_slurm.calls('sbatch')) == 1
+    assert len(fake_slurm.calls('srun')) == 2
+    a, b = shell.user_ns['a'], shell.user_ns['b']
+    assert a.succeeded and a.get_output() == ('a\n', '')
+    assert b.state == 'FAILED' and b.get_output() == ('', 'b\n')
+
+
+def test_empty_bundle(shell, capsys):
+    shell.run_line_magic('execute_flush', '--name=empty')
+    assert "Bundle 'empty' is empty" in capsys.readouterr().err
@@ -0,0 +1,102 @@
+"""Tests of the result cache."""
+import os
+import time
+import asyncio
+
+from execute_batch_scheduler.cache import ResultCache, CachedMgr
+from execute_batch_scheduler.streams import OutputView
+
+
+def test_key(tmp_path):
+    cache = ResultCache(str(tmp_path / 'cache'))
+    data = tmp_path / 'data.txt'
+    data.write_text('a')
+    key = cache.key(b'#!/bin/bash\n', 'cat data.txt', ['sbatch'], [str(data)])
+    assert key == cache.key(b'#!/bin/bash\n', 'cat data.txt', ['sbatch'],
+                            [str(data)])
+    assert key != cache.key(b'#!/bin/bash\n', 'cat data.txt', ['sbatch', '-n2'],
+                            [str(data)])
+    data.write_text('ab')
+    assert key != cache.key(b'#!/bin/bash\n', 'cat data.txt', ['sbatch'],
+                            [str(data)])
+
+
+def test_key_input_content(tmp_path):
+    cache = ResultCache(str(tmp_path / 'cache'))
+    data = tmp_path / 'data.txt'
+    data.write_text('a')
+    key = cache.key(b'', 'cat data.txt', [], [str(data)])
+    # Touched input keeps the key
+    past = time.time() - 100
+    os.utime(str(data), (past, past))
+    assert key == cache.key(b'', 'cat data.txt', [], [str(data)])
+    # Rewritten input of the same size and times changes it
+    st = os.stat(str(data))
+    data.write_text('b')
+    os.utime(str(data), ns=(st.st_atime_ns, st.st_mtime_ns))
+    assert key != cache.key(b'', 'cat data.txt', [], [str(data)])
+
+
+def test_put_get(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    assert cache.get('k') is None
+    cache.put('k', 'out\n', OutputView(b'err\n'))
+    out, err = cache.get('k')
+    assert (str(out), str(err)) == ('out\n', 'err\n')
+
+
+def test_evict_expired(tmp_path):
+    cache = ResultCache(str(tmp_path), max_age=10.)
+    cache.put('old', 'x', '')
+    past = time.time() - 20
+    os.utime(str(tmp_path / 'old'), (past, past))
+    assert cache.get('old') is None
+    cache.put('new', 'x', '')
+    os.utime(str(tmp_path / 'new'), (past, past))
+    cache.evict()
+    assert os.listdir(str(tmp_path)) == []
+
+
+def test_evict_least_recently_used(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    for i, key in enumerate(('a', 'b', 'c')):
+        cache.put(key, 'x' * 1000, '')
+        t = time.time() - 100 + i
+        os.utime(str(tmp_path / key / 'out'), (t, t))
+    # Room for two entries
+    cache.max_size = 2500
+    # Reading a refreshes its access time, b is the least recently used
+    cache.get('a')
+    cache.put('d', 'x' * 1000, '')
+    assert sorted(os.listdir(str(tmp_path))) == ['a', 'd']
+
+
+def test_magic_replay(shell, fake_slurm, capsys, tmp_path, monkeypatch):
+    import execute_batch_scheduler
+    monkeypatch.setattr(execute_batch_scheduler, '_DEFAULT_CACHE_DIR',
+                        str(tmp_path / 'cache'))
+    for _ in range(2):
+        shell.run_cell_magic('execute', '--wlm slurm --cache', 'echo cached')
+        assert 'cached' in capsys.readouterr().out
+    assert len(fake_slurm.calls('sbatch')) == 1
+    shell.run_cell_magic('execute', '--wlm slurm --cache', 'exit 1')
+    shell.run_cell_magic('execute', '--wlm slurm --cache', 'exit 1')
+    # Failures are not cached
+    assert len(fake_slurm.calls('sbatch')) == 3
+
+
+def test_cached_mgr_base_state(shell, fake_slurm, capsys, tmp_path,
+                               monkeypatch):
+    import execute_batch_scheduler
+    monkeypatch.setattr(execute_batch_scheduler, '_DEFAULT_CACHE_DIR',
+                        str(tmp_path / 'cache'))
+    for _ in range(2):
+        shell.run_cell_magic('execute', '--wlm slurm --cache --amgr r',
+                             'echo cached')
+    mgr = shell.user_ns['r']
+    assert isinstance(mgr, CachedMgr)
+    assert mgr._shell == '/bin/bash' and mgr.trace.label == mgr.key[:12]
+    assert asyncio.run(mgr.run_async('echo cached')) == ('cached\n', '')
+    capsys.readouterr()
+    shell.run_line_magic('execute_trace', '--last')
+    assert 'CachedMgr' in capsys.readouterr().out
@@ -0,0 +1,60 @@
+"""Tests of the Slurm job dependencies."""
+import pytest
+
+from execute_batch_scheduler.backends import BasicMgr, SlurmMgr
+
+
+def _dependency(fake_slurm, index=-1):
+    args = fake_slurm.calls('sbatch')[index]
+    return [a for a in args if a.startswith('--dependency')]
+
+
+def test_pipeline(shell, fake_slurm, monkeypatch):
+    monkeypatch.setenv('FAKE_QUEUE_DELAY', '0.3')
+    shell.run_cell_magic('execute', '--wlm slurm --bg --amgr pre',
+                         'sleep 0.5\necho a > a.txt')
+    shell.run_cell_magic('execute', '--wlm slurm --bg --amgr sim --after pre',
+                         'cat a.txt')
+    shell.run_cell_magic('execute', '--wlm slurm --bg --amgr post '
+                         '--after pre:afterany,sim', 'echo done')
+    pre, sim, post = [shell.user_ns[n] for n in ('pre', 'sim', 'post')]
+    # The whole pipeline is queued at once
+    assert _dependency(fake_slurm, -2) == [
+        '--dependency=afterok:{0}'.format(pre._jobid)]
+    assert _dependency(fake_slurm) == ['--dependency=afterany:{0},afterok:{1}'
+                                       .format(pre._jobid, sim._jobid)]
+    assert post.graph is pre.graph is sim.graph
+    assert post.graph.states()[post._jobid] == 'PENDING'
+    shell.run_line_magic('jobs', '--wait --timeout=20')
+    assert post.graph.state == 'COMPLETED'
+    assert list(post.graph.states()) == [pre._jobid, sim._jobid, post._jobid]
+    assert sim.get_output()[0] == 'a\n'
+
+
+def test_failed_dependency(shell, fake_slurm):
+    shell.run_cell_magic('execute', '--wlm slurm --bg --amgr pre', 'exit 1')
+    shell.run_cell_magic('execute', '--wlm slurm --bg --amgr post --after pre',
+                         'echo never')
+    shell.run_line_magic('jobs', '--wait --timeout=20')
+    post = shell.user_ns['post']
+    assert post.state.startswith('CANCELLED')
+    assert post.graph.state == 'CANCELLED FAILED'
+    # Jobs over are not waited for
+    shell.run_cell_magic('execute', '--wlm slurm --amgr again --after pre:afterany',
+                         'true')
+    assert _dependency(fake_slurm) == []
+    assert shell.user_ns['again'].graph is post.graph
+
+
+def test_invalid_dependencies(shell, fake_slurm, capsys):
+    done = SlurmMgr([], '/bin/bash', {})
+    done.submit('exit 1')
+    done.wait_progress(silent=True)
+    mgr = SlurmMgr([], '/bin/bash', {})
+    for after in ([(done, 'afterok')], [(done, 'after')],
+                  [(BasicMgr([], '/bin/bash', {}), 'afterok')]):
+        with pytest.raises(ValueError):
+            mgr.set_dependency(after)
+    shell.run_cell_magic('execute', '--wlm slurm --after nope', 'true')
+    assert capsys.readouterr().err == \
+        "Invalid dependency: undefined variable 'nope'\n"
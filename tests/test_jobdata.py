@@ -0,0 +1,97 @@
+"""Tests of the object exchange between the namespace and the jobs."""
+import os
+import sys
+import mmap
+import pickle
+
+import pytest
+
+import execute_batch_scheduler
+from execute_batch_scheduler import jobdata
+
+
+class Blob(object):
+    """Object pickled with an out-of-band buffer."""
+
+    def __init__(self, data):
+        self.data = data
+
+    def __reduce_ex__(self, protocol):
+        return type(self), (pickle.PickleBuffer(self.data),)
+
+
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(execute_batch_scheduler, '_DEFAULT_DATA_DIR',
+                        str(tmp_path / 'data'))
+    return str(tmp_path / 'data')
+
+
+def test_round_trip(data_dir):
+    path = jobdata.new_dir()
+    assert os.path.dirname(path) == data_dir
+    jobdata.save('x', {'a': [1, 2]}, path)
+    assert jobdata.load('x', path) == {'a': [1, 2]}
+    jobdata.save('x', 'replaced', path)
+    assert os.listdir(path) == ['x.pkl']
+    assert jobdata.load('x', path) == 'replaced'
+    with pytest.raises(FileNotFoundError):
+        jobdata.load('y', path)
+    with pytest.raises(ValueError):
+        jobdata.save('../x', 1, path)
+
+
+def test_out_of_band_buffers(data_dir, monkeypatch):
+    path = jobdata.new_dir()
+    monkeypatch.setenv('EXECUTE_DATA_DIR', path)
+    jobdata.save('blob', Blob(bytearray(b'0123456789')))
+    assert sorted(os.listdir(path)) == ['blob.0.buf', 'blob.pkl']
+    blob = jobdata.load('blob')
+    # Buffer is a copy-on-write map of its file
+    assert isinstance(blob.data, mmap.mmap)
+    assert bytes(blob.data) == b'0123456789'
+    blob.data[0] = ord('x')
+    with open(os.path.join(path, 'blob.0.buf'), 'rb') as f:
+        assert f.read() == b'0123456789'
+
+
+def test_numpy_arrays(data_dir):
+    np = pytest.importorskip('numpy')
+    path = jobdata.new_dir()
+    jobdata.save('a', np.arange(10), path)
+    a = jobdata.load('a', path)
+    assert isinstance(a, np.memmap) and list(a) == list(range(10))
+
+
+JOB = """{0} - <<EOF
+import os, pickle
+d = os.environ['EXECUTE_DATA_DIR']
+x = pickle.load(open(os.path.join(d, 'x.pkl'), 'rb'))
+pickle.dump(x['a'] + 1, open(os.path.join(d, 'y.pkl'), 'wb'))
+EOF
+""".format(sys.executable)
+
+
+def test_push_and_pull(shell, data_dir, capsys):
+    shell.user_ns['x'] = {'a': 41}
+    shell.run_cell_magic('execute', '--wlm slurm --push x --pull y,z', JOB)
+    assert shell.user_ns['y'] == 42
+    assert "Variable 'z' was not saved by the job" in capsys.readouterr().err
+    # Data directory is removed once pulled
+    assert os.listdir(data_dir) == []
+
+
+def test_pull_in_background(shell, data_dir):
+    shell.user_ns['x'] = {'a': 1}
+    shell.user_ns.pop('y', None)
+    shell.run_cell_magic('execute', '--wlm slurm --bg --push x --pull y', JOB)
+    shell.run_line_magic('jobs', '--wait --timeout=10')
+    assert shell.user_ns['y'] == 2
+    assert os.listdir(data_dir) == []
+
+
+def test_rejected(shell, data_dir, capsys):
+    shell.run_cell_magic('execute', '--wlm slurm --push undefined_var', 'true')
+    assert capsys.readouterr().err == 'Undefined variables: undefined_var\n'
+    shell.run_cell_magic('execute', '--wlm slurm --cache --pull y', 'true')
+    assert 'cannot be exchanged' in capsys.readouterr().err
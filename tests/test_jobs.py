@@ -0,0 +1,50 @@
+"""Tests of the background cells registry."""
+import time
+
+from execute_batch_scheduler.backends import SlurmAllocation
+
+
+def _wait(predicate, timeout=10.):
+    end = time.time() + timeout
+    while time.time() < end:
+        if predicate():
+            return True
+        time.sleep(0.05)
+    return False
+
+
+def test_wait_and_output(shell):
+    for i in range(3):
+        shell.run_cell_magic('execute', '--wlm slurm --bg --amgr bg{0}'.format(i),
+                             'echo {0}'.format(i))
+    shell.run_line_magic('jobs', '--wait --timeout=10')
+    shell.run_line_magic('jobs', '')
+    registry = shell.find_magic('jobs').__self__._jobs
+    assert [j.status for j in registry.select()][-3:] == ['done'] * 3
+    outputs = registry.outputs(registry.select()[-3:])
+    assert [str(out) for out, _ in outputs] == ['0\n', '1\n', '2\n']
+    shell.run_line_magic('jobs', '--clear')
+    assert not registry.select()
+
+
+def test_cancel_slurm_job(shell, fake_slurm):
+    shell.run_cell_magic('execute', '--wlm slurm --bg --amgr bg', 'sleep 30')
+    job = shell.find_magic('jobs').__self__._jobs.select()[-1]
+    jobid = str(shell.user_ns['bg']._jobid)
+    shell.run_line_magic('jobs', '--cancel {0}'.format(job.id))
+    assert _wait(lambda: [jobid] in fake_slurm.calls('scancel'))
+    assert job.status == 'cancelled'
+
+
+def test_cancel_session_step(shell):
+    shell.run_cell_magic('execute', '--wlm slurm --session=test-bg --bg --amgr s',
+                         'sleep 30')
+    registry = shell.find_magic('jobs').__self__._jobs
+    job = registry.select()[-1]
+    step = shell.user_ns['s']
+    assert step.p.poll() is None
+    registry.cancel([job])
+    # The srun step is interrupted, releasing its executor thread
+    assert _wait(lambda: step.p.poll() is not None)
+    assert job.status == 'cancelled'
+    SlurmAllocation.get('test-bg').release()
@@ -0,0 +1,160 @@
+"""Tests of the job journal and of the %reattach magic."""
+import socket
+import sqlite3
+import subprocess
+
+import execute_batch_scheduler
+from execute_batch_scheduler.backends import SlurmMgr, SlurmBundle
+from execute_batch_scheduler.journal import JobJournal
+
+
+def _dead_pid():
+    p = subprocess.Popen(['true'])
+    p.wait()
+    return p.pid
+
+
+def _orphan(journal, jobids=None):
+    """Make jobs look left by a dead kernel."""
+    journal._execute('UPDATE jobs SET owner = ?, pid = ?' + (
+        '' if jobids is None else ' WHERE jobid IN ({0})'.format(
+            ','.join(str(j) for j in jobids))), ('dead', _dead_pid()))
+
+
+def _rows(journal):
+    return dict((r[0], r[1:]) for r in journal._execute(
+        'SELECT jobid, state, over, name, description FROM jobs'))
+
+
+def _submit(content, name=None):
+    mgr = SlurmMgr([], '/bin/bash', {})
+    mgr.set_label(name, content.splitlines()[0])
+    mgr.submit(content)
+    return mgr
+
+
+def test_record_and_finish(fake_slurm, monkeypatch):
+    journal = JobJournal.default()
+    assert journal.path == str(fake_slurm.dir).replace('slurm', 'journal.sqlite')
+    mgr = _submit('echo ok', 'job')
+    assert _rows(journal) == {mgr._jobid: ('PENDING', 0, 'job', 'echo ok')}
+    mgr.wait_progress(silent=True)
+    assert _rows(journal)[mgr._jobid][:2] == ('COMPLETED', 1)
+    # Jobs over are pruned once too old
+    monkeypatch.setattr(journal, 'max_age', 0)
+    other = _submit('true')
+    assert list(_rows(journal)) == [other._jobid]
+    # Disabled journal
+    monkeypatch.setattr(execute_batch_scheduler, '_DEFAULT_JOURNAL_FILE', '')
+    assert JobJournal.default() is None
+    _submit('true')
+    assert list(_rows(journal)) == [other._jobid]
+
+
+def test_orphans(tmp_path):
+    journal = JobJournal(str(tmp_path / 'journal.sqlite'))
+    for jobid in (1, 2, 3, 4):
+        journal.record(jobid, ['-N', '1'], '/bin/bash', 'out.%J', ['a', 'b'])
+    # Live kernel of this host, dead kernel, kernel of another host
+    journal._execute("UPDATE jobs SET owner = 'other' WHERE jobid = 2")
+    journal._execute("UPDATE jobs SET owner = 'other', pid = ? "
+                     "WHERE jobid = 3", (_dead_pid(), ))
+    journal._execute("UPDATE jobs SET owner = 'other', host = ? "
+                     "WHERE jobid = 4", (socket.gethostname() + '.other', ))
+    orphans = journal.orphans()
+    assert [j['jobid'] for j in orphans] == [3, 4]
+    assert orphans[0]['args'] == ['-N', '1'] and orphans[0]['sweep'] == ['a', 'b']
+    journal.adopt([3])
+    journal.finish(4, 'COMPLETED')
+    assert not journal.orphans()
+    journal.close()
+
+
+def test_reattach(fake_slurm, shell, capsys):
+    journal = JobJournal.default()
+    done = _submit('echo over', 'done')
+    fake_slurm.wait_state(done._jobid, ('COMPLETED', ))
+    running = _submit('sleep 0.5; echo later', 'running')
+    _orphan(journal)
+    for mgr in (done, running):
+        SlurmMgr._poller.unregister(mgr._jobid)
+    queries = len(fake_slurm.calls('sacct'))
+    capsys.readouterr()
+    shell.run_line_magic('reattach', '--wait')
+    out = capsys.readouterr().out
+    assert 'End batch job {0} Status: COMPLETED\n'.format(done._jobid) in out
+    assert '\nover\n' in out
+    assert 'Reattached batch job {0}: running: sleep 0.5'.format(
+        running._jobid) in out
+    assert out.endswith('later\n')
+    assert shell.user_ns['done'].state == 'COMPLETED'
+    assert shell.user_ns['running'].get_output()[0] == 'later\n'
+    assert all(over for _, over, _, _ in _rows(journal).values())
+    # The states of all the jobs are queried at once
+    first = fake_slurm.calls('sacct')[queries]
+    assert set(first[1].split(',')) >= {str(done._jobid), str(running._jobid)}
+    shell.run_line_magic('reattach', '')
+    assert capsys.readouterr().out == 'No job to reattach\n'
+
+
+def test_reattach_background(fake_slurm, shell, capsys):
+    journal = JobJournal.default()
+    mgr = _submit('sleep 0.3; echo bg', 'bg')
+    _orphan(journal)
+    shell.run_line_magic('reattach', '')
+    assert 'Background job' in capsys.readouterr().out
+    shell.run_line_magic('jobs', '--wait --output')
+    assert capsys.readouterr().out.endswith('bg: sleep 0.3; echo bg <==\nbg\n')
+    assert _rows(journal)[mgr._jobid][:2] == ('COMPLETED', 1)
+
+
+def test_reattach_unknown(fake_slurm, shell, capsys):
+    journal = JobJournal.default()
+    journal.record(999999, [], '/bin/bash',
+                   execute_batch_scheduler._DEFAULT_SLURM_OUTERR_FILE,
+                   name='gone', description='purged')
+    _orphan(journal)
+    shell.run_line_magic('reattach', '')
+    assert capsys.readouterr().out.startswith(
+        'End batch job 999999 Status: UNKNOWN\n')
+    assert shell.user_ns['gone']._is_terminated
+    assert _rows(journal)[999999][:2] == ('UNKNOWN', 1)
+
+
+def test_list_and_forget(fake_slurm, shell, capsys):
+    journal = JobJournal.default()
+    first, second = _submit('sleep 5', 'a'), _submit('sleep 5', 'b')
+    _orphan(journal)
+    shell.run_line_magic('reattach', '--list')
+    lines = capsys.readouterr().out.splitlines()
+    assert [l.split()[0] for l in lines] == [str(first._jobid),
+                                             str(second._jobid)]
+    assert lines[0].endswith('a          sleep 5')
+    shell.run_line_magic('reattach', '--forget {0}'.format(first._jobid))
+    assert capsys.readouterr().out == 'Forgot 1 jobs\n'
+    assert [j['jobid'] for j in journal.orphans()] == [second._jobid]
+    # Jobs are not cancelled
+    assert fake_slurm.state(first._jobid) != 'CANCELLED'
+    for mgr in (first, second):
+        mgr.cancel()
+
+
+def test_bundle_job_not_journaled(fake_slurm):
+    bundle = SlurmBundle('journal')
+    step = SlurmMgr([], '/bin/bash', {})
+    bundle.add(step, 'true')
+    job_mgr, _, _ = bundle.flush([], {})
+    assert job_mgr._jobid and not _rows(JobJournal.default())
+    job_mgr.wait_progress(silent=True)
+
+
+def test_journal_failure(fake_slurm, monkeypatch, capsys):
+    journal = JobJournal.default()
+
+    def broken(*args):
+        raise sqlite3.OperationalError('disk I/O error')
+    monkeypatch.setattr(journal, 'record', broken)
+    mgr = _submit('echo ok')
+    assert 'Job journal' in capsys.readouterr().err
+    mgr.wait_progress(silent=True)
+    assert mgr.get_output()[0] == 'ok\n' and not mgr._journaled
@@ -0,0 +1,121 @@
+"""Tests of the local process pool workload manager."""
+import os
+import asyncio
+
+import pytest
+
+from execute_batch_scheduler import backends
+from execute_batch_scheduler.backends import LocalMgr, LocalPool
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    """Pool of a single core, of its own for each test."""
+    pool = LocalPool(cpus=1)
+    monkeypatch.setattr(LocalMgr, '_pool', pool)
+    yield pool
+    pool.close()
+
+
+def test_run_pinned(pool):
+    mgr = LocalMgr(['-c', '1', '--jobid', 'job'], '/bin/bash', {})
+    out, _ = mgr.submit('echo $EXECUTE_CPUS $OMP_NUM_THREADS\nnproc\n')
+    assert out == 'Submitted local job {0}\n'.format(mgr._jobid)
+    mgr.wait_progress(silent=True)
+    assert mgr.state == 'COMPLETED' and mgr.succeeded
+    cores = ','.join(str(c) for c in pool.cpus)
+    assert mgr.get_output() == ('{0} 1\n1\n'.format(cores), '')
+    assert str(mgr.get_output_view()[0]) == '{0} 1\n1\n'.format(cores)
+    assert mgr._userns['job'] == mgr._jobid
+
+
+@pytest.mark.parametrize('taskset', [True, False])
+def test_affinity(pool, monkeypatch, taskset):
+    if not taskset:
+        monkeypatch.setattr(backends.shutil, 'which', lambda name: None)
+    elif backends.shutil.which('taskset') is None:
+        pytest.skip('taskset is not installed')
+    mgr = LocalMgr([], '/bin/bash', {})
+    mgr.submit('grep Cpus_allowed_list /proc/self/status\n')
+    assert ('taskset' in mgr.p.args[0]) == taskset
+    mgr.wait_progress(silent=True)
+    assert mgr.get_output()[0].split() == ['Cpus_allowed_list:',
+                                           str(pool.cpus[0])]
+
+
+def test_failed_job(pool):
+    mgr = LocalMgr([], '/bin/bash', {})
+    mgr.submit('echo oops >&2\nexit 3\n')
+    mgr.wait_progress(silent=True)
+    assert mgr.state == 'FAILED' and not mgr.succeeded
+    assert mgr.get_output() == ('', 'oops\n')
+
+
+def test_queue_until_cores_are_free(pool):
+    first, second = LocalMgr([], '/bin/bash', {}), LocalMgr([], '/bin/bash', {})
+    first.submit('sleep 0.5\necho first')
+    second.submit('echo second')
+    assert (first.state, second.state) == ('RUNNING', 'PENDING')
+    second.wait_progress(silent=True)
+    assert first.state == 'COMPLETED'
+    assert second.trace.first('running') >= first.trace.first('end')
+    assert second.get_output()[0] == 'second\n'
+
+
+def test_too_many_cores(pool):
+    mgr = LocalMgr(['-n', '2'], '/bin/bash', {})
+    out, err = mgr.submit('true')
+    assert err == 'Local job needs 2 cores, the pool holds 1\n'
+    assert mgr.state == 'FAILED'
+    mgr.wait_progress(silent=True)
+
+
+def test_cancel(pool):
+    running, queued = LocalMgr([], '/bin/bash', {}), LocalMgr([], '/bin/bash', {})
+    running.submit('sleep 30')
+    queued.submit('echo never')
+    queued.cancel()
+    assert queued.state == 'CANCELLED'
+    running.cancel()
+    running.wait_progress(silent=True)
+    assert running.state == 'CANCELLED'
+    assert not pool._running and not pool._queue
+    assert running.p.returncode == -15
+
+
+def test_run_async(pool):
+    mgrs = [LocalMgr([], '/bin/bash', {}) for _ in range(3)]
+
+    async def run_all():
+        return await asyncio.gather(*[m.run_async('echo {0}'.format(i))
+                                      for i, m in enumerate(mgrs)])
+
+    outputs = asyncio.run(run_all())
+    assert [out for out, _ in outputs] == ['0\n', '1\n', '2\n']
+
+
+def test_cancel_async(pool):
+    mgr = LocalMgr([], '/bin/bash', {})
+
+    async def run_and_cancel():
+        await mgr.submit_async('sleep 30')
+        task = asyncio.ensure_future(mgr.wait_async())
+        await asyncio.sleep(0.2)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        await asyncio.wrap_future(mgr._done)
+
+    asyncio.run(run_and_cancel())
+    assert mgr.state == 'CANCELLED'
+
+
+def test_magic(shell, pool, capsys):
+    shell.run_cell_magic('execute', '--wlm local -c 1 --amgr loc',
+                         'echo $EXECUTE_NTASKS')
+    out = capsys.readouterr().out
+    assert 'Submitted local job' in out
+    assert out.endswith('Status: COMPLETED\n1\n')
+    assert os.path.exists(shell.user_ns['loc']._files + '.sh')
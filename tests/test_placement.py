@@ -0,0 +1,79 @@
+"""Tests of the partition selection of --partition=auto."""
+import pytest
+
+import execute_batch_scheduler
+from execute_batch_scheduler.backends import SlurmMgr, SlurmStartEstimator
+
+
+@pytest.fixture
+def partitions(fake_slurm, monkeypatch):
+    monkeypatch.setenv('FAKE_PARTITIONS', 'debug,long,gpu')
+    monkeypatch.setenv('FAKE_PARTITION_START', 'debug:3600,long:60,gpu:0')
+    monkeypatch.setattr(SlurmMgr, '_estimator', SlurmStartEstimator())
+    return fake_slurm
+
+
+def _probes(fake_slurm):
+    return [c for c in fake_slurm.calls('sbatch') if '--test-only' in c]
+
+
+def _submissions(fake_slurm):
+    return [c for c in fake_slurm.calls('sbatch') if '--test-only' not in c]
+
+
+def test_split_partition():
+    for args in (['-p', 'x', '-N1'], ['--partition', 'x', '-N1'],
+                 ['--partition=x', '-N1'], ['-px', '-N1']):
+        assert SlurmMgr._split_partition(args) == (['-N1'], 'x')
+    assert SlurmMgr._split_partition(['-N1']) == (['-N1'], None)
+
+
+def test_auto_partition(partitions):
+    mgr = SlurmMgr(['--partition=auto:debug,long', '-N', '1'], '/bin/bash', {})
+    out, err = mgr.submit('echo ok')
+    assert mgr.partition == 'long'
+    assert list(mgr.partition_estimates) == ['debug', 'long']
+    assert out.startswith('Partition long selected, estimated start ')
+    assert '--partition=long' in _submissions(partitions)[-1]
+    mgr.wait_progress(silent=True)
+    assert mgr.get_output()[0] == 'ok\n'
+    # All the partitions listed by sinfo
+    mgr = SlurmMgr(['-p', 'auto'], '/bin/bash', {})
+    mgr.submit('true')
+    assert mgr.partition == 'gpu'
+    assert len(partitions.calls('sinfo')) == 1
+
+
+def test_estimates_cached(partitions, monkeypatch):
+    for _ in range(3):
+        mgr = SlurmMgr(['-p', 'auto'], '/bin/bash', {})
+        mgr.submit('true')
+    assert len(_probes(partitions)) == 3
+    assert len(_submissions(partitions)) == 3
+    # Other directives are probed again
+    mgr = SlurmMgr(['-p', 'auto'], '/bin/bash', {})
+    mgr.submit('#SBATCH --time=10\ntrue')
+    assert len(_probes(partitions)) == 6
+    monkeypatch.setattr(execute_batch_scheduler, '_DEFAULT_SLURM_AUTO_CACHE', 0)
+    mgr = SlurmMgr(['-p', 'auto'], '/bin/bash', {})
+    mgr.submit('true')
+    assert len(_probes(partitions)) == 9
+    assert len(partitions.calls('sinfo')) == 2
+
+
+def test_no_eligible_partition(partitions, monkeypatch):
+    monkeypatch.setattr(execute_batch_scheduler,
+                        '_DEFAULT_SLURM_AUTO_PARTITIONS', 'nope, other')
+    mgr = SlurmMgr(['-p', 'auto'], '/bin/bash', {})
+    out, err = mgr.submit('true')
+    assert err == "Partition auto: no eligible partition among 'nope,other'\n"
+    assert not mgr._is_started and mgr._is_terminated
+    assert not _submissions(partitions) and not partitions.calls('sinfo')
+
+
+def test_explicit_partition_untouched(partitions):
+    mgr = SlurmMgr(['-p', 'debug'], '/bin/bash', {})
+    mgr.submit('true')
+    assert mgr.partition is None
+    assert not _probes(partitions)
+    assert _submissions(partitions)[-1][2:4] == ['-p', 'debug']
@@ -0,0 +1,66 @@
+"""Tests of the shared Slurm state poller."""
+import subprocess
+
+from execute_batch_scheduler.backends import SlurmStatePoller
+
+
+def test_expand_tasks():
+    expand = SlurmStatePoller._expand_tasks
+    assert expand('3') == [3]
+    assert expand('[1,4-6%2]') == [1, 4, 5, 6]
+    assert expand('[0-2]') == [0, 1, 2]
+
+
+def test_parse_rows():
+    poller = SlurmStatePoller()
+    states = {'10': '', '11': ''}
+    tasks = {}
+    poller._parse('10|RUNNING', '|', states, tasks)
+    poller._parse('11_[2-3]|PENDING', '|', states, tasks)
+    poller._parse('11_0 COMPLETED', ' ', states, tasks)
+    poller._parse('12|FAILED', '|', states, tasks)
+    assert states == {'10': 'RUNNING', '11': ''}
+    assert tasks == {'11': {0: 'COMPLETED', 2: 'PENDING', 3: 'PENDING'}}
+
+
+def test_aggregate():
+    aggregate = SlurmStatePoller._aggregate
+    assert aggregate({0: 'COMPLETED', 1: 'COMPLETED'}) == 'COMPLETED'
+    assert aggregate({0: 'COMPLETED', 1: 'CANCELLED by 0'}) == \
+        'CANCELLED COMPLETED'
+    assert aggregate({0: 'COMPLETED', 1: 'RUNNING'}) == 'RUNNING'
+    assert aggregate({0: 'PENDING', 1: 'COMPLETED'}) == 'PENDING'
+
+
+def test_single_query_for_all_jobs(fake_slurm):
+    jobids = [fake_slurm.sbatch() for _ in range(3)]
+    for jobid in jobids:
+        fake_slurm.wait_state(jobid, ('COMPLETED',))
+    poller = SlurmStatePoller(tick=60.)
+    for jobid in jobids:
+        poller.register(jobid)
+    assert [poller.get_state(j) for j in jobids] == ['COMPLETED'] * 3
+    assert len(fake_slurm.calls('sacct')) == 1
+    assert not fake_slurm.calls('squeue')
+
+
+def test_squeue_fallback(fake_slurm, monkeypatch):
+    monkeypatch.setenv('FAKE_ACCT_LAG', '60')
+    monkeypatch.setenv('FAKE_QUEUE_DELAY', '60')
+    jobid = fake_slurm.sbatch()
+    poller = SlurmStatePoller(tick=0.)
+    assert poller.get_state(jobid) == 'PENDING'
+    assert len(fake_slurm.calls('squeue')) == 1
+    # Unknown job ids leave an empty state
+    assert poller.get_state('1') == ''
+    subprocess.check_call(['scancel', jobid])
+    # Out of the queue but not yet in accounting: unknown state
+    assert poller.get_state(jobid) == ''
+
+
+def test_no_query_without_jobs(fake_slurm):
+    poller = SlurmStatePoller(tick=0.)
+    poller.register('1000')
+    poller.unregister('1000')
+    poller.refresh()
+    assert not fake_slurm.calls()
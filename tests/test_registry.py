@@ -0,0 +1,68 @@
+"""Tests of the lazily imported backend registry."""
+import os
+import sys
+import subprocess
+import collections
+
+import pytest
+
+from execute_batch_scheduler import registry
+from execute_batch_scheduler.registry import BackendRegistry
+
+EntryPoint = collections.namedtuple('EntryPoint', 'name value')
+
+
+def test_extension_load_imports_no_backend():
+    tests = os.path.dirname(os.path.abspath(__file__))
+    code = ("import sys; sys.path.insert(0, {0!r}); import conftest\n"
+            "import execute_batch_scheduler.execute_magic\n"
+            "print('execute_batch_scheduler.backends' in sys.modules)\n"
+            .format(tests))
+    out = subprocess.check_output([sys.executable, '-c', code])
+    assert out.decode().split() == ['False']
+
+
+def test_builtin_backends():
+    from execute_batch_scheduler.backends import SSHMgr
+    backends = BackendRegistry()
+    assert backends.get('ssh') is SSHMgr
+    assert backends.loaded() == ['ssh']
+    with pytest.raises(KeyError):
+        backends.get('nope')
+
+
+def test_entry_points_on_miss(monkeypatch):
+    listed = []
+
+    def entry_points(group):
+        listed.append(group)
+        return [EntryPoint('coll', 'collections:OrderedDict'),
+                EntryPoint('ssh', 'collections:Counter'),
+                EntryPoint('broken', 'collections:Missing')]
+
+    monkeypatch.setattr(registry, '_entry_points', entry_points)
+    backends = BackendRegistry()
+    backends.get('slurm')
+    # Built-in backends are found without listing entry points
+    assert not listed
+    assert backends.get('coll') is collections.OrderedDict
+    assert listed == [BackendRegistry.group]
+    assert backends.get('ssh').__name__ == 'SSHMgr'
+    with pytest.raises(ImportError):
+        backends.get('broken')
+    assert backends.names() == ['', 'broken', 'coll', 'local', 'slurm', 'ssh']
+    assert listed == [BackendRegistry.group]
+
+
+def test_register():
+    backends = BackendRegistry()
+    backends.register('ordered', 'collections:OrderedDict')
+    assert 'ordered' not in backends.loaded()
+    assert backends.get('ordered') is collections.OrderedDict
+
+
+def test_unknown_backend(shell, capsys):
+    shell.run_cell_magic('execute', '--wlm nope', 'true')
+    err = capsys.readouterr().err
+    assert err.startswith("Unknown workload manager 'nope', available: ")
+    assert "'slurm'" in err
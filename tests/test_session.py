@@ -0,0 +1,69 @@
+"""Tests of held allocation sessions."""
+import os
+
+from execute_batch_scheduler.backends import SlurmMgr, SlurmAllocation
+
+
+def _run(mgr, content='echo step'):
+    mgr.submit(content)
+    mgr.wait_progress(silent=True)
+    return mgr
+
+
+def test_step_output(fake_slurm):
+    mgr = _run(SlurmMgr(['--session=test-output'], '/bin/bash', {}))
+    assert mgr.state == 'COMPLETED'
+    assert mgr.get_output() == ('step\n', '')
+    SlurmAllocation.get('test-output').release()
+
+
+def test_srun_error_in_output(fake_slurm, monkeypatch):
+    alloc = SlurmAllocation.get('test-srun-error')
+    # Allocation unknown to the scheduler
+    monkeypatch.setattr(alloc, 'jobid', lambda: 999)
+    mgr = _run(SlurmMgr(['--session=test-srun-error'], '/bin/bash', {}))
+    assert mgr.state == 'FAILED'
+    out, err = mgr.get_output_view()
+    assert 'srun: error: Unable to confirm allocation' in str(err)
+    assert 'srun: error' in mgr.get_output()[1]
+
+
+def test_unknown_state_keeps_allocation(fake_slurm, monkeypatch):
+    alloc = SlurmAllocation('test-unknown')
+    jobid = alloc.jobid()
+    with monkeypatch.context() as m:
+        m.setattr(SlurmMgr._poller, 'get_state',
+                  lambda jobid, max_age=None: '')
+        assert alloc.jobid() == jobid
+    assert len(fake_slurm.calls('salloc')) == 1
+    assert not fake_slurm.calls('scancel')
+    alloc.release()
+
+
+def test_ended_allocation_released(fake_slurm, monkeypatch):
+    alloc = SlurmAllocation('test-ended')
+    jobid = alloc.jobid()
+    with monkeypatch.context() as m:
+        m.setattr(SlurmMgr._poller, 'get_state',
+                  lambda jobid, max_age=None: 'TIMEOUT')
+        assert alloc.jobid() != jobid
+    assert fake_slurm.calls('scancel') == [[str(jobid)]]
+    assert len(fake_slurm.calls('salloc')) == 2
+    alloc.release()
+
+
+def test_iter_step_output(fake_slurm):
+    mgr = SlurmMgr(['--session=test-iter'], '/bin/bash', {})
+    mgr.submit('echo first; echo error >&2; echo second')
+    chunks = list(mgr)
+    assert ''.join(c for n, c in chunks if n == 'stdout') == 'first\nsecond\n'
+    assert ''.join(c for n, c in chunks if n == 'stderr') == 'error\n'
+    assert mgr._is_terminated and mgr.state == 'COMPLETED'
+    # The step is over for the allocation, whose idle timer is armed
+    alloc = SlurmAllocation.get('test-iter')
+    assert alloc._steps == 0 and alloc._timer is not None
+    assert not os.path.exists(mgr._step_files + '.sh')
+    mgr.wait_progress(silent=True)
+    assert alloc._steps == 0
+    assert mgr.get_output() == ('first\nsecond\n', 'error\n')
+    alloc.release()
@@ -0,0 +1,43 @@
+"""Tests of the Slurm workload manager against the stand-in scheduler."""
+from execute_batch_scheduler.backends import SlurmMgr
+
+CELL = '# Job setup\n#SBATCH --time=00:01:00\n\n#SBATCH -p debug\necho $SWEEP_VALUE\n'
+
+
+def _lines(script):
+    return script.decode().splitlines()
+
+
+def test_prologue_after_directives(fake_slurm):
+    mgr = SlurmMgr([], '/bin/bash', {})
+    lines = _lines(mgr._build_script(CELL, mgr._prologue()))
+    assert lines[0] == '#!/bin/bash '
+    assert lines[1:5] == CELL.splitlines()[:4]
+    assert lines[5].startswith('if [ -z "${EXECUTE_SENTINEL_CHILD')
+    assert lines[10] == 'fi'
+    assert lines[11:] == ['echo $SWEEP_VALUE']
+
+
+def test_sweep_prologue_after_directives(fake_slurm):
+    mgr = SlurmMgr([], '/bin/bash', {})
+    mgr.set_sweep(['a', 'b'])
+    lines = _lines(mgr._build_script(CELL, mgr._prologue()))
+    assert lines[1:5] == CELL.splitlines()[:4]
+    assert lines[5].startswith('SWEEP_VALUE=')
+    assert lines[-1] == 'echo $SWEEP_VALUE'
+
+
+def test_header_only_cell(fake_slurm):
+    mgr = SlurmMgr([], '/bin/bash', {})
+    lines = _lines(mgr._build_script('#SBATCH -n 1', b'true\n'))
+    assert lines == ['#!/bin/bash ', '#SBATCH -n 1', 'true']
+
+
+def test_sweep_run(fake_slurm):
+    mgr = SlurmMgr([], '/bin/bash', {})
+    mgr.set_sweep(['a', 'b', 'c'])
+    mgr.submit(CELL)
+    mgr.wait_progress(silent=True)
+    assert mgr.state == 'COMPLETED'
+    assert [mgr.get_task_output(t)[0].strip() for t in range(3)] == \
+        ['a', 'b', 'c']
@@ -0,0 +1,242 @@
+"""Tests of the slurmrestd transport against a stub HTTP server."""
+import json
+import time
+import threading
+import subprocess
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import execute_batch_scheduler
+from execute_batch_scheduler.backends import SlurmMgr
+from execute_batch_scheduler.slurmrest import (SlurmRestClient, SlurmRestError,
+                                               job_description)
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """slurmrestd stub running the submitted scripts at once, the jobs in
+    ``server.purged`` being only known by the accounting database."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super(StubHandler, self).setup()
+        self.server.connections += 1
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, data, code=200):
+        body = json.dumps(data).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        self.server.requests.append(('POST', self.path))
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        job = body['job']
+        jobid = 2000 + len(self.server.jobs)
+        env = dict(e.split('=', 1) for e in job['environment'])
+        path = job['standard_output'].replace('%J', str(jobid))
+        # Script run from a file, like the slurmd spooled copy
+        with open(path + '.sh', 'w') as f:
+            f.write(body['script'])
+        with open(path, 'w') as out, \
+                open(job['standard_error'].replace('%J', str(jobid)), 'w') as err:
+            p = subprocess.Popen(['bash', path + '.sh'], stdout=out,
+                                 stderr=err, env=env,
+                                 cwd=job['current_working_directory'])
+        self.server.jobs[jobid] = [p, None]
+        self._reply({'job_id': jobid, 'errors': []})
+
+    def _state(self, jobid):
+        p, state = self.server.jobs[jobid]
+        if state is None:
+            rc = p.poll()
+            state = 'RUNNING' if rc is None else (
+                'COMPLETED' if rc == 0 else 'FAILED')
+        return state
+
+    def do_GET(self):
+        self.server.requests.append(('GET', self.path))
+        if self.server.fail:
+            return self._reply({'errors': [{'error': 'Failure'}]},
+                               self.server.fail)
+        path, _, query = self.path.partition('?')
+        query = dict(q.split('=', 1) for q in query.split('&'))
+        if path.startswith('/slurmdb/'):
+            assert int(query['start_time']) < time.time()
+            jobs = [{'job_id': j, 'state': {'current': [self._state(j)]},
+                     'array': {'job_id': 0, 'task_id': {'set': False}}}
+                    for j in map(int, query['step'].split(','))
+                    if j in self.server.jobs]
+        else:
+            jobs = [{'job_id': j, 'job_state': [self._state(j)],
+                     'array_job_id': {'set': True, 'number': 0}}
+                    for j in map(int, query['job_id'].split(','))
+                    if j in self.server.jobs and j not in self.server.purged]
+        self._reply({'jobs': jobs, 'errors': []})
+
+    def do_DELETE(self):
+        self.server.requests.append(('DELETE', self.path))
+        jobid = int(self.path.rsplit('/', 1)[1])
+        if jobid not in self.server.jobs:
+            return self._reply({'errors': [{'error': 'Invalid job id'}]}, 404)
+        self.server.jobs[jobid][0].terminate()
+        self.server.jobs[jobid][1] = 'CANCELLED'
+        self._reply({'errors': []})
+
+
+@pytest.fixture
+def rest(fake_slurm, monkeypatch):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    server.connections, server.requests, server.jobs = 0, [], {}
+    server.purged, server.fail = set(), None
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    monkeypatch.setattr(SlurmRestClient, '_clients', {})
+    monkeypatch.setattr(execute_batch_scheduler, '_DEFAULT_SLURMREST_URL',
+                        'http://127.0.0.1:{0}'.format(server.server_address[1]))
+    yield server
+    SlurmRestClient.default().close()
+    server.shutdown()
+    server.server_close()
+    for p, _ in server.jobs.values():
+        p.kill()
+        p.wait()
+
+
+def test_job_description():
+    job = job_description(['-n', '1', '-n4', '--time=1-00:30:00', '--mem=2G',
+                           '-p', 'debug', '--kill-on-invalid-dep=yes'],
+                          {'A': '1'})
+    assert job['environment'] == ['A=1']
+    assert job['tasks'] == 4 and job['partition'] == 'debug'
+    assert job['time_limit'] == {'set': True, 'number': 1470}
+    assert job['memory_per_node'] == {'set': True, 'number': 2048}
+    assert job['kill_on_invalid_dependency'] is True
+    with pytest.raises(ValueError):
+        job_description(['--exclusive'], {})
+
+
+def test_job_states(monkeypatch):
+    client = SlurmRestClient('http://localhost:1')
+    monkeypatch.setattr(execute_batch_scheduler,
+                        '_DEFAULT_SLURMREST_DB_WINDOW', 0)
+    controller = {'jobs': [
+        {'job_id': 10, 'job_state': 'RUNNING', 'array_job_id': 0},
+        {'job_id': 11, 'job_state': ['COMPLETED'],
+         'array_job_id': {'set': True, 'number': 11},
+         'array_task_id': {'set': True, 'number': 0}},
+        {'job_id': 12, 'job_state': ['PENDING'],
+         'array_job_id': {'set': True, 'number': 11},
+         'array_task_id': {'set': False, 'number': 0},
+         'array_task_id_bitmap': '2-3'}]}
+    # Purged by the controller, still in the accounting database
+    accounting = {'jobs': [
+        {'job_id': 14, 'state': {'current': ['TIMEOUT']},
+         'array': {'job_id': 0, 'task_id': {'set': False}}},
+        {'job_id': 15, 'state': {'current': ['COMPLETED']},
+         'array': {'job_id': 14, 'task_id': {'set': True, 'number': 1}}}]}
+    paths = []
+
+    def request(method, path):
+        paths.append(path)
+        return accounting if path.startswith('/slurmdb/') else controller
+    client.request = request
+    states = [('10', 'RUNNING'), ('11_0', 'COMPLETED'),
+              ('11_[2-3]', 'PENDING'), ('14', 'TIMEOUT'),
+              ('14_1', 'COMPLETED')]
+    start = int(time.time())
+    assert client.job_states(['10', '11', '14', '16']) == states
+    # One request filtered on the polled jobs, one to the accounting
+    # database for the purged ones, from their first query
+    assert paths[0] == '/slurm/{version}/jobs/state?job_id=10,11,14,16'
+    path, _, query = paths[1].partition('?step=14,16&start_time=')
+    assert path == '/slurmdb/{version}/jobs' and start <= int(query)
+    # The job unknown by the accounting database is not searched again
+    del paths[:]
+    assert client.job_states(['10', '11', '14', '16']) == states
+    assert paths[1].startswith('/slurmdb/{version}/jobs?step=14&')
+    del paths[:]
+    assert client.job_states(['10', '11']) == states[:3]
+    assert paths == ['/slurm/{version}/jobs/state?job_id=10,11']
+
+    # Failed requests are not taken for unknown jobs
+    def unreachable(method, path):
+        raise SlurmRestError('Connection refused')
+    client.request = unreachable
+    with pytest.raises(SlurmRestError):
+        client.job_states(['10'])
+
+
+@pytest.mark.parametrize('status', [401, 500])
+def test_job_states_errors(rest, status):
+    rest.fail = status
+    with pytest.raises(SlurmRestError) as e:
+        SlurmRestClient.default().job_states(['2000'])
+    assert e.value.status == status
+
+
+def test_submit_and_wait(rest, fake_slurm):
+    mgrs = [SlurmMgr(['-N', '1'], '/bin/bash', {}) for _ in range(3)]
+    for i, mgr in enumerate(mgrs):
+        out, _ = mgr.submit('echo hello {0}'.format(i))
+        assert out == 'Submitted batch job {0}\n'.format(mgr._jobid)
+    for mgr in mgrs:
+        mgr.wait_progress(silent=True)
+    assert [m.state for m in mgrs] == ['COMPLETED'] * 3
+    assert [m.get_output()[0] for m in mgrs] == \
+        ['hello {0}\n'.format(i) for i in range(3)]
+    # No Slurm command, all the requests through one connection
+    assert not fake_slurm.calls()
+    assert rest.connections == 1
+    # States of all the jobs read at once, only from the controller
+    assert all(path.startswith('/slurm/v0.0.40/jobs/state?job_id=')
+               for method, path in rest.requests if method == 'GET')
+
+
+def test_purged_job(rest, fake_slurm):
+    mgr = SlurmMgr([], '/bin/bash', {})
+    mgr.submit('true')
+    rest.purged.add(mgr._jobid)
+    mgr.wait_progress(silent=True)
+    assert mgr.state == 'COMPLETED'
+    assert any(path.startswith('/slurmdb/v0.0.40/jobs?step={0}&'.format(
+        mgr._jobid)) for _, path in rest.requests)
+    assert not fake_slurm.calls()
+
+
+def test_cancel(rest, fake_slurm):
+    mgr = SlurmMgr([], '/bin/bash', {})
+    mgr.submit('sleep 30')
+    mgr.cancel()
+    mgr.wait_progress(silent=True)
+    assert mgr.state == 'CANCELLED'
+    assert ('DELETE', '/slurm/v0.0.40/job/{0}'.format(mgr._jobid)) \
+        in rest.requests
+    assert not fake_slurm.calls()
+
+
+def test_unsupported_option(rest):
+    mgr = SlurmMgr(['--exclusive'], '/bin/bash', {})
+    out, err = mgr.submit('true')
+    assert "option '--exclusive' is not supported" in err
+    assert mgr._is_terminated and not rest.requests
+
+
+def test_reconnect_and_errors(rest):
+    client = SlurmRestClient.default()
+    client.request('GET', '/slurm/{version}/jobs/state?job_id=1')
+    # Idle connection closed behind the client
+    client._idle[0].sock.close()
+    assert client.request('GET', '/slurm/{version}/jobs/state?job_id=1') == \
+        {'jobs': [], 'errors': []}
+    assert client.connections == 2
+    with pytest.raises(SlurmRestError) as e:
+        client.cancel(1)
+    assert 'Invalid job id' in str(e.value)
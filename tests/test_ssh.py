@@ -0,0 +1,272 @@
+"""Tests of the SSH workload manager against the stand-in ssh command."""
+import os
+import time
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from IPython.core.error import UsageError
+
+import execute_batch_scheduler
+from execute_batch_scheduler.backends import (SSHMasterPool, SSHMgr,
+                                              SSHSession,
+                                              expand_hostlist,
+                                              fold_hostlist)
+from execute_batch_scheduler.staging import Stager
+
+
+def test_run(fake_slurm):
+    mgr = SSHMgr(['--host=node'], '/bin/bash', {})
+    mgr.submit('echo out; echo err >&2')
+    mgr.wait_progress(silent=True)
+    assert mgr.succeeded
+    assert mgr.get_output() == ('out\n', 'err\n')
+
+
+def test_master_connection_reused(fake_slurm):
+    for _ in range(3):
+        mgr = SSHMgr(['--host=reused'], '/bin/bash', {})
+        mgr.submit('true')
+        mgr.wait_progress(silent=True)
+    masters = [c for c in fake_slurm.calls('ssh') if 'ControlMaster=yes' in c]
+    assert len(masters) == 1
+
+
+def test_large_output_display_bounded(shell, capsys, monkeypatch):
+    monkeypatch.setattr(execute_batch_scheduler, '_DEFAULT_OUTPUT_MAX_SIZE',
+                        10000)
+    monkeypatch.setattr(execute_batch_scheduler, '_DEFAULT_OUTPUT_HEAD_LINES', 5)
+    monkeypatch.setattr(execute_batch_scheduler, '_DEFAULT_OUTPUT_TAIL_LINES', 5)
+    shell.run_cell_magic('execute', '--wlm ssh --host=node --amgr s',
+                         'seq -w 100000000 100050000')
+    out = capsys.readouterr().out
+    assert len(out) < 3 * 10000
+    assert 'display truncated' in out
+    assert 'bytes omitted' in out
+    assert out.rstrip().endswith('100050000')
+    full, _ = shell.user_ns['s'].get_output_view(full=True)
+    assert len(full) == 50001
+
+
+@pytest.fixture
+def no_rsync(monkeypatch):
+    monkeypatch.setattr(execute_batch_scheduler, '_DEFAULT_SSH_RSYNC', False)
+
+
+def _run(args, content, host='node'):
+    mgr = SSHMgr((['--host=' + host] if host else []) + args, '/bin/bash', {})
+    mgr.submit(content)
+    mgr.wait_progress(silent=True)
+    return mgr
+
+
+def test_stage_and_fetch_incremental(fake_slurm, no_rsync, tmp_path):
+    (tmp_path / 'data').mkdir()
+    (tmp_path / 'data' / 'a.txt').write_text('a\n')
+    (tmp_path / 'data' / 'b.txt').write_text('b\n')
+    args = ['--stage=data', '--fetch=out']
+    content = 'mkdir -p out; cat data/*.txt > out/r.txt'
+    mgr = _run(args, content)
+    assert mgr.succeeded
+    assert mgr.staged == ['data/a.txt', 'data/b.txt']
+    assert mgr.fetched == ['out/r.txt']
+    assert (tmp_path / 'out' / 'r.txt').read_text() == 'a\nb\n'
+    assert (tmp_path / 'python-execute-work' / 'data' / 'a.txt').exists()
+    # Only the changed files move
+    (tmp_path / 'data' / 'b.txt').write_text('c\n')
+    mgr = _run(args, content)
+    assert (mgr.staged, mgr.fetched) == (['data/b.txt'], ['out/r.txt'])
+    assert (tmp_path / 'out' / 'r.txt').read_text() == 'a\nc\n'
+    mgr = _run(args, content)
+    assert (mgr.staged, mgr.fetched) == ([], [])
+
+
+def test_stage_errors(fake_slurm, no_rsync):
+    for path in ('../x', 'missing'):
+        mgr = SSHMgr(['--host=node', '--stage=' + path], '/bin/bash', {})
+        out, err = mgr.submit('true')
+        assert err.startswith('Staging failed:')
+        mgr.wait_progress(silent=True)
+        assert not mgr.succeeded
+        assert mgr.get_output() == ('', '')
+
+
+def test_rsync_command(monkeypatch):
+    monkeypatch.setattr(shutil, 'which', lambda name: '/usr/bin/' + name)
+    stager = Stager(['ssh', '-o', 'ControlPath=/tmp/a b', 'node'], 'work',
+                    rsync=True)
+    assert stager._rsync_cmd(['data'], 'node:work/') == [
+        '/usr/bin/rsync', '-a', '--relative', '--out-format=%n',
+        '--rsync-path=mkdir -p work && rsync',
+        '-e', "ssh -o 'ControlPath=/tmp/a b'", '--', 'data', 'node:work/']
+
+
+def test_no_remote_rsync(fake_slurm, monkeypatch, tmp_path):
+    # rsync found locally, but not on the remote host
+    monkeypatch.setattr(shutil, 'which', lambda name: '/usr/bin/' + name)
+    monkeypatch.setattr(Stager, '_remote_rsync', {})
+    monkeypatch.setenv('PATH', os.pathsep.join(
+        p for p in os.environ['PATH'].split(os.pathsep)
+        if not os.path.exists(os.path.join(p, 'rsync'))))
+    (tmp_path / 'in.txt').write_text('in\n')
+    stager = Stager(['ssh', 'node'], 'work', rsync=True)
+    assert stager.stage(['in.txt']) == ['in.txt']
+    (tmp_path / 'work' / 'out.txt').write_text('out\n')
+    assert stager.fetch(['out.txt']) == ['out.txt']
+    assert (tmp_path / 'out.txt').read_text() == 'out\n'
+    # The remote host is probed once
+    probes = [c for c in fake_slurm.calls('ssh') if 'command -v rsync' in ' '.join(c)]
+    assert len(probes) == 1
+
+
+def test_stage_magic(shell, no_rsync, tmp_path, capsys):
+    (tmp_path / 'in.txt').write_text('12345')
+    shell.run_cell_magic('execute', '--wlm ssh --host=node --stage=in.txt '
+                         '--fetch=res.txt --workdir=wd', 'wc -c < in.txt > res.txt')
+    out = capsys.readouterr().out
+    assert 'Staged 1 file(s) to wd' in out and 'Fetched 1 file(s)' in out
+    assert (tmp_path / 'res.txt').read_text().strip() == '5'
+
+
+@pytest.fixture
+def sessions(fake_slurm):
+    yield SSHSession._sessions
+    SSHSession.close_all()
+
+
+def _workers(fake_slurm):
+    return [c for c in fake_slurm.calls('ssh') if 'exec' in c]
+
+
+def test_session_keeps_environment(fake_slurm, sessions):
+    _run(['--session'], 'export FOO=bar; cd /tmp; x=1')
+    mgr = _run(['--session'], 'echo $FOO $PWD $x; echo err >&2')
+    assert mgr.succeeded
+    assert mgr.get_output() == ('bar /tmp 1\n', 'err\n')
+    mgr = _run(['--session'], 'false')
+    assert not mgr.succeeded
+    mgr = _run(['--session'], 'seq 1 100000')
+    assert mgr.get_output()[0] == ''.join('{0}\n'.format(i)
+                                          for i in range(1, 100001))
+    # Other sessions have their own shell
+    mgr = _run(['--session=other'], 'echo ${FOO:-unset}')
+    assert mgr.get_output()[0] == 'unset\n'
+    assert len(_workers(fake_slurm)) == 2
+
+
+def test_session_restarted_after_exit(fake_slurm, sessions):
+    mgr = _run(['--session'], 'exit 2')
+    assert not mgr.succeeded
+    assert 'SSH session ended' in mgr.get_output()[1]
+    mgr = _run(['--session'], 'echo again')
+    assert mgr.get_output() == ('again\n', '')
+    assert len(_workers(fake_slurm)) == 2
+
+
+def test_session_cancel(fake_slurm, sessions):
+    mgr = SSHMgr(['--host=node', '--session'], '/bin/bash', {})
+    mgr.submit('sleep 30')
+    end = time.time() + 10
+    while mgr._session.pid is None and time.time() < end:
+        time.sleep(0.05)
+    mgr.cancel()
+    mgr.wait_progress(silent=True)
+    assert not mgr.succeeded
+    assert time.time() < end
+
+
+def test_session_staged_workdir(fake_slurm, sessions, no_rsync, tmp_path):
+    (tmp_path / 'in.txt').write_text('x')
+    for _ in range(2):
+        mgr = _run(['--session', '--stage=in.txt', '--workdir=wd'],
+                   'cat in.txt; pwd')
+        out = mgr.get_output()[0]
+        assert out.startswith('x') and out.rstrip().endswith('/wd')
+
+
+def test_session_background(shell, sessions):
+    shell.run_cell_magic('execute', '--wlm ssh --host=node --session --bg '
+                         '--amgr a', 'echo hi')
+    shell.run_line_magic('jobs', '--wait --timeout=20')
+    assert shell.user_ns['a'].get_output() == ('hi\n', '')
+
+
+def test_hostlist():
+    hosts = expand_hostlist('node[001-003,007],login,r[1-2]n[1-2],login')
+    assert hosts == ['node001', 'node002', 'node003', 'node007', 'login',
+                     'r1n1', 'r1n2', 'r2n1', 'r2n2']
+    assert fold_hostlist(hosts) == \
+        'node[001-003,007],login,r1n[1-2],r2n[1-2]'
+    for spec in ('node[1-', 'node[a-b]', ',', 'n[1-2]]'):
+        with pytest.raises(ValueError):
+            expand_hostlist(spec)
+
+
+def test_fanout_gathered(fake_slurm):
+    mgr = _run(['--hosts=node[001-004]', '--host-timeout=1'],
+               'case $FAKE_SSH_HOST in node003) echo other; exit 3;; '
+               'node004) sleep 30;; esac; echo same', host=None)
+    assert not mgr.succeeded
+    out, err = mgr.get_output()
+    assert out == ('---------------\nnode[001-002] (2)\n---------------\n'
+                   'same\n'
+                   '---------------\nnode003 (1)\n---------------\nother\n')
+    assert err == 'node003: exited with status 3\n' \
+        'node004: timed out after 1s\n'
+    assert [r[0] for r in mgr.results.values()] == [0, 0, 3, None]
+
+
+def test_fanout_limit(fake_slurm):
+    start = time.time()
+    mgr = _run(['--hosts=n[1-4]', '--fanout=2'], 'sleep 0.5', host=None)
+    elapsed = time.time() - start
+    assert mgr.succeeded
+    assert 0.9 < elapsed < 1.9
+    assert all(r[3] >= 0.5 for r in mgr.results.values())
+
+
+def test_hosts_conflicts(fake_slurm):
+    for args in (['--hosts=n1', '--session'], ['--hosts=n1', '--host=n2'],
+                 ['--hosts=n[1-']):
+        with pytest.raises(UsageError):
+            SSHMgr(args, '/bin/bash', {})
+
+
+def test_hosts_magic(shell, capsys):
+    shell.run_cell_magic('execute', '--wlm ssh --hosts=n[1-3] --amgr f',
+                         'echo up')
+    out = capsys.readouterr().out
+    assert 'SSH started on 3 hosts: n[1-3]' in out
+    assert '\nn[1-3] (3)\n---------------\nup\n' in out
+    assert shell.user_ns['f'].succeeded
+
+
+def test_fanout_cancel(fake_slurm):
+    mgr = SSHMgr(['--hosts=n[1-3]', '--fanout=2'], '/bin/bash', {})
+    mgr.submit('sleep 30')
+    end = time.time() + 10
+    while len(mgr._fanout._procs) < 2 and time.time() < end:
+        time.sleep(0.05)
+    mgr.cancel()
+    mgr.wait_progress(silent=True)
+    assert time.time() < end
+    assert mgr.get_output()[1] == 'n[1-2]: killed by signal 9\nn3: not run\n'
+
+
+def test_master_started_on_submit(fake_slurm, monkeypatch):
+    monkeypatch.setattr(SSHMgr, '_masters', SSHMasterPool())
+    mgrs = [SSHMgr(['--host=lazy{0}'.format(i)], '/bin/bash', {})
+            for i in range(3)]
+    assert not fake_slurm.calls('ssh')
+    # Masters of different hosts start concurrently
+    monkeypatch.setenv('FAKE_SSH_DELAY', '1')
+    start = time.time()
+    with ThreadPoolExecutor(3) as pool:
+        list(pool.map(lambda m: m.submit('true'), mgrs))
+    assert time.time() - start < 2
+    for mgr in mgrs:
+        mgr.wait_progress(silent=True)
+        assert mgr.succeeded
+    masters = [c for c in fake_slurm.calls('ssh') if 'ControlMaster=yes' in c]
+    assert len(masters) == 3
+    SSHMgr._masters.close()
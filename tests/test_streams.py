@@ -0,0 +1,153 @@
+"""Tests of output followers and views, and of Slurm job streaming."""
+import os
+import sys
+import random
+
+import pytest
+
+from execute_batch_scheduler.backends import SlurmMgr
+from execute_batch_scheduler.streams import FileFollower, OutputView, Spool
+
+# Job writing its output in two parts, the second one once the first one
+# is seen
+GATED = ('echo first\nwhile [ ! -e go ]; do sleep 0.05; done\n'
+         'echo second; echo error >&2\n')
+
+
+def _text(n, end='\n'):
+    return ''.join('line {0}\n'.format(i) for i in range(n))[:-1] + end
+
+
+@pytest.mark.parametrize('end', ['\n', ''])
+def test_view_lines(end, monkeypatch):
+    # Small stride to cross index blocks
+    monkeypatch.setattr(OutputView, '_stride', 7)
+    text = _text(100, end)
+    lines = text.splitlines()
+    view = OutputView(text.encode())
+    assert len(view) == 100
+    assert view[0] == 'line 0' and view[-1] == 'line 99'
+    assert view[42] == 'line 42' and view[-30] == lines[-30]
+    assert view[10:30] == lines[10:30]
+    assert view[95:200] == lines[95:]
+    assert view[::10] == lines[::10]
+    assert list(view) == lines
+    assert str(view) == text
+    with pytest.raises(IndexError):
+        view[100]
+    with pytest.raises(IndexError):
+        view[-101]
+
+
+def test_view_random_access(monkeypatch):
+    monkeypatch.setattr(OutputView, '_stride', 5)
+    rng = random.Random(0)
+    lines = ['x' * rng.randint(0, 20) for _ in range(300)]
+    view = OutputView(('\n'.join(lines) + '\n').encode())
+    for _ in range(200):
+        i = rng.randint(-300, 299)
+        assert view[i] == lines[i]
+        j = rng.randint(0, 310)
+        assert view[abs(i):j] == lines[abs(i):j]
+
+
+def test_view_head_tail():
+    view = OutputView(_text(10).encode())
+    assert view.head(2) == 'line 0\nline 1\n'
+    assert view.tail(2) == 'line 8\nline 9\n'
+    assert view.tail(0) == ''
+    assert view.tail(20) == _text(10)
+
+
+def test_view_summary():
+    text = _text(1000)
+    view = OutputView(text.encode())
+    assert view.summary(len(text), 3, 3) == text
+    summary = view.summary(200, 3, 3)
+    assert summary.startswith('line 0\nline 1\nline 2\n[... ')
+    assert summary.endswith(' bytes omitted ...]\nline 997\nline 998\nline 999\n')
+
+
+def test_view_file(tmp_path):
+    path = tmp_path / 'out'
+    path.write_bytes('é\n'.encode() * 3)
+    view = OutputView(str(path), offset=3)
+    assert len(view) == 2 and view.size == 6
+    assert OutputView(str(tmp_path / 'missing')).size == 0
+
+
+def test_follower_split_character(tmp_path):
+    path = tmp_path / 'out'
+    path.write_bytes('aé'.encode())
+    follower = FileFollower(str(path), chunk_size=2)
+    assert follower.read() == 'a'
+    assert follower.read() == 'é'
+    assert follower.read() == ''
+
+
+def test_spool_view():
+    spool = Spool()
+    spool.append(b'a\nb\n')
+    assert str(spool.view(2)) == 'b\n'
+    assert ''.join(spool.follower().chunks()) == 'a\nb\n'
+
+
+class _Cell(object):
+    """Cell output releasing the gated job once its first part is shown."""
+
+    def __init__(self, fake_slurm):
+        self.fake_slurm, self.text, self.running = fake_slurm, '', None
+
+    def write(self, text):
+        self.text += text
+        if 'first\n' in text:
+            jobid = self.text.split('Submitted batch job ')[-1].split()[0]
+            self.running = self.fake_slurm.state(jobid) == 'RUNNING'
+            open('go', 'w').close()
+
+    def flush(self):
+        pass
+
+
+def test_stream_magic(shell, fake_slurm, monkeypatch):
+    cell = _Cell(fake_slurm)
+    monkeypatch.setattr(sys, 'stdout', cell)
+    shell.run_cell_magic('execute', '--wlm slurm --stream --amgr job', GATED)
+    monkeypatch.undo()
+    # First part displayed while the job runs
+    assert cell.running
+    assert 'first\nsecond\n' in cell.text
+    job = shell.user_ns['job']
+    assert job.state == 'COMPLETED'
+    # Nothing left to display, the full output is still available
+    assert job.get_output() == ('', '')
+    out, err = job.get_output_view(full=True)
+    assert str(out) == 'first\nsecond\n' and str(err) == 'error\n'
+
+
+def test_stream_remainder(fake_slurm):
+    mgr = SlurmMgr(['--stream'], '/bin/bash', {})
+    mgr.submit('echo shown')
+    mgr.wait_progress()
+    with open(mgr._job_files() + '.out', 'a') as f:
+        f.write('late\n')
+    assert mgr.get_output() == ('late\n', '')
+
+
+def test_iter_output(fake_slurm):
+    mgr = SlurmMgr([], '/bin/bash', {})
+    mgr.submit(GATED)
+    chunks, running = [], None
+    for name, chunk in mgr:
+        chunks.append((name, chunk))
+        if chunk == 'first\n':
+            running = fake_slurm.state(mgr._jobid) == 'RUNNING'
+            open('go', 'w').close()
+    assert running
+    assert ''.join(c for n, c in chunks if n == 'stdout') == 'first\nsecond\n'
+    assert ''.join(c for n, c in chunks if n == 'stderr') == 'error\n'
+    # The job is over, and no longer queried
+    assert mgr._is_terminated and mgr.state == 'COMPLETED'
+    assert str(mgr._jobid) not in SlurmMgr._poller._jobids
+    assert not os.path.exists(mgr._job_files() + '.done')
+    assert mgr.get_output() == ('first\nsecond\n', 'error\n')
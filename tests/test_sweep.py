@@ -0,0 +1,33 @@
+"""Tests of parameter sweeps."""
+import pytest
+
+from execute_batch_scheduler.backends import SlurmMgr, parse_sweep
+
+
+def test_parse_sweep():
+    assert parse_sweep('1-3') == ['1', '2', '3']
+    assert parse_sweep('0-10:5') == ['0', '5', '10']
+    assert parse_sweep('-2--1') == ['-2', '-1']
+    assert parse_sweep(' 0.1, 0.5 ,2') == ['0.1', '0.5', '2']
+    assert parse_sweep('a') == ['a']
+
+
+@pytest.mark.parametrize('spec', ['1-5:0', '5-1', '', ' , '])
+def test_parse_invalid_sweep(spec):
+    with pytest.raises(ValueError):
+        parse_sweep(spec)
+
+
+def test_empty_sweep(fake_slurm):
+    with pytest.raises(ValueError):
+        SlurmMgr([], '/bin/bash', {}).set_sweep([])
+
+
+@pytest.mark.parametrize('line, error', [
+    ('--sweep=5-1', 'Invalid parameter sweep'),
+    ('--sweep=1-5:0', 'Invalid parameter sweep'),
+    ('--sweep=1-2 --bundle', 'cannot be bundled')])
+def test_magic_rejects_sweep(shell, fake_slurm, capsys, line, error):
+    shell.run_cell_magic('execute', '--wlm slurm ' + line, 'true')
+    assert error in capsys.readouterr().err
+    assert not fake_slurm.calls('sbatch')
@@ -0,0 +1,81 @@
+"""Tests of the execution traces."""
+import json
+
+import pytest
+
+from execute_batch_scheduler.backends import BasicMgr
+from execute_batch_scheduler.trace import Trace, TraceLog
+
+
+def test_summary():
+    trace = Trace('Mgr')
+    for phase, t in (('submit', 0.), ('submitted', 1.), ('running', 3.),
+                     ('end', 6.)):
+        trace.mark(phase, t)
+    assert not trace.mark('end', 7.)
+    assert trace.summary() == {'submission': 1., 'queue': 2., 'run': 3.,
+                               'total': 6.}
+
+
+def test_nested_spans():
+    trace = Trace('Mgr')
+    with trace.span('output'):
+        with trace.span('output'):
+            pass
+    with trace.span('output'):
+        pass
+    assert len(trace.spans('output')) == 2
+    assert set(trace.summary()) == {'output'}
+
+
+def test_bounded_events():
+    trace = Trace('Poller', maxlen=10)
+    for _ in range(100):
+        with trace.span('sacct'):
+            pass
+    assert len(trace.events) == 10
+    trace.clear()
+    assert not trace.events
+
+
+def test_aggregate_and_eviction():
+    log = TraceLog(maxlen=3)
+    attached = Trace('Poller', maxlen=5)
+    log.attach(attached)
+    for i in range(5):
+        trace = log.new('Mgr')
+        trace.mark('submit', 0.)
+        trace.mark('end', float(i))
+    assert len(log.all()) == 4
+    stats = log.aggregate()
+    assert stats['Mgr', 'total'] == {'count': 3, 'total': 9., 'mean': 3.,
+                                     'max': 4.}
+    log.clear()
+    assert log.all() == [attached]
+
+
+@pytest.mark.parametrize('fmt', ['chrome', 'jsonl'])
+def test_export(tmp_path, fmt):
+    log = TraceLog()
+    trace = log.new('Mgr')
+    trace.mark('submit', 1.)
+    trace.mark('end', 2.)
+    path = str(tmp_path / 'trace')
+    log.export(path, fmt)
+    with open(path) as f:
+        if fmt == 'chrome':
+            names = [e['name'] for e in json.load(f)['traceEvents']]
+            assert names == ['thread_name', 'submit', 'end']
+        else:
+            assert [json.loads(l)['phase'] for l in f] == ['submit', 'end']
+
+
+def test_basic_mgr_phases():
+    mgr = BasicMgr([], '/bin/bash', {})
+    mgr.submit('sleep 0.3')
+    phases = mgr.trace.summary()
+    # The run is not accounted in the submission
+    assert phases['submission'] < 0.2
+    assert phases['run'] >= 0.3
+    assert abs(phases['total'] - phases['submission'] - phases['queue'] -
+               phases['run']) < 1e-6
@@ -0,0 +1,95 @@
+"""Tests of the file watcher and of the sentinel-triggered job end."""
+import os
+import sys
+import json
+import time
+import asyncio
+import threading
+
+import pytest
+
+import execute_batch_scheduler
+from execute_batch_scheduler import watch
+from execute_batch_scheduler.backends import SlurmMgr
+from execute_batch_scheduler.watch import FileWatcher
+
+
+def _touch_later(path, delay):
+    def touch():
+        time.sleep(delay)
+        with open(path + '.tmp', 'w') as f:
+            f.write('x')
+        os.rename(path + '.tmp', path)
+    thread = threading.Thread(target=touch)
+    thread.start()
+    return thread
+
+
+@pytest.mark.parametrize('inotify', [True, False])
+def test_file_watcher(tmp_path, monkeypatch, inotify):
+    if not inotify:
+        monkeypatch.setattr(watch, '_libc', False)
+    path = str(tmp_path / 'file')
+    watcher = FileWatcher([path], stat_interval=5. if inotify else 0.05)
+    if inotify and not watcher.uses_inotify:
+        pytest.skip('inotify is not available')
+    assert watcher.wait(0.1) == set()
+    thread = _touch_later(path, 0.2)
+    start = time.time()
+    assert watcher.wait(10.) == {path}
+    assert time.time() - start < 1.
+    thread.join()
+    # Changes are only reported once
+    assert watcher.wait(0.1) == set()
+    watcher.close()
+
+
+def _end_latency(fake_slurm, mgr):
+    """Time between the job end and the end of the wait."""
+    with open(os.path.join(fake_slurm.dir, 'jobs',
+                           '{0}.times'.format(mgr._jobid))) as f:
+        return time.time() - json.load(f)['end']
+
+
+def _queries(fake_slurm):
+    return len(fake_slurm.calls('sacct')) + len(fake_slurm.calls('squeue'))
+
+
+@pytest.mark.parametrize('wait_async', [False, True])
+def test_sentinel_end(fake_slurm, wait_async):
+    # Backoff grown to seconds when the job ends
+    mgr = SlurmMgr([], '/bin/bash', {})
+    mgr.submit('sleep 2.5')
+    if wait_async:
+        asyncio.run(mgr.wait_async())
+    else:
+        mgr.wait_progress(silent=True)
+    assert mgr._sentinel and mgr.state == 'COMPLETED'
+    assert _end_latency(fake_slurm, mgr) < 0.3
+    # Few queries while the job runs
+    assert _queries(fake_slurm) < 20
+    assert not os.path.exists(mgr._job_files() + '.done')
+
+
+def test_sentinel_with_cell_exit_trap(fake_slurm):
+    mgr = SlurmMgr([], '/bin/bash', {})
+    mgr.submit("trap 'echo cleanup' EXIT\nsleep 2.5\nexit 3\n")
+    mgr.wait_progress(silent=True)
+    assert mgr._sentinel and mgr.state == 'FAILED'
+    assert _end_latency(fake_slurm, mgr) < 0.3
+    assert mgr.get_output() == ('cleanup\n', '')
+
+
+@pytest.mark.parametrize('wait_async', [False, True])
+def test_fallback_poll(fake_slurm, monkeypatch, wait_async):
+    monkeypatch.setattr(execute_batch_scheduler,
+                        '_DEFAULT_SLURM_FALLBACK_POLL', 0.4)
+    # No sentinel for other shells
+    mgr = SlurmMgr([], sys.executable, {})
+    mgr.submit('import time\ntime.sleep(1)\n')
+    if wait_async:
+        asyncio.run(mgr.wait_async())
+    else:
+        mgr.wait_progress(silent=True)
+    assert not mgr._sentinel and mgr.state == 'COMPLETED'
+    assert _end_latency(fake_slurm, mgr) < 0.4 + 0.3